@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import instrument
+import regressions
+import storage
+
+# Bump when the way the factors are fitted changes, to refit them
+FACTORS_VERSION = '1'
+# Daily column adjusted for each regression type variable
+ADJUSTED_COLUMNS = {
+    'infection' : 'infection_day',
+    'hospital' : 'hospital_day',
+    'deaths' : 'dead_day'
+    }
+
+def regression_weekdays(params):
+    ''' Returns the fitted share of the week reported on each weekday
+    (monday first) from the coefficients of a weekday regression,
+    where the intercept is the share of the friday. '''
+    intercept = params.loc['Intercept']
+    return np.array([intercept if day == 'Friday' else
+        intercept + params.loc[f'C(weekday)[T.{day}]']
+        for day in regressions.WEEKDAYS])
+
+def fit_factors(dframe):
+    ''' Fits the weekday regressions of all adjusted variables, and
+    turns the fitted shares into correction factors: the factor of a
+    weekday scales its reported figure to what it would be if every
+    day of the week reported an equal share (1/7). Returns the
+    factors (monday first) by type variable. '''
+    results = regressions.day_contrib_reg_batch(dframe, list(ADJUSTED_COLUMNS))
+    factors = {}
+    for type_var, result in results.items():
+        shares = regression_weekdays(result.params['coef'])
+        factors[type_var] = list(1 / (7 * shares))
+    return factors
+
+def complete_weeks(dframe):
+    ''' Returns the number of complete weeks in the data, the last
+    one, and a hash of the figures of the complete weeks the factors
+    are fitted on. '''
+    shares = regressions.weekday_shares(dframe, list(ADJUSTED_COLUMNS))
+    hasher = hashlib.sha256()
+    hasher.update(pd.util.hash_pandas_object(shares.drop(columns='date'),
+        index=False).to_numpy().tobytes())
+    return shares.week_number.nunique(), shares.week_number.max(), hasher.hexdigest()
+
+def factors_path():
+    return os.path.join(os.getcwd(), 'data', 'weekday_factors.json')
+
+def load_factors(path=None):
+    path = path or factors_path()
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_factors(cached, path=None):
+    path = path or factors_path()
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cached, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+@instrument.timed('weekday_factors')
+def get_factors(dframe, path=None):
+    ''' Returns the weekday correction factors of the data, read from
+    the cache in data/ unless the complete weeks changed since they
+    were fitted (weeks were added, or their figures revised), in which
+    case they are fitted and cached again. '''
+    n_weeks, last_week, data_hash = complete_weeks(dframe)
+    cached = load_factors(path)
+    if (cached and cached['version'] == FACTORS_VERSION and
+            cached['complete_weeks'] == n_weeks and
+            cached['last_complete_week'] == last_week and
+            cached.get('data_hash') == data_hash):
+        return cached['factors']
+    print(f'Fitting weekday factors on {n_weeks} complete weeks.')
+    cached = {
+        'version' : FACTORS_VERSION,
+        'complete_weeks' : n_weeks,
+        'last_complete_week' : last_week,
+        'data_hash' : data_hash,
+        'factors' : fit_factors(dframe)
+        }
+    save_factors(cached, path)
+    return cached['factors']
+
+def adjust_for_weekday(dframe, factors):
+    ''' Returns the date and the daily figures of the merged data,
+    with the figures multiplied by the correction factor of their
+    weekday (<column>_adj) and the 7-day average of the adjusted
+    figures (<column>_adj_avg7). '''
+    dates = pd.to_datetime(dframe.date)
+    weekdays = dates.dt.dayofweek.to_numpy()
+    adjusted = pd.DataFrame({'date' : dates})
+    for type_var, column in ADJUSTED_COLUMNS.items():
+        adjusted[column] = dframe[column]
+        adjusted[f'{column}_adj'] = dframe[column].to_numpy() * np.asarray(
+            factors[type_var])[weekdays]
+    adjusted = adjusted.sort_values('date')
+    for column in ADJUSTED_COLUMNS.values():
+        adjusted[f'{column}_adj_avg7'] = adjusted[f'{column}_adj'].rolling(
+            7, min_periods=7).mean()
+    return adjusted
+
+def adjusted_stem():
+    return os.path.join(os.getcwd(), 'export_adjusted')
+
+def export_adjusted(adjusted, stem=None):
+    ''' Exports the adjusted figures next to export.csv, in the
+    configured storage format. '''
+    storage.write_frame(adjusted, stem or adjusted_stem())
+
+def adjustment_main(dframe, path=None, export=True):
+    ''' Adjusts the daily figures of the merged data for the weekday
+    reporting pattern, using the cached correction factors, and
+    exports the result unless export is disabled. '''
+    adjusted = adjust_for_weekday(dframe, get_factors(dframe, path))
+    if export:
+        export_adjusted(adjusted)
+    return adjusted
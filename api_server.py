@@ -0,0 +1,368 @@
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import getdata
+import storage
+import regressions
+import rapport_data
+
+API_HOST = os.environ.get('COVID_NL_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('COVID_NL_API_PORT', '8050'))
+# Seconds between checks of the exported files for a new version
+RELOAD_INTERVAL = 10
+COMPRESS_LEVEL = 6
+# Number of filtered responses cached per version
+QUERY_CACHE_SIZE = 256
+CONTENT_TYPES = {
+    'json' : 'application/json',
+    'csv' : 'text/csv; charset=utf-8',
+    'png' : 'image/png'
+    }
+# Column the date range of each dataset is filtered on
+DATE_COLUMNS = {
+    'merged' : 'date',
+    'testing' : 'start_dt',
+    'regression' : None
+    }
+
+def plot_dir():
+    return os.path.join(os.getcwd(), 'plots')
+
+def source_signature():
+    ''' Returns the paths, modification times, and sizes of the files
+    the served datasets are loaded from. '''
+    paths = [storage.frame_path(getdata.export_stem()),
+        storage.frame_path(rapport_data.test_data_stem())]
+    if os.path.isdir(plot_dir()):
+        paths += [os.path.join(plot_dir(), file_name) for file_name in
+            sorted(os.listdir(plot_dir())) if file_name.endswith('.png')]
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def load_datasets():
+    ''' Reads the exported merged data and GGD testing data, and fits
+    the weekday regressions on the merged data. Returns the datasets
+    found by name. '''
+    datasets = {}
+    merged = getdata.load_export()
+    if merged is not None:
+        datasets['merged'] = merged.reset_index(drop=True)
+        datasets['regression'] = regressions.results_frame(
+            regressions.day_contrib_reg_batch(datasets['merged']))
+    testing = rapport_data.load_test_data()
+    if testing is not None:
+        datasets['testing'] = testing
+    return datasets
+
+def load_plots():
+    ''' Returns the contents of the plots in plots/ by file name. '''
+    if not os.path.isdir(plot_dir()):
+        return {}
+    plots = {}
+    for file_name in sorted(os.listdir(plot_dir())):
+        if file_name.endswith('.png'):
+            with open(os.path.join(plot_dir(), file_name), 'rb') as f:
+                plots[file_name] = f.read()
+    return plots
+
+def encode_frame(dframe, data_format):
+    ''' Returns the dataframe as JSON records or CSV bytes, with the
+    dates written as YYYY-MM-DD. '''
+    dframe = dframe.copy()
+    for column in dframe.columns:
+        if pd.api.types.is_datetime64_any_dtype(dframe[column]):
+            dframe[column] = dframe[column].dt.strftime('%Y-%m-%d')
+    if data_format == 'json':
+        return dframe.to_json(orient='records').encode('utf-8')
+    return dframe.to_csv(index=False).encode('utf-8')
+
+class Response:
+    ''' A precomputed response body, along with its gzip compressed
+    version (unless compress is disabled) and an ETag. '''
+
+    def __init__(self, body, content_type, compress=True):
+        self.body = body
+        self.content_type = content_type
+        self.gzip_body = gzip.compress(body, COMPRESS_LEVEL) if compress else None
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+class DatasetVersion:
+    ''' An immutable set of the served datasets (dataframes by name)
+    and plots (PNG contents by file name). The full datasets are
+    encoded and compressed once when the version is created; filtered
+    responses are computed on first request and cached for the life
+    of the version. '''
+
+    def __init__(self, datasets, plots=None):
+        self.datasets = datasets
+        self.plots = plots or {}
+        self.created = time.strftime('%Y-%m-%dT%H:%M:%S')
+        hasher = hashlib.sha256()
+        for name, dframe in sorted(datasets.items()):
+            hasher.update(name.encode())
+            hasher.update(pd.util.hash_pandas_object(dframe, index=False).to_numpy().tobytes())
+        for file_name, body in sorted(self.plots.items()):
+            hasher.update(file_name.encode())
+            hasher.update(body)
+        self.id = hasher.hexdigest()[:12]
+        self.responses = {(name, data_format, None, None, None) :
+            Response(encode_frame(dframe, data_format), CONTENT_TYPES[data_format])
+            for name, dframe in datasets.items() for data_format in ['json', 'csv']}
+        self.plot_responses = {file_name : Response(body, CONTENT_TYPES['png'],
+            compress=False) for file_name, body in self.plots.items()}
+        self.index = Response(json.dumps(self.describe(), indent=4).encode('utf-8'),
+            CONTENT_TYPES['json'])
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def describe(self):
+        return {
+            'version' : self.id,
+            'created' : self.created,
+            'datasets' : {name : {
+                'rows' : len(dframe),
+                'columns' : list(dframe.columns),
+                'date_column' : DATE_COLUMNS.get(name),
+                'paths' : [f'/data/{name}.json', f'/data/{name}.csv']
+                } for name, dframe in self.datasets.items()},
+            'plots' : [f'/plots/{file_name}' for file_name in self.plots]
+            }
+
+    def query(self, name, data_format, start=None, end=None, columns=None):
+        ''' Returns the response holding the dataset in the inputted
+        format, with the rows from start up to and including end and
+        only the inputted columns. Raises KeyError for an unknown
+        dataset and ValueError for an invalid filter. '''
+        if name not in self.datasets or data_format not in ['json', 'csv']:
+            raise KeyError(name)
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        columns = None if columns is None else tuple(columns)
+        key = (name, data_format, start, end, columns)
+        response = self.responses.get(key)
+        if response is not None:
+            return response
+        with self._lock:
+            response = self._queries.get(key)
+            if response is not None:
+                self._queries.move_to_end(key)
+                return response
+        dframe = self.datasets[name]
+        if start is not None or end is not None:
+            date_column = DATE_COLUMNS.get(name)
+            if date_column is None:
+                raise ValueError(f'Dataset {name} has no date column')
+            dates = dframe[date_column]
+            rows = pd.Series(True, index=dframe.index)
+            if start is not None:
+                rows &= dates >= start
+            if end is not None:
+                rows &= dates <= end
+            dframe = dframe[rows]
+        if columns is not None:
+            unknown = [column for column in columns if column not in dframe.columns]
+            if unknown:
+                raise ValueError(f'Unknown column(s) of {name}: {", ".join(unknown)}')
+            dframe = dframe[list(columns)]
+        response = Response(encode_frame(dframe, data_format), CONTENT_TYPES[data_format])
+        with self._lock:
+            self._queries[key] = response
+            while len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return response
+
+def load_version():
+    ''' Returns a version holding the exported datasets and plots in
+    the current directory. '''
+    return DatasetVersion(load_datasets(), load_plots())
+
+class ApiServer:
+    ''' Read-only HTTP API serving the current dataset version:
+
+        /                       the version, datasets, and plots
+        /data/<name>.json|csv   a dataset, filtered with the query
+                                parameters start, end (YYYY-MM-DD), and
+                                columns (comma separated)
+        /plots/<file name>      a plot
+
+    Responses carry an ETag (answering conditional requests with 304)
+    and are sent gzip compressed to clients accepting it. publish
+    swaps in a new version at once: a request is answered entirely
+    from the version that was current when it arrived. '''
+
+    def __init__(self, host=API_HOST, port=API_PORT, version=None):
+        self.host = host
+        self.port = port
+        self.version = version
+        self.request_count = 0
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def url(self, path=''):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def publish(self, version):
+        self.version = version
+        print(f'Serving version {version.id} ({", ".join(version.datasets)}).')
+
+    def reload(self):
+        ''' Loads and publishes a new version if the exported files
+        changed since the last one was loaded. Returns whether it did. '''
+        signature = source_signature()
+        if signature == self._signature:
+            return False
+        self.publish(load_version())
+        self._signature = signature
+        return True
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        ''' Checks the exported files every interval seconds, reloading
+        once they changed and then stayed the same for one interval
+        (so a version is not loaded while the pipeline is still
+        writing its outputs). '''
+        previous = source_signature()
+        while not self._stop.wait(interval):
+            signature = source_signature()
+            if signature == previous and signature != self._signature:
+                try:
+                    self.reload()
+                except Exception as error:
+                    print(f'Reloading failed, keeping version '
+                        f'{self.version.id if self.version else None}: {error}')
+            previous = signature
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # The headers and body are written separately, which would
+            # otherwise wait on the delayed ACK of keep-alive clients
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                version = api.version
+                with api._lock:
+                    api.request_count += 1
+                url = urlsplit(self.path)
+                if version is None:
+                    self.send_error(503, 'No dataset version loaded')
+                    return
+                try:
+                    response = self.route(version, url.path, parse_qs(url.query))
+                except KeyError:
+                    self.send_error(404)
+                    return
+                except ValueError as error:
+                    self.send_error(400, str(error))
+                    return
+                self.send(version, response)
+
+            def route(self, version, path, query):
+                if path in ['', '/']:
+                    return version.index
+                if path.startswith('/plots/'):
+                    return version.plot_responses[path[len('/plots/'):]]
+                if not path.startswith('/data/'):
+                    raise KeyError(path)
+                name, _, data_format = path[len('/data/'):].rpartition('.')
+                params = {key : values[-1] for key, values in query.items()}
+                unknown = set(params) - {'start', 'end', 'columns'}
+                if unknown:
+                    raise ValueError(f'Unknown parameter(s): {", ".join(sorted(unknown))}')
+                columns = params.get('columns')
+                return version.query(name, data_format, params.get('start'),
+                    params.get('end'), columns.split(',') if columns else None)
+
+            def send(self, version, response):
+                not_modified = self.headers.get('If-None-Match') == response.etag
+                self.send_response(304 if not_modified else 200)
+                self.send_header('ETag', response.etag)
+                self.send_header('X-Dataset-Version', version.id)
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Vary', 'Accept-Encoding')
+                if not_modified:
+                    self.end_headers()
+                    return
+                body = response.body
+                if (response.gzip_body is not None and
+                        'gzip' in self.headers.get('Accept-Encoding', '')):
+                    body = response.gzip_body
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Type', response.content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, watch_interval=None):
+        ''' Starts serving from a background thread, and watching the
+        exported files if watch_interval is set. '''
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._server.serve_forever,
+            daemon=True)]
+        if watch_interval:
+            self._threads.append(threading.Thread(target=self.watch,
+                args=(watch_interval,), daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Covid_NL read-only data API')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL,
+        help='Seconds between checks of the exported files for a new version')
+    args = parser.parse_args(argv)
+    api = ApiServer(args.host, args.port)
+    api.reload()
+    if not api.version.datasets:
+        print('No exported data found, run main.py first.')
+        sys.exit()
+    api.start(args.reload_interval)
+    print(f'Serving on {api.url()}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,680 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import inspect
+import platform
+import tempfile
+import argparse
+import contextlib
+import subprocess
+import tracemalloc
+import isoweek
+import pandas as pd
+import getdata
+import storage
+import plotfuncs
+import httpclient
+import instrument
+import adjustment
+import regressions
+import rollup
+import rapport_data
+import synthetic
+from standin_server import StandinServer
+from weeknumbers import week_numbers
+
+def measure(func, *args, **kwargs):
+    ''' Runs func twice, and returns its result together with the
+    wall time in seconds and the peak traced memory in bytes. The
+    timing run is done without tracemalloc, as tracing slows down
+    allocation heavy code considerably. '''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def rivm_full_download(n_municipalities, n_days):
+    ''' The get_rivm_data_main path: the whole body in memory, decoded
+    into a list of dicts, loaded into a dataframe and summed by date. '''
+    content = synthetic.rivm_json_bytes(n_municipalities, n_days)
+    dframe = pd.DataFrame(json.loads(content))
+    del content
+    return dframe.groupby('Date_of_publication')[
+        ['Total_reported', 'Hospital_admission', 'Deceased']].sum()
+
+def rivm_streaming(n_municipalities, n_days):
+    ''' The get_rivm_data_streaming path, fed chunk by chunk. '''
+    chunks = synthetic.rivm_json_chunks(n_municipalities, n_days)
+    return getdata.aggregate_rivm_records(getdata.iter_json_array(chunks))
+
+def bench_rivm_ingestion(n_municipalities=355, n_days=6000):
+    ''' Compares peak memory and throughput of the full download
+    and the streaming ingestion of the RIVM feed. '''
+    rows = n_municipalities * n_days
+    results = {}
+    for name, func in [('full_download', rivm_full_download),
+            ('streaming', rivm_streaming)]:
+        _, elapsed, peak = measure(func, n_municipalities, n_days)
+        results[name] = {
+            'rows' : rows,
+            'seconds' : round(elapsed, 3),
+            'rows_per_second' : round(rows / elapsed),
+            'peak_mb' : round(peak / 1e6, 1)
+            }
+    return results
+
+def bench_rivm_schema(n_municipalities=355, n_days=700, repeats=3):
+    ''' Compares the memory footprint (memory_usage(deep=True)) of the
+    raw RIVM frame as loaded from JSON with the frame after applying
+    the RIVM schema, on a full-size synthetic feed, and times parsing
+    every date string against parsing each distinct date once. '''
+    records = json.loads(synthetic.rivm_json_bytes(n_municipalities, n_days))
+    def plain_frame():
+        dframe = pd.DataFrame(records)
+        dframe['date'] = pd.to_datetime(dframe.Date_of_publication)
+        return dframe
+    plain = plain_frame()
+    schema = getdata.apply_rivm_schema(pd.DataFrame(records))
+    plain_bytes = plain.memory_usage(deep=True)
+    schema_bytes = schema.memory_usage(deep=True)
+    dates = plain.Date_of_publication
+    return {
+        'rows' : len(plain),
+        'plain_mb' : round(plain_bytes.sum() / 1e6, 1),
+        'schema_mb' : round(schema_bytes.sum() / 1e6, 1),
+        'reduction' : round(plain_bytes.sum() / schema_bytes.sum(), 1),
+        'columns_mb' : {column : [round(plain_bytes[column] / 1e6, 2),
+            round(schema_bytes[column] / 1e6, 2)] for column in schema_bytes.index
+            if column != 'Index'},
+        'plain_load' : best_of(plain_frame, repeats),
+        'schema_load' : best_of(lambda: getdata.apply_rivm_schema(
+            pd.DataFrame(records)), repeats),
+        'parse_every_date' : best_of(pd.to_datetime, repeats, dates),
+        'parse_dates_once' : best_of(getdata.parse_dates_once, repeats, dates)
+        }
+
+def bench_week_numbers(n_rows=2000000, n_dates=700):
+    ''' Compares the row-wise isoweek apply that was used to label
+    the RIVM rows with the vectorized week_numbers. '''
+    dates = pd.date_range('2020-02-27', periods=n_dates, freq='D')
+    dframe = pd.DataFrame({'date' : dates.repeat(n_rows // n_dates)})
+    start = time.perf_counter()
+    expected = dframe.apply(
+        lambda row: isoweek.Week.withdate(row['date']).isoformat(), axis=1)
+    apply_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    result = week_numbers(dframe.date)
+    vectorized_seconds = time.perf_counter() - start
+    return {
+        'rows' : len(dframe),
+        'equal' : bool((expected == result).all()),
+        'apply_seconds' : round(apply_seconds, 3),
+        'vectorized_seconds' : round(vectorized_seconds, 3),
+        'speedup' : round(apply_seconds / vectorized_seconds, 1)
+        }
+
+def bench_storage(n_days=10 * 365, repeats=20):
+    ''' Compares write and read time, file size, and dtype preservation
+    of the storage formats on a multi-year synthetic merged dataset. '''
+    dframe = synthetic.merged_frame(n_days)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stem = os.path.join(tmp_dir, 'export')
+        for storage_format in storage.EXTENSIONS:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                path = storage.write_frame(dframe, stem, storage_format)
+            write_seconds = (time.perf_counter() - start) / repeats
+            start = time.perf_counter()
+            for _ in range(repeats):
+                result = storage.read_frame(stem, storage_format)
+            read_seconds = (time.perf_counter() - start) / repeats
+            results[storage_format] = {
+                'rows' : len(dframe),
+                'write_ms' : round(write_seconds * 1000, 2),
+                'read_ms' : round(read_seconds * 1000, 2),
+                'size_kb' : round(os.path.getsize(path) / 1024, 1),
+                'dtypes_kept' : [d.kind for d in result.dtypes] == 
+                    [d.kind for d in dframe.dtypes]
+                }
+    return results
+
+def bench_plots(n_days=365):
+    ''' Compares rendering the plot suite in this process with
+    rendering it in worker processes. '''
+    dframe = synthetic.merged_frame(n_days)
+    results = {'cores' : os.cpu_count()}
+    for name, workers in [('sequential', 1), ('parallel', None)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            plotfuncs.plot_and_save_all(dframe, tmp_dir, workers=workers)
+            results[name + '_seconds'] = round(time.perf_counter() - start, 3)
+    return results
+
+RAPPORT_PDF = os.path.join(os.getcwd(), 'pdf_rapport', 
+    'COVID-19_WebSite_rapport_wekelijks_20210223_1223_final.pdf')
+
+def legacy_extract_text(pdf_path):
+    ''' The original page search: a new resource manager and full text
+    extraction for every page until the table title is found. '''
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.converter import TextConverter
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    with open(pdf_path, 'rb') as fh:
+        for i, page in enumerate(PDFPage.get_pages(fh, caching=True,
+                check_extractable=True)):
+            res_manager = PDFResourceManager()
+            fake_file_handle = io.StringIO()
+            converter = TextConverter(res_manager, fake_file_handle)
+            PDFPageInterpreter(res_manager, converter).process_page(page)
+            text = fake_file_handle.getvalue()
+            converter.close()
+            if rapport_data.TABLE_SEARCH_STR in text:
+                return i + 1
+
+def bench_pdf_scan(pdf_path=RAPPORT_PDF):
+    ''' Compares locating the GGD table page in a rapport with the
+    original extraction, the shared resource manager only, the raw 
+    content stream fast path, and the page index. '''
+    def full_scan(path):
+        for i, page in enumerate(rapport_data.extract_text_by_page(path)):
+            if rapport_data.TABLE_SEARCH_STR in page:
+                return i + 1
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = rapport_data.PAGE_INDEX_PATH
+        rapport_data.PAGE_INDEX_PATH = os.path.join(tmp_dir, 'index.json')
+        try:
+            for name, func in [('legacy', legacy_extract_text),
+                    ('shared_resources', full_scan),
+                    ('fast_path', rapport_data.find_table_page),
+                    ('first_indexed', rapport_data.extract_text),
+                    ('indexed', rapport_data.extract_text)]:
+                start = time.perf_counter()
+                page = func(pdf_path)
+                results[name] = {
+                    'page' : page,
+                    'seconds' : round(time.perf_counter() - start, 4)
+                    }
+        finally:
+            rapport_data.PAGE_INDEX_PATH = index_path
+    return results
+
+def bench_table_extraction(pdf_path=RAPPORT_PDF, n_reports=10):
+    ''' Times extracting the GGD table from a batch of rapports (the
+    committed rapport n_reports times) with each table backend. The
+    tabula backend is skipped when no java is installed. '''
+    page = rapport_data.extract_text(pdf_path)
+    results = {}
+    for backend in ['tabula', 'pdfminer']:
+        if backend == 'tabula' and shutil.which('java') is None:
+            results[backend] = 'skipped: java not found'
+            continue
+        start = time.perf_counter()
+        for _ in range(n_reports):
+            table = rapport_data.extract_table(page, pdf_path, backend=backend)
+        elapsed = time.perf_counter() - start
+        results[backend] = {
+            'reports' : n_reports,
+            'seconds' : round(elapsed, 3),
+            'seconds_per_report' : round(elapsed / n_reports, 3),
+            'rows' : len(table)
+            }
+    return results
+
+def bench_backfill(pdf_path=RAPPORT_PDF, n_reports=8):
+    ''' Times backfilling n_reports copies of the committed rapport 
+    with one worker process and with one per core. '''
+    results = {'cores' : os.cpu_count()}
+    cwd = os.getcwd()
+    backfill_dir = rapport_data.BACKFILL_DIR
+    index_path = rapport_data.PAGE_INDEX_PATH
+    for name, workers in [('one_worker', 1), ('all_cores', None)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = os.path.join(tmp_dir, 'archive')
+            os.makedirs(archive)
+            os.makedirs(os.path.join(tmp_dir, 'data'))
+            for i in range(n_reports):
+                shutil.copy(pdf_path, os.path.join(archive, 
+                    f'rapport_wekelijks_202101{10 + i}_final.pdf'))
+            rapport_data.BACKFILL_DIR = os.path.join(tmp_dir, 'backfill')
+            rapport_data.PAGE_INDEX_PATH = os.path.join(tmp_dir, 'index.json')
+            os.chdir(tmp_dir)
+            try:
+                start = time.perf_counter()
+                rapport_data.backfill(archive, workers=workers, 
+                    backend='pdfminer')
+                elapsed = time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+                rapport_data.BACKFILL_DIR = backfill_dir
+                rapport_data.PAGE_INDEX_PATH = index_path
+        results[name] = {
+            'seconds' : round(elapsed, 3),
+            'reports_per_second' : round(n_reports / elapsed, 2)
+            }
+    return results
+
+def best_of(func, repeats, *args, **kwargs):
+    ''' Runs func repeats times, and returns the fastest and the mean
+    wall time in seconds. '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return {
+        'repeats' : repeats,
+        'seconds' : round(min(times), 4),
+        'mean_seconds' : round(sum(times) / repeats, 4)
+        }
+
+def bench_parse_rivm_df(n_municipalities=355, n_days=365, repeats=3):
+    ''' Times parse_rivm_df on a raw RIVM frame in the shape returned
+    by get_rivm_data_main. '''
+    raw = synthetic.rivm_frame(n_municipalities, n_days)
+    result = best_of(getdata.parse_rivm_df, repeats, raw)
+    result['rows'] = len(raw)
+    return result
+
+def bench_rollup_cube(n_municipalities=355, n_days=365, repeats=3):
+    ''' Times building the rollup cube from a raw RIVM frame, against
+    the national groupby it replaces, and slicing a single province
+    over a month from the cube against filtering the raw rows. '''
+    raw = synthetic.rivm_frame(n_municipalities, n_days)
+    cube = rollup.build_cube(raw)
+    province = raw.Province.iloc[0]
+    start, end = raw.date.min(), raw.date.min() + pd.Timedelta(days=30)
+    def scan():
+        rows = raw[(raw.Province == province) & raw.date.between(start, end)]
+        return rows.groupby('date').Total_reported.sum()
+    return {
+        'rows' : len(raw),
+        'build' : best_of(rollup.build_cube, repeats, raw),
+        'national_groupby' : best_of(getdata.sum_rivm_by_day, repeats, raw),
+        'region_slice' : best_of(cube.region, 20 * repeats, 'province',
+            province, 'day', start, end),
+        'region_scan' : best_of(scan, repeats)
+        }
+
+def bench_merge_dframes(n_days=3 * 365, repeats=20):
+    ''' Times merge_dframes on NICE frames in the shape returned by
+    get_nice_data and the parsed RIVM data. '''
+    merged = synthetic.merged_frame(n_days)
+    rivm_df = merged.drop(columns=['IC_current', 'ZKH_current'])
+    ic_df = synthetic.nice_frame('IC_current', n_days, seed=1)
+    zkh_df = synthetic.nice_frame('ZKH_current', n_days, seed=2)
+    result = best_of(getdata.merge_dframes, repeats, ic_df, zkh_df, rivm_df)
+    result['rows'] = n_days
+    return result
+
+def bench_day_contrib_reg(n_days=3 * 365, repeats=3):
+    ''' Times the statsmodels weekday regression for each reported
+    variable, and the batch regression fitting all of them at once. '''
+    dframe = synthetic.merged_frame(n_days)
+    results = {'rows' : n_days}
+    for type_var in regressions.TYPE_VARS:
+        results[type_var] = best_of(regressions.day_contrib_reg, repeats,
+            dframe, type_var)
+    results['batch'] = best_of(regressions.day_contrib_reg_batch, repeats,
+        dframe)
+    return results
+
+def refit_windows(dframe, window):
+    ''' Fits the batch regression on the weeks of every rolling window
+    from scratch, the alternative to rolling_day_contrib_reg. '''
+    weeks = sorted(regressions.weekday_shares(dframe).week_number.unique())
+    return [regressions.day_contrib_reg_batch(dframe[dframe.week_number.between(
+        weeks[i - window + 1], weeks[i])]) for i in range(window - 1, len(weeks))]
+
+def bench_rolling_regression(n_days=10 * 365, window=12, repeats=3):
+    ''' Compares the rolling weekday regressions, updating the normal
+    equations week by week, with refitting every window. '''
+    dframe = synthetic.merged_frame(n_days)
+    with contextlib.redirect_stdout(io.StringIO()):
+        rolling = best_of(regressions.rolling_day_contrib_reg, repeats, 
+            dframe, window)
+        refit = best_of(refit_windows, 1, dframe, window)
+    return {
+        'rows' : n_days,
+        'windows' : regressions.weekday_shares(dframe).week_number.nunique() 
+            - window + 1,
+        'rolling' : rolling,
+        'refit' : refit,
+        'speedup' : round(refit['seconds'] / rolling['seconds'], 1)
+        }
+
+def bench_process_test_data(n_reports=10, n_weeks=12):
+    ''' Times process_test_data_df on the raw GGD tables of n_reports
+    rapports. '''
+    tables = [table for _, table in synthetic.ggd_tables(n_reports, n_weeks)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for table in tables:
+            rapport_data.process_test_data_df(table, export=False)
+    elapsed = time.perf_counter() - start
+    return {
+        'reports' : n_reports,
+        'seconds' : round(elapsed, 4),
+        'seconds_per_report' : round(elapsed / n_reports, 4)
+        }
+
+def bench_plot_functions(n_days=365, repeats=3):
+    ''' Times rendering and saving each plotting function on its own,
+    in this process, and deriving the series the plots share. '''
+    dframe = synthetic.merged_frame(n_days)
+    with contextlib.redirect_stdout(io.StringIO()):
+        testing_df = rapport_data.process_test_data_df(
+            synthetic.ggd_table(), export=False)
+    jobs = [(plot, dframe, ()) for plot in plotfuncs.PLOTS]
+    jobs.append((plotfuncs.plot_testing_data, testing_df, 
+        ('rapport_wekelijks_20210223_final.pdf',)))
+    jobs.append((plotfuncs.plot_rolling_weekday, 
+        regressions.rolling_day_contrib_reg(dframe), ('infection',)))
+    jobs.append((plotfuncs.plot_adjusted_daily, adjustment.adjust_for_weekday(
+        dframe, adjustment.fit_factors(dframe)), ()))
+    results = {'rows' : n_days}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for plot, data, args in jobs:
+            results[plot.__name__] = best_of(plot, repeats, data, *args,
+                target_dir=tmp_dir)
+    # Deriving the shared series of a new frame, and looking them up
+    def derive():
+        plotfuncs._derived.clear()
+        return plotfuncs.derived_series(dframe).prepare()
+    results['derive_series'] = best_of(derive, 10 * repeats)
+    results['lookup_series'] = best_of(plotfuncs.derived_series, 10 * repeats, dframe)
+    return results
+
+@contextlib.contextmanager
+def offline_pipeline(n_municipalities, n_days, pdf_path=RAPPORT_PDF):
+    ''' Serves synthetic RIVM and NICE feeds, a rapport listing, and
+    the committed rapport from a local stand-in server, and runs the
+    context in an empty temporary directory, with the source urls, 
+    the HTTP cache, and the page index pointed to it. Paths resolved
+    from the working directory, like those of the weekday factors and
+    the plot manifest, follow the change of directory. The GGD table
+    is extracted with the pdfminer backend unless java is installed. '''
+    pdf_name = os.path.basename(pdf_path)
+    with open(pdf_path, 'rb') as f:
+        pdf = f.read()
+    saved = [(getdata, 'RIVM_URL'), (getdata, 'NICE_URL_IC'),
+        (getdata, 'NICE_URL_ZKH'), (rapport_data, 'RAPPORT_URL'),
+        (rapport_data, 'RAPPORT_HOST'), (rapport_data, 'TABLE_BACKEND'),
+        (rapport_data, 'PAGE_INDEX_PATH'), (httpclient, 'CACHE_DIR'),
+        (httpclient, '_cache')]
+    saved = [(module, name, getattr(module, name)) for module, name in saved]
+    cwd = os.getcwd()
+    with StandinServer() as standin, tempfile.TemporaryDirectory() as tmp_dir:
+        standin.set_route('/rivm.json', 
+            synthetic.rivm_json_bytes(n_municipalities, n_days))
+        standin.set_route('/ic.json', synthetic.nice_json_bytes(n_days, seed=1))
+        standin.set_route('/zkh.json', synthetic.nice_json_bytes(n_days, seed=2))
+        standin.set_route('/rapporten', synthetic.rapport_listing_html(pdf_name))
+        standin.set_route('/documenten/' + pdf_name, pdf)
+        getdata.RIVM_URL = standin.url('/rivm.json')
+        getdata.NICE_URL_IC = standin.url('/ic.json')
+        getdata.NICE_URL_ZKH = standin.url('/zkh.json')
+        rapport_data.RAPPORT_URL = standin.url('/rapporten')
+        rapport_data.RAPPORT_HOST = standin.url('')
+        if shutil.which('java') is None:
+            rapport_data.TABLE_BACKEND = 'pdfminer'
+        rapport_data.PAGE_INDEX_PATH = os.path.join(tmp_dir, 'data', 
+            'rapport_page_index.json')
+        httpclient.CACHE_DIR = os.path.join(tmp_dir, '.http_cache')
+        httpclient._cache = None
+        for folder in ['data', 'pdf_rapport', 'plots']:
+            os.makedirs(os.path.join(tmp_dir, folder))
+        os.chdir(tmp_dir)
+        try:
+            yield standin
+        finally:
+            os.chdir(cwd)
+            for module, name, value in saved:
+                setattr(module, name, value)
+
+def stage_totals(report):
+    ''' Sums the wall time of the recorded stages by stage name. '''
+    totals = {}
+    for record in report['stages']:
+        totals[record['stage']] = round(
+            totals.get(record['stage'], 0) + record['wall_s'], 4)
+    return totals
+
+def bench_main_offline(n_municipalities=355, n_days=365):
+    ''' Runs the full main.main pipeline twice against the offline
+    stand-in sources: a cold run in an empty directory, and a warm
+    run revalidating the cached downloads, updating the previous
+    export, and skipping the unchanged plots. Reports the wall time
+    and the time per stage of both runs. '''
+    import main
+    results = {'rows' : n_municipalities * n_days}
+    with offline_pipeline(n_municipalities, n_days) as standin:
+        results['table_backend'] = rapport_data.TABLE_BACKEND
+        for name in ['cold', 'warm']:
+            instrument.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.main()
+            elapsed = time.perf_counter() - start
+            report = instrument.report()
+            results[name] = {
+                'seconds' : round(elapsed, 3),
+                'max_rss_mb' : report['max_rss_mb'],
+                'stages' : stage_totals(report)
+                }
+        results['requests'] = standin.request_count
+        results['not_modified'] = standin.not_modified_count
+    instrument.reset()
+    return results
+
+# Modules loaded on first use by each stage of main.py, and the modules
+# main.py imported at start up before they were loaded lazily
+PLOT_IMPORTS = ['matplotlib.figure', 'matplotlib.backends.backend_agg',
+    'matplotlib.dates', 'matplotlib.ticker']
+STAGE_IMPORTS = {
+    'data' : [],
+    'plots' : PLOT_IMPORTS,
+    'regression' : ['scipy.special'] + PLOT_IMPORTS,
+    'testing' : ['pdfminer.pdfpage', 'pdfminer.converter', 
+        'pdfminer.pdfinterp', 'pdfminer.layout', 'bs4', 'tabula'] + PLOT_IMPORTS
+    }
+EAGER_IMPORTS = ['statsmodels.formula.api', 'scipy.stats', 'matplotlib.pyplot',
+    'matplotlib.dates', 'matplotlib.ticker', 'tabula', 'bs4', 
+    'pdfminer.pdfpage', 'pdfminer.converter', 'pdfminer.pdfinterp', 
+    'pdfminer.layout']
+
+def import_times(modules, repeats=3):
+    ''' Imports the modules in a fresh interpreter with -X importtime,
+    and returns the total import time in ms, and the cumulative time
+    of the modules imported at the top two levels, of the fastest of
+    repeats runs. '''
+    code = '; '.join(f'import {module}' for module in modules)
+    best = None
+    for _ in range(repeats):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, check=True).stderr
+        total = 0
+        modules = {}
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            ms = int(cumulative) / 1000
+            if depth == 0:
+                total += ms
+            # The imports of the inputted modules and what they import
+            if depth <= 1:
+                modules[name.strip()] = ms
+        if best is None or total < best[0]:
+            best = (total, modules)
+    return best
+
+def bench_import_time(top=8):
+    ''' Compares the start up import time of main.py, and that of each
+    stage including the modules it loads on first use, with importing
+    the heavy dependencies at start up as before. Lists the slowest 
+    imports of each. '''
+    results = {}
+    runs = [('startup', ['main']), ('eager', ['main'] + EAGER_IMPORTS)]
+    runs += [(stage, ['main'] + modules) for stage, modules in STAGE_IMPORTS.items()]
+    for name, modules in runs:
+        total, imported = import_times(modules)
+        slowest = sorted(imported.items(), key=lambda item: -item[1])[:top]
+        results[name] = {
+            'import_ms' : round(total, 1),
+            'slowest' : {module : round(ms, 1) for module, ms in slowest}
+            }
+    for stage in STAGE_IMPORTS:
+        results[stage]['reduction_ms'] = round(
+            results['eager']['import_ms'] - results[stage]['import_ms'], 1)
+    return results
+
+BENCHMARKS = {
+    'rivm_ingestion' : bench_rivm_ingestion,
+    'rivm_schema' : bench_rivm_schema,
+    'week_numbers' : bench_week_numbers,
+    'storage' : bench_storage,
+    'plots' : bench_plots,
+    'pdf_scan' : bench_pdf_scan,
+    'table_extraction' : bench_table_extraction,
+    'backfill' : bench_backfill,
+    'parse_rivm_df' : bench_parse_rivm_df,
+    'rollup_cube' : bench_rollup_cube,
+    'merge_dframes' : bench_merge_dframes,
+    'day_contrib_reg' : bench_day_contrib_reg,
+    'rolling_regression' : bench_rolling_regression,
+    'process_test_data' : bench_process_test_data,
+    'plot_functions' : bench_plot_functions,
+    'main_offline' : bench_main_offline,
+    'import_time' : bench_import_time
+    }
+
+# Command line options scaling the synthetic inputs, and the benchmark
+# argument each of them sets (for the benchmarks taking it)
+SCALE_OPTIONS = {
+    'municipalities' : 'n_municipalities',
+    'days' : 'n_days',
+    'reports' : 'n_reports'
+    }
+
+def run_benchmark(name, scale):
+    ''' Runs the named benchmark with those of the scale arguments
+    it takes. '''
+    func = BENCHMARKS[name]
+    accepted = inspect.signature(func).parameters
+    return func(**{arg : value for arg, value in scale.items() 
+        if arg in accepted})
+
+def git_commit():
+    ''' Returns the current commit hash, and whether the working tree
+    has uncommitted changes (None, None outside a git checkout). '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], 
+            capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', 
+            '--untracked-files=no'], capture_output=True, text=True, 
+            check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+def environment():
+    import numpy
+    import matplotlib
+    commit, dirty = git_commit()
+    return {
+        'commit' : commit,
+        'dirty' : dirty,
+        'python' : platform.python_version(),
+        'pandas' : pd.__version__,
+        'numpy' : numpy.__version__,
+        'matplotlib' : matplotlib.__version__,
+        'platform' : platform.platform(),
+        'cores' : os.cpu_count()
+        }
+
+def save_results(results, output_dir):
+    ''' Writes the results as JSON into output_dir, named after the
+    time and the commit they were run on. Returns the path. '''
+    os.makedirs(output_dir, exist_ok=True)
+    commit = (results['environment']['commit'] or 'nogit')[:10]
+    timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+    path = os.path.join(output_dir, f'{timestamp}_{commit}.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=4)
+    return path
+
+def numeric_leaves(value, prefix=''):
+    ''' Yields (path, number) for the numbers nested in the results. '''
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from numeric_leaves(item, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def compare_results(baseline, results):
+    ''' Returns (path, baseline, current, ratio) for the timings and
+    memory figures present in both benchmark runs. '''
+    old = dict(numeric_leaves(baseline['benchmarks']))
+    rows = []
+    for path, value in numeric_leaves(results['benchmarks']):
+        if path not in old or not re.search(r'(seconds|_s|_ms|_mb)$', path):
+            continue
+        ratio = round(value / old[path], 2) if old[path] else None
+        rows.append((path, old[path], value, ratio))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Covid_NL benchmarks')
+    parser.add_argument('names', nargs='*', default=list(BENCHMARKS),
+        help='Benchmarks to run (default: all)')
+    parser.add_argument('--municipalities', type=int, 
+        help='Number of municipalities in the synthetic RIVM feed')
+    parser.add_argument('--days', type=int, 
+        help='Number of days in the synthetic feeds')
+    parser.add_argument('--reports', type=int, 
+        help='Number of synthetic rapports')
+    parser.add_argument('--output', default='bench_results',
+        help='Directory the results are saved to (default: bench_results)')
+    parser.add_argument('--no-save', action='store_true',
+        help='Only print the results')
+    parser.add_argument('--compare', metavar='RESULTS',
+        help='Results file of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+    scale = {arg : getattr(args, option) for option, arg in 
+        SCALE_OPTIONS.items() if getattr(args, option) is not None}
+    results = {
+        'environment' : environment(),
+        'scale' : scale,
+        'benchmarks' : {}
+        }
+    for name in args.names:
+        print(name)
+        results['benchmarks'][name] = run_benchmark(name, scale)
+        print(json.dumps(results['benchmarks'][name], indent=4))
+    if not args.no_save:
+        print(f'Results saved to {save_results(results, args.output)}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'Compared with {args.compare} '
+            f'(commit {baseline["environment"]["commit"]}):')
+        for path, old, new, ratio in compare_results(baseline, results):
+            print(f'{path:<50} {old:>10} {new:>10} {ratio:>6}x')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
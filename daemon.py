@@ -0,0 +1,163 @@
+import gc
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from collections import deque
+import getdata
+import httpclient
+import instrument
+import rapport_data
+from pipeline import Pipeline
+
+# Seconds between the start of two polling cycles
+POLL_INTERVAL = int(os.environ.get('COVID_NL_POLL_INTERVAL', '900'))
+POLL_TIMEOUT = (10, 300)
+# Number of cycle records kept in memory
+HISTORY_SIZE = 100
+# The url polled for each source task of the pipeline (read when
+# polling, so a changed url is picked up)
+SOURCES = {
+    'fetch_rivm' : lambda: getdata.RIVM_URL,
+    'fetch_ic' : lambda: getdata.NICE_URL_IC,
+    'fetch_zkh' : lambda: getdata.NICE_URL_ZKH,
+    'fetch_report' : lambda: rapport_data.RAPPORT_URL
+    }
+
+def daemon_log_path():
+    return os.path.join(os.getcwd(), 'daemon_cycles.jsonl')
+
+def source_changed(url):
+    ''' Revalidates the cached body of url, downloading and caching it
+    if it changed (so the source task reads it from the cache). Returns
+    whether it changed; always True when it can not be told, i.e.
+    without the HTTP cache or when the server sends no validators. '''
+    if not httpclient.USE_CACHE or httpclient.REPLAY_SNAPSHOT:
+        return True
+    cache = httpclient.get_cache()
+    validators = cache.validators(url)
+    response = httpclient.get(url, headers=httpclient.HEADERS,
+        timeout=POLL_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+    finally:
+        response.close()
+    return not validators or cache.validators(url) != validators
+
+class Daemon:
+    ''' Keeps the pipeline warm in a single process: polls the sources
+    every interval seconds, and runs the targets (by default all
+    tasks) with the unchanged sources skipped, so only the tasks
+    downstream of a changed source run again. The loaded modules, the
+    pooled HTTP session, and the task outputs in memory are reused
+    between cycles. Each cycle is appended to log_path as a line of
+    JSON, with its timings and the memory use of the process. With an
+    api server, the exported data is published to it after every
+    cycle that ran a task. '''
+
+    def __init__(self, interval=POLL_INTERVAL, targets=None, pipeline=None,
+            log_path=None, api=None):
+        self.interval = interval
+        self.targets = targets
+        self.pipeline = pipeline or Pipeline()
+        self.log_path = log_path or daemon_log_path()
+        self.api = api
+        self.count = 0
+        self.cycles = deque(maxlen=HISTORY_SIZE)
+        self._stop = threading.Event()
+
+    def poll(self):
+        ''' Returns for each source task the targets need whether its
+        source changed. '''
+        required = self.pipeline.required(self.targets or list(self.pipeline.tasks))
+        return {name : source_changed(url()) for name, url in SOURCES.items()
+            if name in required}
+
+    def cycle(self):
+        ''' Polls the sources and runs the tasks downstream of the
+        changed ones. Errors are recorded, and do not stop the daemon.
+        Returns the record of the cycle. '''
+        self.count += 1
+        instrument.reset()
+        record = {
+            'cycle' : self.count,
+            'started' : time.strftime('%Y-%m-%dT%H:%M:%S')
+            }
+        start = time.perf_counter()
+        try:
+            changed = self.poll()
+            record['poll_s'] = round(time.perf_counter() - start, 4)
+            record['changed'] = sorted(name for name, was_changed in
+                changed.items() if was_changed)
+            status = self.pipeline.run(self.targets, unchanged={name for name,
+                was_changed in changed.items() if not was_changed})
+            record['run'] = sorted(name for name, task_status in status.items()
+                if task_status == 'run')
+            if self.api is not None and record['run']:
+                self.api.reload()
+        except (Exception, SystemExit) as error:
+            record['error'] = repr(error)
+        record['wall_s'] = round(time.perf_counter() - start, 4)
+        record['tasks'] = {stage['stage'][len('task_'):] : stage['wall_s']
+            for stage in instrument.records() if stage['stage'].startswith('task_')}
+        gc.collect()
+        record['rss_mb'] = instrument.rss_mb()
+        record['max_rss_mb'] = instrument.max_rss_mb()
+        self.cycles.append(record)
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        print(f'Cycle {self.count}: {record["wall_s"]:.2f}s, changed: '
+            f'{", ".join(record.get("changed", [])) or "-"}, ran '
+            f'{len(record.get("run", []))} task(s), {record["rss_mb"]} MB'
+            + (f', error: {record["error"]}' if 'error' in record else ''))
+        return record
+
+    def run(self, cycles=None):
+        ''' Runs a cycle every interval seconds, until stopped or after
+        the inputted number of cycles. '''
+        done = 0
+        while not self._stop.is_set() and (cycles is None or done < cycles):
+            record = self.cycle()
+            done += 1
+            if cycles is None or done < cycles:
+                self._stop.wait(max(0, self.interval - record['wall_s']))
+
+    def stop(self, *args):
+        self._stop.set()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Covid_NL pipeline daemon')
+    parser.add_argument('targets', nargs='*',
+        help='Pipeline tasks to keep up to date (default: all)')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+        help='Seconds between polling the sources')
+    parser.add_argument('--cycles', type=int, default=None,
+        help='Stop after this number of cycles')
+    parser.add_argument('--serve', action='store_true',
+        help='Serve the exported data with api_server.py, updated every cycle')
+    args = parser.parse_args(argv)
+    pipeline = Pipeline()
+    for target in args.targets:
+        if target not in pipeline.tasks:
+            parser.error(f'unknown task: {target} '
+                f'(choose from {", ".join(pipeline.tasks)})')
+    api = None
+    if args.serve:
+        import api_server
+        api = api_server.ApiServer().start()
+        print(f'Serving on {api.url()}')
+    daemon = Daemon(args.interval, args.targets, pipeline, api=api)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run(args.cycles)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if api is not None:
+            api.stop()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,589 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import requests
+import numpy as np
+import pandas as pd
+import getdata
+import synthetic
+import httpclient
+import plotfuncs
+import snapshots
+import adjustment
+import api_server
+import regressions
+import rollup
+import rapport_data
+from httpcache import HTTPCache
+from standin_server import StandinServer
+from weeknumbers import week_numbers
+
+RIVM_COLUMNS = ['date', 'week_number', 'infection_day', 'hospital_day',
+    'dead_day', 'infection_week', 'hospital_week', 'dead_week']
+
+def load_export(path='export.csv'):
+    ''' Reads the committed export, with the date column parsed. '''
+    return pd.read_csv(path, index_col=0, parse_dates=['date'])
+
+def raw_rivm_from_daily(daily_df, n_municipalities=5, seed=0):
+    ''' Splits the daily totals over a number of fake municipalities,
+    giving a raw frame in the shape returned by get_rivm_data_main
+    which sums back to the inputted totals. '''
+    rng = np.random.default_rng(seed)
+    rows = daily_df.loc[daily_df.index.repeat(n_municipalities)]
+    raw = pd.DataFrame({
+        'date' : rows.date.to_numpy(),
+        'Municipality_code' : np.tile([f'GM{i:04d}' for i in 
+            range(n_municipalities)], len(daily_df))
+        })
+    for source, target in [('infection_day', 'Total_reported'),
+            ('hospital_day', 'Hospital_admission'), 
+            ('dead_day', 'Deceased')]:
+        shares = rng.multinomial(1, [1 / n_municipalities] * n_municipalities,
+            size=len(daily_df)).astype(bool)
+        # Put the total of each date in a single random municipality
+        raw[target] = np.where(shares.ravel(), rows[source].to_numpy(), 0)
+    raw['Date_of_publication'] = raw.date.dt.strftime('%Y-%m-%d')
+    return raw
+
+def check_parse_rivm_df(path='export.csv'):
+    ''' Rebuilds a raw RIVM frame from the committed export, and checks
+    that parse_rivm_df and merge_dframes reproduce the export column
+    for column. '''
+    export = load_export(path)
+    raw = raw_rivm_from_daily(export)
+    ic_df = export[['date', 'IC_current']].dropna()
+    zkh_df = export[['date', 'ZKH_current']].dropna()
+    rivm_df = getdata.parse_rivm_df(raw)
+    pd.testing.assert_frame_equal(
+        rivm_df.reset_index(drop=True), export[RIVM_COLUMNS])
+    dframe = getdata.merge_dframes(ic_df, zkh_df, rivm_df)
+    pd.testing.assert_frame_equal(dframe, export, check_dtype=False)
+    print(f'parse_rivm_df reproduces {path}.')
+
+def serve_sources(standin, n_municipalities=50, n_days=200):
+    ''' Adds synthetic RIVM and NICE feeds to the stand-in server, and
+    points the getdata source urls to it. '''
+    standin.set_route('/rivm.json', 
+        synthetic.rivm_json_bytes(n_municipalities, n_days))
+    standin.set_route('/ic.json', synthetic.nice_json_bytes(n_days, seed=1))
+    standin.set_route('/zkh.json', synthetic.nice_json_bytes(n_days, seed=2))
+    getdata.RIVM_URL = standin.url('/rivm.json')
+    getdata.NICE_URL_IC = standin.url('/ic.json')
+    getdata.NICE_URL_ZKH = standin.url('/zkh.json')
+
+@contextmanager
+def scratch_directory():
+    ''' Runs the context in an empty temporary working directory, with
+    a data folder and the HTTP cache in it, so the files written by 
+    the retreival are not left in the repository. Yields its path. '''
+    cwd, cache_dir = os.getcwd(), httpclient.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, 'data'))
+        os.chdir(tmp_dir)
+        httpclient.CACHE_DIR = os.path.join(tmp_dir, '.http_cache')
+        httpclient._cache = None
+        try:
+            yield tmp_dir
+        finally:
+            os.chdir(cwd)
+            httpclient.CACHE_DIR = cache_dir
+            httpclient._cache = None
+
+def check_concurrent_retrieval(latency=1.0):
+    ''' Retreives the sources from a local stand-in with artificial 
+    latency, both one after another and concurrently, and checks that 
+    the results are equal and the concurrent run takes about one 
+    round trip instead of three. '''
+    with scratch_directory(), StandinServer(latency=latency) as standin:
+        serve_sources(standin)
+        start = time.perf_counter()
+        sequential = getdata.data_main()
+        sequential_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        concurrent = getdata.data_main(stream=True, concurrent=True)
+        concurrent_seconds = time.perf_counter() - start
+    pd.testing.assert_frame_equal(sequential, concurrent)
+    if concurrent_seconds >= 2 * latency:
+        raise AssertionError(f'Concurrent retrieval took {concurrent_seconds:.2f}s')
+    print(f'Concurrent retrieval: {concurrent_seconds:.2f}s, '
+        f'sequential: {sequential_seconds:.2f}s.')
+
+def check_http_cache():
+    ''' Runs the data retreival twice against the stand-in server with
+    a fresh cache, and checks that the second run is served from disk,
+    that a changed source is downloaded again, and that the cache
+    evicts the least recently used body when it is full. '''
+    with scratch_directory(), StandinServer() as standin:
+        serve_sources(standin)
+        cache = HTTPCache(httpclient.CACHE_DIR, max_bytes=10 ** 9)
+        httpclient._cache = cache
+        first = getdata.data_main(stream=True)
+        second = getdata.data_main(stream=True)
+        pd.testing.assert_frame_equal(first, second)
+        assert cache.hits == 3 and cache.misses == 3, cache.stats()
+        assert cache.bytes_saved == cache.stats()['size']
+        standin.set_route('/ic.json', synthetic.nice_json_bytes(200, seed=3))
+        getdata.data_main(stream=True)
+        assert cache.hits == 5 and cache.misses == 4, cache.stats()
+        # Only room for the new RIVM body: both NICE bodies get evicted
+        standin.set_route('/rivm.json', synthetic.rivm_json_bytes(50, 200, seed=1))
+        cache.max_bytes = len(standin.routes['/rivm.json'])
+        getdata.data_main(stream=True)
+        assert set(cache.entries) == {getdata.RIVM_URL}, cache.stats()
+    print(f'HTTP cache: {cache.stats()}')
+
+def revised_feed(n_municipalities, n_days, revised_day):
+    ''' Returns a synthetic RIVM feed where the infections of the
+    first municipality on revised_day are corrected upwards. '''
+    records = list(synthetic.rivm_records(n_municipalities, n_days))
+    records[revised_day * n_municipalities]['Total_reported'] += 100
+    return json.dumps(records).encode('utf-8')
+
+def check_incremental_update():
+    ''' Exports the data of a feed, then updates it incrementally
+    after the feed gained ten days and one revised date, and checks
+    the result against a full rebuild. '''
+    with scratch_directory(), StandinServer() as standin:
+        serve_sources(standin, n_municipalities=50, n_days=200)
+        getdata.export_data(getdata.data_main())
+        standin.set_route('/rivm.json', revised_feed(50, 210, 100))
+        incremental = getdata.data_main(stream=True, incremental=True)
+        full = getdata.data_main()
+        pd.testing.assert_frame_equal(incremental, full)
+        getdata.export_data(incremental)
+        unchanged = getdata.data_main(incremental=True)
+        pd.testing.assert_frame_equal(unchanged, full)
+    print('Incremental update equals a full rebuild.')
+
+def check_plot_cache():
+    ''' Renders the plots twice, checking that the second run skips
+    all of them, and that changing a single value only renders the 
+    plots using that column again. '''
+    dframe = synthetic.merged_frame(120)
+    with tempfile.TemporaryDirectory() as plot_dir:
+        rendered = plotfuncs.plot_and_save_all(dframe, plot_dir, workers=1)
+        assert len(rendered) == len(plotfuncs.PLOTS), rendered
+        assert plotfuncs.plot_and_save_all(dframe, plot_dir, workers=1) == []
+        dframe.loc[60, 'infection_day'] += 1
+        rendered = plotfuncs.plot_and_save_all(dframe, plot_dir, workers=1)
+        assert sorted(rendered) == ['dailycombined.png', 'dailyinfections.png'], rendered
+        os.remove(os.path.join(plot_dir, 'currenticzkh.png'))
+        rendered = plotfuncs.plot_and_save_all(dframe, plot_dir, workers=1)
+        assert rendered == ['currenticzkh.png'], rendered
+    print('Plot cache renders only changed plots.')
+
+def check_derived_series():
+    ''' Renders all plots of a frame, checking that they share one set
+    of derived series, which is looked up again for an equal frame but
+    not for a changed one. '''
+    dframe = synthetic.merged_frame(120)
+    plotfuncs._derived.clear()
+    with tempfile.TemporaryDirectory() as plot_dir:
+        plotfuncs.plot_and_save_all(dframe, plot_dir, workers=1)
+    assert len(plotfuncs._derived) == 1
+    series = plotfuncs.derived_series(dframe.copy())
+    assert series is next(iter(plotfuncs._derived.values()))
+    assert sorted(series._rolling) == [(column, 7) for column in 
+        sorted(plotfuncs.ROLLING_COLUMNS)]
+    assert series.weekly.week_number.is_unique
+    dframe.loc[60, 'infection_day'] += 1
+    changed = plotfuncs.derived_series(dframe)
+    assert changed is not series
+    assert np.isclose(changed.rolling('infection_day').iloc[60],
+        series.rolling('infection_day').iloc[60] + 1 / 7)
+    print('Plots share the derived series of their data.')
+
+RAPPORT_PDF = os.path.join('pdf_rapport', 
+    'COVID-19_WebSite_rapport_wekelijks_20210223_1223_final.pdf')
+
+def check_backfill(n_rapports=3):
+    ''' Backfills copies of the committed rapport under different
+    dates with the pdfminer backend, checking that the merged result 
+    equals the committed testing data, that the page index holds the
+    table page of every rapport, and that a resumed backfill only 
+    parses the rapports without a stored result. '''
+    expected = pd.read_csv(os.path.join('data', 'ggd_test_data.csv'),
+        parse_dates=['start_dt', 'end_dt'])
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, 'archive')
+        os.makedirs(os.path.join(tmp_dir, 'data'))
+        os.makedirs(archive)
+        for day in range(n_rapports):
+            name = f'COVID-19_WebSite_rapport_wekelijks_202102{10 + day}_1223_final.pdf'
+            shutil.copy(RAPPORT_PDF, os.path.join(archive, name))
+        rapport_data.BACKFILL_DIR = os.path.join(tmp_dir, 'data', 'backfill')
+        rapport_data.PAGE_INDEX_PATH = os.path.join(tmp_dir, 'data', 'index.json')
+        os.chdir(tmp_dir)
+        try:
+            result = rapport_data.backfill(archive, workers=2, backend='pdfminer')
+            assert (result.n_rapports == n_rapports).all()
+            # The pages found by all workers are kept in the index
+            assert len(rapport_data.load_page_index()) == n_rapports
+            pd.testing.assert_frame_equal(result[expected.columns], expected,
+                check_dtype=False)
+            stored = [os.path.join(rapport_data.BACKFILL_DIR, name)
+                for name in sorted(os.listdir(rapport_data.BACKFILL_DIR))]
+            os.remove(stored[0])
+            mtimes = [os.path.getmtime(path) for path in stored[1:]]
+            resumed = rapport_data.backfill(archive, workers=2, backend='pdfminer')
+            # Only the removed result is parsed and stored again
+            assert os.path.exists(stored[0])
+            assert mtimes == [os.path.getmtime(path) for path in stored[1:]]
+            pd.testing.assert_frame_equal(resumed, result)
+        finally:
+            os.chdir(cwd)
+    print(f'Backfill of {n_rapports} rapports matches the testing data.')
+
+def check_stage_peaks():
+    ''' Checks that the tracemalloc peak of a stage includes the
+    memory allocated before a nested stage started, and the peak of
+    the nested stage. '''
+    import instrument
+    trace_memory, tracing = instrument.TRACE_MEMORY, tracemalloc.is_tracing()
+    instrument.TRACE_MEMORY = True
+    instrument.reset()
+    try:
+        with instrument.stage('outer'):
+            block = bytearray(20 * 10 ** 6)
+            del block
+            with instrument.stage('inner'):
+                block = bytearray(5 * 10 ** 6)
+                del block
+            with instrument.stage('inner'):
+                pass
+    finally:
+        instrument.TRACE_MEMORY = trace_memory
+        if not tracing:
+            tracemalloc.stop()
+    peaks = [record['tracemalloc_peak_mb'] for record in instrument.records()]
+    assert 5 <= peaks[0] < 20 and peaks[1] < 5 and peaks[2] >= 20, peaks
+    print(f'Nested stages keep their tracemalloc peaks: {peaks}')
+
+def check_batch_regression(path='export.csv'):
+    ''' Checks that the batch weekday regressions of all variables
+    (including the residual diagnostics) match those fitted by
+    statsmodels, on the committed export and on
+    a synthetic frame where the deaths are missing on some dates. '''
+    from statsmodels.formula.api import ols
+    from statsmodels.stats import stattools
+    synthetic_df = synthetic.merged_frame(400)
+    synthetic_df['dead_week'] = synthetic_df.dead_week.astype(float)
+    synthetic_df.loc[[30, 31, 200], 'dead_week'] = np.nan
+    for dframe in [load_export(path), synthetic_df]:
+        results = regressions.day_contrib_reg_batch(dframe)
+        for type_var, result in results.items():
+            y_var_name = regressions.set_target_regression_variables(type_var)[2]
+            fit = ols(f'{y_var_name} ~ C(weekday)', 
+                data=regressions.weekday_shares(dframe, [type_var])).fit()
+            assert result.nobs == fit.nobs
+            assert list(result.params.index) == list(fit.params.index)
+            np.testing.assert_allclose(result.params['coef'], fit.params)
+            np.testing.assert_allclose(result.params['std err'], fit.bse)
+            np.testing.assert_allclose(result.params['P>|t|'], fit.pvalues,
+                atol=1e-12)
+            np.testing.assert_allclose(result.rsquared, fit.rsquared)
+            np.testing.assert_allclose(result.fvalue, fit.fvalue)
+            np.testing.assert_allclose(result.f_pvalue, fit.f_pvalue)
+            np.testing.assert_allclose(result.params['[0.025'], fit.conf_int()[0])
+            np.testing.assert_allclose(result.params['0.975]'], fit.conf_int()[1])
+            omnibus, omnibus_pvalue, *_ = stattools.omni_normtest(fit.resid)
+            jarque_bera, jb_pvalue, skew, kurtosis = stattools.jarque_bera(fit.resid)
+            expected = {
+                'llf' : fit.llf, 'aic' : fit.aic, 'bic' : fit.bic,
+                'durbin_watson' : stattools.durbin_watson(fit.resid),
+                'skew' : skew, 'kurtosis' : kurtosis,
+                'omnibus' : omnibus, 'omnibus_pvalue' : omnibus_pvalue,
+                'jarque_bera' : jarque_bera, 'jarque_bera_pvalue' : jb_pvalue,
+                'condition_number' : fit.condition_number
+                }
+            for name, value in expected.items():
+                np.testing.assert_allclose(result.diagnostics[name], value,
+                    rtol=1e-7, atol=1e-12, err_msg=name)
+    print('Batch regressions match statsmodels.')
+
+def check_rolling_regression(window=8):
+    ''' Checks the rolling and expanding weekday regressions against
+    refitting the batch regression on the weeks of every window, on
+    a synthetic frame where the deaths are missing on some dates. '''
+    dframe = synthetic.merged_frame(300)
+    dframe['dead_week'] = dframe.dead_week.astype(float)
+    dframe.loc[[30, 31, 200], 'dead_week'] = np.nan
+    weeks = sorted(regressions.weekday_shares(dframe).week_number.unique())
+    for expanding in [False, True]:
+        rolling = regressions.rolling_day_contrib_reg(dframe, window,
+            expanding=expanding)
+        assert rolling.last_week.nunique() == len(weeks) - window + 1
+        for (first, last), estimates in rolling.groupby(
+                ['first_week', 'last_week']):
+            assert first == weeks[0 if expanding else weeks.index(last) - window + 1]
+            results = regressions.day_contrib_reg_batch(dframe[
+                dframe.week_number.between(first, last)])
+            for type_var, result in results.items():
+                estimate = estimates[estimates.type_var == type_var]
+                assert list(estimate.term) == list(result.params.index)
+                np.testing.assert_allclose(estimate.coef, result.params['coef'],
+                    atol=1e-12)
+                np.testing.assert_allclose(estimate.std_err, 
+                    result.params['std err'], atol=1e-12)
+                assert (estimate.nobs == result.nobs).all()
+    print('Rolling regressions match refitting every window.')
+
+def check_weekday_adjustment():
+    ''' Checks that figures following a fixed weekday pattern are 
+    adjusted to a flat series, and that the cached factors are only
+    refit when complete weeks are added or their figures revised. '''
+    pattern = np.array([0.20, 0.16, 0.14, 0.13, 0.13, 0.12, 0.12])
+    def patterned_frame(n_days):
+        dframe = synthetic.merged_frame(n_days)
+        weekly = 700 * (1 + pd.factorize(dframe.week_number)[0])
+        for column in ['infection_day', 'hospital_day', 'dead_day']:
+            dframe[column] = weekly * pattern[dframe.date.dt.dayofweek]
+        for column in ['infection', 'hospital', 'dead']:
+            dframe[f'{column}_week'] = dframe.groupby('week_number')[
+                f'{column}_day'].transform('sum')
+        return dframe, weekly
+    dframe, weekly = patterned_frame(212)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'factors.json')
+        adjusted = adjustment.adjustment_main(dframe, path, export=False)
+        np.testing.assert_allclose(adjusted.infection_day_adj, weekly / 7)
+        fitted = adjustment.load_factors(path)
+        # One more day does not complete a week: the factors are reused
+        adjustment.adjustment_main(patterned_frame(213)[0], path, export=False)
+        assert adjustment.load_factors(path) == fitted
+        # Revised figures of a complete week are fitted again
+        revised = dframe.copy()
+        revised.loc[10, 'infection_day'] *= 2
+        revised['infection_week'] = revised.groupby('week_number').infection_day.transform('sum')
+        adjustment.adjustment_main(revised, path, export=False)
+        refitted = adjustment.load_factors(path)
+        assert refitted['complete_weeks'] == fitted['complete_weeks']
+        assert refitted['factors'] != fitted['factors']
+        adjustment.adjustment_main(patterned_frame(220)[0], path, export=False)
+        refitted = adjustment.load_factors(path)
+        assert refitted['complete_weeks'] == fitted['complete_weeks'] + 1
+    print('Weekday adjustment flattens a fixed weekday pattern.')
+
+def check_rollup_cube():
+    ''' Builds the rollup cube of a synthetic feed (with rows missing
+    their municipality in several provinces, and a missing figure)
+    loaded with the RIVM schema, and checks the national slice and the
+    daily and weekly figures of every region against groupby sums of
+    the raw rows, also after storing and memory mapping the cube. '''
+    raw_df = synthetic.rivm_frame(60, 100, schema=False)
+    unknown = raw_df.drop_duplicates('Province').index[:4]
+    raw_df.loc[unknown, ['Municipality_code', 'Municipality_name']] = None
+    raw_df.loc[unknown[:2], 'Security_region_code'] = None
+    raw_df.loc[7, 'Total_reported'] = np.nan
+    assert raw_df.loc[unknown, 'Province'].nunique() == len(unknown)
+    cube = rollup.build_cube(getdata.apply_rivm_schema(raw_df.copy()))
+    raw_df['week_number'] = week_numbers(raw_df.date)
+    pd.testing.assert_frame_equal(cube.national('day'),
+        getdata.sum_rivm_by_day(raw_df), check_dtype=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stored = rollup.load_cube(cube.save(os.path.join(tmp_dir, 'rollup')))
+        for level, (key_col, _) in rollup.LEVELS.items():
+            for period, period_col in [('day', 'date'), ('week', 'week_number')]:
+                expected = raw_df.fillna({key_col : ''}).groupby(
+                    [key_col, period_col]).Total_reported.sum().unstack(fill_value=0)
+                assert list(expected.index) == list(cube.keys[level]), level
+                for source in [cube, stored]:
+                    for key in expected.index:
+                        region = source.region(level, key, period)
+                        assert np.array_equal(region[f'infection_{period}'],
+                            expected.loc[key].to_numpy()), (level, period, key)
+        start, end = raw_df.date.iloc[[40, 0]].sort_values()
+        window = stored.region('safety_region', 'VR03', 'day', start, end)
+        assert window.date.min() == start and window.date.max() == end
+    print(f'Rollup cube matches the raw rows: {cube.arrays[("municipality", "day")].shape}')
+
+def check_daemon():
+    ''' Runs daemon cycles against the offline stand-in sources,
+    checking that a cycle without changed sources runs no tasks, and
+    that a changed source only reruns the tasks depending on it. '''
+    from benchmarks import offline_pipeline
+    from daemon import Daemon
+    from pipeline import Pipeline
+    with offline_pipeline(50, 200, os.path.abspath(RAPPORT_PDF)) as standin:
+        pipeline = Pipeline(cache_dir=os.path.join(os.getcwd(), '.pipeline_cache'))
+        daemon = Daemon(interval=0, pipeline=pipeline)
+        record = daemon.cycle()
+        assert len(record['run']) == len(pipeline.tasks), record
+        requests_made = standin.request_count
+        record = daemon.cycle()
+        assert record['run'] == [] and record['changed'] == [], record
+        assert standin.request_count - requests_made == len(daemon.poll())
+        standin.set_route('/zkh.json', synthetic.nice_json_bytes(200, seed=3))
+        record = daemon.cycle()
+        assert record['changed'] == ['fetch_zkh'], record
+        assert record['run'] == ['export', 'fetch_zkh', 'merge', 'plots', 
+            'regression', 'rolling_regression', 'weekday_adjustment'], record
+        with open(daemon.log_path) as f:
+            assert len(f.readlines()) == 3
+    print('Daemon reruns only the tasks downstream of a changed source.')
+
+def check_api_server(n_requests=200):
+    ''' Serves the exported data of a temporary directory, checking
+    filtering, compression, and ETags, that a changed export is loaded
+    as a new version, and that requests made while versions are
+    swapped are answered entirely from one version. '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            dframe = synthetic.merged_frame(200)
+            getdata.export_data(dframe)
+            api = api_server.ApiServer(port=0)
+            assert api.reload() and not api.reload()
+            with api:
+                url = api.url('/data/merged.json?start=2020-03-02&end=2020-03-08'
+                    '&columns=date,infection_day')
+                response = requests.get(url)
+                assert response.headers['Content-Encoding'] == 'gzip'
+                expected = dframe[dframe.date.between('2020-03-02', '2020-03-08')]
+                assert [row['infection_day'] for row in response.json()] == \
+                    expected.infection_day.tolist()
+                etag = response.headers['ETag']
+                assert requests.get(url, headers={'If-None-Match' : etag}).status_code == 304
+                assert requests.get(api.url('/data/merged.json?columns=nope')).status_code == 400
+                assert requests.get(api.url('/data/nope.json')).status_code == 404
+                dframe.loc[5, 'infection_day'] += 1
+                getdata.export_data(dframe)
+                assert api.reload()
+                assert requests.get(url, headers={'If-None-Match' : etag}).status_code == 200
+                versions = {version.id : version for version in
+                    [api.version, api_server.DatasetVersion({'merged' : dframe.head(100)})]}
+                mismatches = []
+                def fetch():
+                    session = requests.Session()
+                    for _ in range(n_requests):
+                        response = session.get(api.url('/data/merged.csv'))
+                        version = versions[response.headers['X-Dataset-Version']]
+                        if response.content != version.responses[
+                                ('merged', 'csv', None, None, None)].body:
+                            mismatches.append(version.id)
+                threads = [threading.Thread(target=fetch) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                while any(thread.is_alive() for thread in threads):
+                    for version in versions.values():
+                        api.version = version
+                        time.sleep(0.001)
+                for thread in threads:
+                    thread.join()
+                assert not mismatches, mismatches
+        finally:
+            os.chdir(cwd)
+    print(f'API server: {api.request_count} requests, versions swapped atomically.')
+
+def check_pipeline():
+    ''' Runs the pipeline against the offline stand-in sources, and
+    checks that unchanged tasks are served from the cache, and that 
+    a changed source only reruns the tasks depending on it. '''
+    from benchmarks import offline_pipeline
+    from pipeline import Pipeline
+    data_tasks = ['merge', 'export', 'plots', 'regression', 
+        'rolling_regression', 'weekday_adjustment']
+    report_tasks = ['parse_report', 'testing_plot']
+    factors_path = adjustment.factors_path()
+    factors_before = os.path.exists(factors_path) and os.stat(factors_path).st_mtime
+    with offline_pipeline(50, 200, os.path.abspath(RAPPORT_PDF)) as standin:
+        cache_dir = os.path.join(os.getcwd(), '.pipeline_cache')
+        status = Pipeline(cache_dir=cache_dir).run()
+        assert set(status.values()) == {'run'}, status
+        plot_tasks = [task for task in Pipeline(cache_dir=cache_dir).tasks.values()
+            if task.group == 'plots']
+        manifest = plotfuncs.load_manifest('plots')
+        assert all(os.path.basename(path) in manifest for task in plot_tasks
+            for path in task.outputs() if path.endswith('.png')), manifest
+        status = Pipeline(cache_dir=cache_dir).run()
+        assert all(status[name] == 'cached' for name in 
+            ['parse_rivm'] + data_tasks + report_tasks), status
+        standin.set_route('/ic.json', synthetic.nice_json_bytes(200, seed=3))
+        status = Pipeline(cache_dir=cache_dir).run()
+        assert status['parse_rivm'] == 'cached', status
+        assert all(status[name] == 'run' for name in data_tasks), status
+        assert all(status[name] == 'cached' for name in report_tasks), status
+        os.remove('reg_results.txt')
+        requests_made = standin.request_count
+        status = Pipeline(cache_dir=cache_dir, offline=True).run(['regression'])
+        assert status == {'fetch_rivm' : 'cached', 'fetch_ic' : 'cached',
+            'fetch_zkh' : 'cached', 'parse_rivm' : 'cached', 
+            'merge' : 'cached', 'regression' : 'run'}, status
+        assert standin.request_count == requests_made
+    # The synthetic factors were cached in the temporary directory
+    assert factors_before == (os.path.exists(factors_path) and
+        os.stat(factors_path).st_mtime)
+    print('Pipeline only reruns the tasks downstream of changes.')
+
+def check_snapshot_replay():
+    ''' Records the sources and the rapport served by the stand-in 
+    into a snapshot, then replays them after the stand-in is stopped,
+    with requests disabled, checking that the results are equal. '''
+    pdf_name = os.path.basename(RAPPORT_PDF)
+    with open(RAPPORT_PDF, 'rb') as f:
+        pdf = f.read()
+    rapport_url, rapport_host = rapport_data.RAPPORT_URL, rapport_data.RAPPORT_HOST
+    session_request = requests.Session.request
+    snapshot_dir = snapshots.SNAPSHOT_DIR
+    with scratch_directory() as tmp_dir:
+        snapshots.SNAPSHOT_DIR = os.path.join(tmp_dir, 'snapshots')
+        try:
+            with StandinServer() as standin:
+                serve_sources(standin)
+                standin.set_route('/rapporten', 
+                    synthetic.rapport_listing_html(pdf_name))
+                standin.set_route('/documenten/' + pdf_name, pdf)
+                rapport_data.RAPPORT_URL = standin.url('/rapporten')
+                rapport_data.RAPPORT_HOST = standin.url('')
+                httpclient.record('check')
+                recorded = getdata.data_main(concurrent=True)
+                recorded_stream = getdata.data_main(stream=True)
+                online_rapport = rapport_data.retreive_online_rapport()
+                rapport_data.dowload_rapport(online_rapport[1], pdf_name, tmp_dir)
+            os.remove(os.path.join(tmp_dir, pdf_name))
+            httpclient.replay('check')
+            def no_network(*args, **kwargs):
+                raise AssertionError('Network access while replaying')
+            requests.Session.request = no_network
+            pd.testing.assert_frame_equal(getdata.data_main(concurrent=True), recorded)
+            pd.testing.assert_frame_equal(getdata.data_main(stream=True), 
+                recorded_stream)
+            assert rapport_data.retreive_online_rapport() == online_rapport
+            rapport_data.dowload_rapport(online_rapport[1], pdf_name, tmp_dir)
+            with open(os.path.join(tmp_dir, pdf_name), 'rb') as f:
+                assert f.read() == pdf
+            summary = snapshots.Snapshot('check').summary()
+            assert summary['responses'] == 5, summary
+        finally:
+            httpclient.live()
+            requests.Session.request = session_request
+            snapshots.SNAPSHOT_DIR = snapshot_dir
+            rapport_data.RAPPORT_URL = rapport_url
+            rapport_data.RAPPORT_HOST = rapport_host
+    print(f'Replayed snapshot: {summary}')
+
+if __name__ == '__main__':
+    check_parse_rivm_df()
+    check_concurrent_retrieval()
+    check_http_cache()
+    check_incremental_update()
+    check_plot_cache()
+    check_derived_series()
+    check_backfill()
+    check_stage_peaks()
+    check_batch_regression()
+    check_rolling_regression()
+    check_weekday_adjustment()
+    check_rollup_cube()
+    check_pipeline()
+    check_daemon()
+    check_api_server()
+    check_snapshot_replay()
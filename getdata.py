@@ -1,9 +1,35 @@
-import requests
 import json
+import numpy as np
 import pandas as pd
 import os
-import isoweek
+import re
+import sys
+import codecs
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+import httpclient
+import instrument
+import storage
+import rollup
+from weeknumbers import week_numbers
+
+RIVM_URL = 'https://data.rivm.nl/covid-19/COVID-19_aantallen_gemeente_per_dag.json'
+NICE_URL_IC = 'https://stichting-nice.nl/covid-19/public/intake-count/'
+NICE_URL_ZKH = 'https://stichting-nice.nl/covid-19/public/zkh/intake-count/'
+# (connect, read) timeouts in seconds per source
+NICE_TIMEOUT = (10, 30)
+RIVM_TIMEOUT = (10, 300)
+RIVM_CHUNK_SIZE = 1 << 20
+DAY_COLUMNS = ['infection_day', 'hospital_day', 'dead_day']
+# Explicit schema of the raw RIVM feed: the strings repeated on every
+# day are stored as categoricals, the counts as the narrowest integer
+# type holding them, and the dates parsed once per distinct value
+RIVM_CATEGORICAL = ['Municipality_code', 'Municipality_name', 'Province',
+    'Security_region_code', 'Security_region_name', 
+    'Municipal_health_service', 'ROAZ_region']
+RIVM_COUNTS = ['Total_reported', 'Hospital_admission', 'Deceased']
+RIVM_DATES = ['Date_of_report', 'Date_of_publication']
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
 
 def check_request_response(response):
     if response.raise_for_status() is None:
@@ -12,67 +38,195 @@ def check_request_response(response):
         print(response.raise_for_status())
         sys.exit()
 
-def get_nice_data(headers, nice_url, variable_name):
+def get_nice_data(headers, nice_url, variable_name, session=None,
+        timeout=NICE_TIMEOUT):
     ''' Retreives either the amount of current patients in the 
     hospital or in the IC (depending on inputted variable_name)
     JSON data from stichting nice using the requests module, 
     loads the json into a dataframe, and returns said dataframe. '''
-    response = requests.get(nice_url, headers=headers)
+    with instrument.stage('download_nice', source=variable_name):
+        response = httpclient.get(nice_url, headers=headers, 
+            timeout=timeout, session=session)
+        content = response.content
     if check_request_response(response):
-        dframe = pd.DataFrame(json.loads(response.content))
-        dframe.rename(columns = {'value' : variable_name}, inplace = True)
-        dframe['date'] = pd.to_datetime(dframe.date)
+        with instrument.stage('parse_nice', source=variable_name) as record:
+            dframe = pd.DataFrame(json.loads(content))
+            dframe.rename(columns = {'value' : variable_name}, inplace = True)
+            dframe['date'] = pd.to_datetime(dframe.date)
+            record['rows'] = len(dframe)
         return dframe
 
-def calculate_week_numer(row):
-    ''' Function using the Isoweek module to calculate the week number
-    corresponsing with a given date. '''
-    return isoweek.Week.withdate(row['date']).isoformat()
-
-def get_rivm_data_main(headers, url):
-    ''' Retreives RIVM data using requests. Additionally sets up the 
-    date column as datetime and calculates ISO week number. 
-    Requests the json file containing the data, and returns it
-    as a dataframe. '''
-    response = requests.get(url, headers=headers)
+def parse_dates_once(values):
+    ''' Parses a column of date strings, parsing each distinct string
+    once and mapping the parsed dates back onto the rows. '''
+    codes, uniques = pd.factorize(values)
+    dates = pd.DatetimeIndex(pd.to_datetime(uniques))
+    return pd.Series(dates.take(codes, allow_fill=True, fill_value=pd.NaT),
+        index=values.index, name=values.name)
+
+def narrowest_integers(values):
+    ''' Returns the column of counts as the narrowest signed integer
+    type holding all of them, or its nullable variant (e.g. Int16) if
+    any count is missing. '''
+    missing = values.isna()
+    for int_type in INTEGER_TYPES:
+        info = np.iinfo(int_type)
+        if missing.all() or (info.min <= values.min() and values.max() <= info.max):
+            break
+    if missing.any():
+        return values.astype(f'Int{info.bits}')
+    return values.astype(int_type)
+
+def apply_rivm_schema(dframe):
+    ''' Converts the columns of the raw RIVM dataframe (as loaded from
+    the JSON feed) to the types of the RIVM schema, and adds the
+    publication date as the date column. '''
+    for column in RIVM_CATEGORICAL:
+        if column in dframe:
+            dframe[column] = dframe[column].astype('category')
+    for column in RIVM_COUNTS:
+        dframe[column] = narrowest_integers(dframe[column])
+    for column in RIVM_DATES:
+        if column in dframe:
+            dframe[column] = parse_dates_once(dframe[column])
+    dframe['date'] = dframe.Date_of_publication
+    return dframe
+
+def get_rivm_data_main(headers, url, session=None, timeout=RIVM_TIMEOUT):
+    ''' Retreives RIVM data using requests. Additionally applies the
+    RIVM schema (see apply_rivm_schema). Requests the json file 
+    containing the data, and returns it as a dataframe. The ISO week
+    numbers are added after summing by day (see add_week_totals). '''
+    with instrument.stage('download_rivm'):
+        response = httpclient.get(url, headers=headers, 
+            timeout=timeout, session=session)
+        content = response.content
     if check_request_response(response):
         try:
-            dframe = pd.DataFrame(json.loads(response.content))
-            dframe['date'] = pd.to_datetime(dframe.Date_of_publication)
-            dframe['week_number'] = dframe.apply(calculate_week_numer, axis=1)
+            with instrument.stage('parse_rivm_json') as record:
+                dframe = apply_rivm_schema(pd.DataFrame(json.loads(content)))
+                record['rows'] = len(dframe)
             return dframe
         except ValueError:
             print('None JSON response received from RIVM')
             sys.exit()
 
-def sum_day_and_week_rivm(dframe):
-    ''' Takes the raw dataframe and returns a dataframe with 
-    the reported infection, hospital admissions, and deaths
-    summed by week and by day. '''
-    dframe['infection_day'] = dframe.Total_reported.groupby(
-        dframe.date).transform('sum')
-    dframe['hospital_day'] = dframe.Hospital_admission.groupby(
-        dframe.date).transform('sum')
-    dframe['dead_day'] = dframe.Deceased.groupby(
-        dframe.date).transform('sum')
-    dframe['infection_week'] = dframe.Total_reported.groupby(
-        dframe.week_number).transform('sum')
-    dframe['hospital_week'] = dframe.Hospital_admission.groupby(
-        dframe.week_number).transform('sum')
-    dframe['dead_week'] = dframe.Deceased.groupby(
-        dframe.week_number).transform('sum')  
+def iter_json_array(chunks):
+    ''' Incrementally decodes a JSON array of objects from an iterable
+    of byte chunks, yielding the objects one by one. Only the undecoded
+    tail of the stream is kept in memory. '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    separators = re.compile(r'[\s,]*')
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        pos = separators.match(buffer).end()
+        if not started:
+            if pos == len(buffer):
+                continue
+            if buffer[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos = separators.match(buffer, pos + 1).end()
+        while pos < len(buffer):
+            if buffer[pos] == ']':
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Incomplete object, wait for the next chunk
+                break
+            yield record
+            pos = separators.match(buffer, pos).end()
+        buffer = buffer[pos:]
+    raise ValueError('Unexpected end of JSON array')
+
+def aggregate_rivm_records(records):
+    ''' Sums the reported infections, hospital admissions, and deaths
+    of the RIVM records by publication date as they arrive, and returns
+    the daily totals as a dataframe. '''
+    totals = {}
+    for record in records:
+        day = totals.get(record['Date_of_publication'])
+        if day is None:
+            day = totals[record['Date_of_publication']] = [0, 0, 0]
+        day[0] += record['Total_reported'] or 0
+        day[1] += record['Hospital_admission'] or 0
+        day[2] += record['Deceased'] or 0
+    dframe = pd.DataFrame.from_dict(totals, orient='index',
+        columns=['infection_day', 'hospital_day', 'dead_day'])
+    dframe.index = pd.to_datetime(dframe.index)
+    dframe = dframe.rename_axis('date').sort_index().reset_index()
+    return dframe
+
+def get_rivm_data_streaming(headers, url, session=None, timeout=RIVM_TIMEOUT,
+        chunk_size=RIVM_CHUNK_SIZE):
+    ''' Streaming alternative to get_rivm_data_main. Reads the RIVM
+    response body in chunks, parsing and summing the records by date
+    while downloading, so memory use depends on the number of dates
+    rather than the number of rows. Returns the daily totals. '''
+    response = httpclient.get(url, headers=headers, 
+        timeout=timeout, session=session, stream=True)
+    if check_request_response(response):
+        try:
+            with instrument.stage('download_parse_rivm_stream') as record:
+                records = iter_json_array(response.iter_content(chunk_size))
+                dframe = aggregate_rivm_records(records)
+                record['rows'] = len(dframe)
+            return dframe
+        except ValueError:
+            print('None JSON response received from RIVM')
+            sys.exit()
+        finally:
+            response.close()
+
+def add_week_totals(daily_df):
+    ''' Takes a dataframe with one row per date holding the daily
+    totals, and adds the ISO week number and the weekly totals, which
+    are summed from the daily totals and joined back on the week. '''
+    dframe = daily_df.copy()
+    with instrument.stage('week_numbers', rows=len(dframe)):
+        dframe['week_number'] = week_numbers(dframe.date)
+    week_totals = dframe.groupby('week_number').agg(
+        infection_week=('infection_day', 'sum'),
+        hospital_week=('hospital_day', 'sum'),
+        dead_week=('dead_day', 'sum')
+        )
+    dframe = dframe.merge(week_totals, how='left', on='week_number')
     return dframe
 
+@instrument.timed('aggregate_rivm_by_day', rows=True)
+def sum_rivm_by_day(dframe):
+    ''' Takes the raw dataframe and returns the reported infections,
+    hospital admissions, and deaths summed by day. The counts are
+    summed as int64, as the schema stores them in narrower types. '''
+    dframe = dframe[RIVM_COUNTS].fillna(0).astype(np.int64).assign(date=dframe.date)
+    return dframe.groupby('date').agg(
+        infection_day=('Total_reported', 'sum'),
+        hospital_day=('Hospital_admission', 'sum'),
+        dead_day=('Deceased', 'sum')
+        ).reset_index()
+
+def sum_day_and_week_rivm(dframe):
+    ''' Takes the raw dataframe and returns a dataframe with one
+    row per date, holding the reported infection, hospital admissions,
+    and deaths summed by day and by week. The raw rows are only
+    aggregated once (by date); the weekly totals are summed from
+    the daily ones. '''
+    return add_week_totals(sum_rivm_by_day(dframe))
 
 def drop_redudant(dframe):
-    ''' Returns the rivm dataframe with only the relevant
-    columns (dropping the others). '''
-    dframe.drop_duplicates(subset=['date'], keep='first', inplace=True)
+    ''' Returns the rivm dataframe with one observation per date
+    and only the relevant columns (dropping the others). '''
+    dframe = dframe.drop_duplicates(subset=['date'], keep='first')
     cols_to_keep = ['date', 'week_number', 'infection_day', 
             'hospital_day', 'dead_day', 'infection_week', 
             'hospital_week', 'dead_week']
     return dframe[cols_to_keep]
 
+@instrument.timed('merge', rows=True)
 def merge_dframes(ic_df, zkh_df, rivm_df):
     ''' Returns the combined NICE dataframes and
     the RIVM dataframe, merged on the date variable. '''
@@ -83,33 +237,110 @@ def merge_dframes(ic_df, zkh_df, rivm_df):
 def parse_rivm_df(raw_rivm_df):
     ''' Further processes the rivm dataframe. First
     function sums data by day and week. Second function
-    drops duplicates, keeping 1 observation per date.'''
+    keeps only the relevant columns.'''
     dframe = sum_day_and_week_rivm(raw_rivm_df)
     dframe = drop_redudant(dframe)
     return dframe
 
-def export_data(dframe):
-    ''' Export data retreived from RIVM and NICE to a csv file
-    in the current directory. '''
-    dframe.to_csv(os.path.join(os.getcwd(), 'export.csv'))
+@instrument.timed('aggregate_rivm_by_week', rows=True)
+def parse_rivm_daily_df(daily_df):
+    ''' Equivalent of parse_rivm_df for the daily totals returned
+    by get_rivm_data_streaming. '''
+    dframe = add_week_totals(daily_df)
+    return drop_redudant(dframe)
+
+def revised_weeks(previous_df, daily_df):
+    ''' Compares the daily totals with those of the previously 
+    exported data, and returns the ISO weeks containing dates that
+    are new, revised, or no longer present. '''
+    previous = previous_df[['date'] + DAY_COLUMNS]
+    compared = daily_df.merge(previous, how='outer', on='date', 
+        suffixes=('', '_prev'))
+    changed = pd.Series(False, index=compared.index)
+    for col in DAY_COLUMNS:
+        changed |= compared[col].ne(compared[col + '_prev'])
+    return set(week_numbers(compared.date[changed]))
+
+@instrument.timed('incremental_update', rows=True)
+def update_rivm_df(previous_df, daily_df):
+    ''' Incremental alternative to parse_rivm_daily_df. Takes the
+    previously exported data and the current daily totals, and only
+    recomputes the weeks that were added or revised since, keeping
+    the rows of all other weeks as they were. '''
+    weeks = revised_weeks(previous_df, daily_df)
+    print(f'Recomputing {len(weeks)} week(s) of RIVM data.')
+    dframe = drop_redudant(previous_df[~previous_df.week_number.isin(weeks)])
+    if weeks:
+        patch = daily_df[week_numbers(daily_df.date).isin(weeks)]
+        dframe = pd.concat([dframe, parse_rivm_daily_df(patch)])
+    return dframe.sort_values('date').reset_index(drop=True)
 
-def data_retreival():
+def export_stem():
+    return os.path.join(os.getcwd(), 'export')
+
+def load_export(stem=None):
+    ''' Reads the data previously written by export_data, with the
+    date column parsed. Returns None if there is no export yet. '''
+    return storage.read_frame(stem or export_stem(), 
+        parse_dates=['date'], index=True)
+
+@instrument.timed('export_data')
+def export_data(dframe, stem=None):
+    ''' Export data retreived from RIVM and NICE to a file in the
+    current directory, in the configured storage format (export.csv
+    by default). The file is written next to the old one and then
+    swapped in, so an interrupted run never leaves a partial export
+    behind for the next incremental update. '''
+    storage.write_frame(dframe, stem or export_stem(), index=True)
+
+@instrument.timed()
+def data_retreival(stream=False, concurrent=False):
     ''' Retreivs the various data sources using the
-    requests library. '''
-    HEADERS = {'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) ' \
-        'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36')}
-    RIVM_URL = 'https://data.rivm.nl/covid-19/COVID-19_aantallen_gemeente_per_dag.json'
-    NICE_URL_IC = 'https://stichting-nice.nl/covid-19/public/intake-count/'
-    NICE_URL_ZKH = 'https://stichting-nice.nl/covid-19/public/zkh/intake-count/'
-    ic_df = get_nice_data(HEADERS, NICE_URL_IC, 'IC_current')
-    zkh_df = get_nice_data(HEADERS, NICE_URL_ZKH, 'ZKH_current')
-    raw_rivm_df = get_rivm_data_main(HEADERS, RIVM_URL) 
+    requests library. With stream set, the RIVM data is
+    aggregated by date while downloading (see
+    get_rivm_data_streaming). With concurrent set, the three
+    sources are downloaded in parallel over the shared session. '''
+    session = httpclient.get_session()
+    get_rivm = get_rivm_data_streaming if stream else get_rivm_data_main
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            rivm_future = executor.submit(get_rivm, httpclient.HEADERS, 
+                RIVM_URL, session)
+            ic_future = executor.submit(get_nice_data, httpclient.HEADERS, 
+                NICE_URL_IC, 'IC_current', session)
+            zkh_future = executor.submit(get_nice_data, httpclient.HEADERS, 
+                NICE_URL_ZKH, 'ZKH_current', session)
+            ic_df = ic_future.result()
+            zkh_df = zkh_future.result()
+            raw_rivm_df = rivm_future.result()
+    else:
+        ic_df = get_nice_data(httpclient.HEADERS, NICE_URL_IC, 
+            'IC_current', session)
+        zkh_df = get_nice_data(httpclient.HEADERS, NICE_URL_ZKH, 
+            'ZKH_current', session)
+        raw_rivm_df = get_rivm(httpclient.HEADERS, RIVM_URL, session)
     return ic_df, zkh_df, raw_rivm_df
 
-def data_main():
+def data_main(stream=False, concurrent=False, incremental=False):
+    ''' Retreives and combines the RIVM and NICE data. With
+    incremental set, the previous export is updated with only the
+    new and revised weeks, instead of recomputing the RIVM data in
+    full (see update_rivm_df). Unless streaming, the raw RIVM rows
+    are summed once into the regional rollup cube (stored in
+    data/rollup), and the national daily totals are taken from it. '''
     print('Starting data retreival')
-    ic_df, zkh_df, raw_rivm_df = data_retreival()
-    rivm_df = parse_rivm_df(raw_rivm_df)
+    ic_df, zkh_df, raw_rivm_df = data_retreival(stream, concurrent)
+    if stream:
+        daily_df = raw_rivm_df
+    else:
+        cube = rollup.build_cube(raw_rivm_df)
+        cube.save()
+        daily_df = cube.national('day')
+    previous_df = load_export() if incremental else None
+    if previous_df is not None:
+        rivm_df = update_rivm_df(previous_df, daily_df)
+    else:
+        rivm_df = parse_rivm_daily_df(daily_df)
     dframe = merge_dframes(ic_df, zkh_df, rivm_df)
     return dframe
 
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+class CachedResponse:
+    ''' Stands in for a requests response whose body is served from
+    the cache directory. '''
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+
+    def raise_for_status(self):
+        return None
+
+    def _open(self):
+        return open(self.path, 'rb')
+
+    @property
+    def content(self):
+        with self._open() as f:
+            return f.read()
+
+    def iter_content(self, chunk_size=1):
+        with self._open() as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = f.read(chunk_size)
+
+    def close(self):
+        pass
+
+class HTTPCache:
+    ''' On-disk cache of response bodies, revalidated with
+    If-None-Match / If-Modified-Since. A 304 response is served from
+    disk. The cache is limited to max_bytes, evicting the least recently
+    used bodies first. Keeps count of hits, misses, and bytes saved. '''
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except ValueError:
+            return {}
+        return {url : entry for url, entry in entries.items()
+            if os.path.exists(self._body_path(url))}
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _body_path(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    def stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'bytes_saved' : self.bytes_saved,
+            'entries' : len(self.entries),
+            'size' : sum(entry['size'] for entry in self.entries.values())
+            }
+
+    def validators(self, url):
+        ''' Returns the conditional request headers for the cached
+        version of url (empty if not cached). '''
+        headers = {}
+        with self._lock:
+            entry = self.entries.get(url)
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, session, url, headers=None, timeout=None, stream=False):
+        ''' Performs a conditional GET request. Returns a CachedResponse
+        if the server replied 304 (or when a new body was stored while
+        streaming), and the response itself otherwise. '''
+        request_headers = dict(headers or {})
+        request_headers.update(self.validators(url))
+        response = session.get(url, headers=request_headers,
+            timeout=timeout, stream=stream)
+        if response.status_code == 304:
+            response.close()
+            with self._lock:
+                entry = self.entries.get(url)
+                if entry:
+                    entry['last_used'] = time.time()
+                    self.hits += 1
+                    self.bytes_saved += entry['size']
+                    self._save_index()
+            if entry:
+                return CachedResponse(url, self._body_path(url))
+            # Evicted in the meantime, request the full body again
+            response = session.get(url, headers=headers,
+                timeout=timeout, stream=stream)
+        with self._lock:
+            self.misses += 1
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return response
+        if stream:
+            self._store(url, response.iter_content(1 << 20), etag, last_modified)
+            response.close()
+            return CachedResponse(url, self._body_path(url))
+        self._store(url, [response.content], etag, last_modified)
+        return response
+
+    def _store(self, url, chunks, etag, last_modified):
+        path = self._body_path(url)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self.entries[url] = {
+                'etag' : etag,
+                'last_modified' : last_modified,
+                'size' : size,
+                'last_used' : time.time()
+                }
+            self._evict(keep=url)
+            self._save_index()
+
+    def _evict(self, keep=None):
+        ''' Removes the least recently used bodies until the cache
+        fits in max_bytes. '''
+        total = sum(entry['size'] for entry in self.entries.values())
+        by_age = sorted(self.entries, key=lambda url: self.entries[url]['last_used'])
+        for url in by_age:
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            total -= self.entries.pop(url)['size']
+            if os.path.exists(self._body_path(url)):
+                os.remove(self._body_path(url))
@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from httpcache import HTTPCache
+from snapshots import Snapshot
+
+HEADERS = {'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) ' \
+    'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36')}
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_RETRIES = 3
+POOL_SIZE = 10
+CACHE_DIR = os.path.join(os.getcwd(), '.http_cache')
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+USE_CACHE = True
+# Name of the snapshot the response bodies are recorded to, or replayed
+# from without any network access (see snapshots.py)
+RECORD_SNAPSHOT = os.environ.get('COVID_NL_RECORD')
+REPLAY_SNAPSHOT = os.environ.get('COVID_NL_REPLAY')
+
+_session = None
+_cache = None
+_snapshot = None
+_session_lock = threading.Lock()
+
+def create_session(retries=DEFAULT_RETRIES, pool_size=POOL_SIZE):
+    ''' Returns a requests session with a connection pool, retrying
+    failed connections and 5xx responses with an exponential backoff. '''
+    retry = Retry(total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session():
+    ''' Returns the session shared by all requests of this process,
+    creating it on first use. '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def get_cache():
+    ''' Returns the HTTP cache shared by all requests of this process,
+    creating it on first use. '''
+    global _cache
+    with _session_lock:
+        if _cache is None:
+            _cache = HTTPCache(CACHE_DIR, CACHE_MAX_BYTES)
+        return _cache
+
+def get_snapshot():
+    ''' Returns the snapshot being replayed or recorded to (None if
+    neither), opening it on first use. '''
+    global _snapshot
+    name = REPLAY_SNAPSHOT or RECORD_SNAPSHOT
+    with _session_lock:
+        if name is None:
+            return None
+        if _snapshot is None or _snapshot.name != name:
+            _snapshot = Snapshot(name)
+        return _snapshot
+
+def replay(name):
+    ''' Serves all following requests from the named snapshot. '''
+    global REPLAY_SNAPSHOT, RECORD_SNAPSHOT
+    REPLAY_SNAPSHOT, RECORD_SNAPSHOT = name, None
+
+def record(name):
+    ''' Records the bodies of all following requests to the named
+    snapshot. '''
+    global REPLAY_SNAPSHOT, RECORD_SNAPSHOT
+    REPLAY_SNAPSHOT, RECORD_SNAPSHOT = None, name
+
+def live():
+    ''' Stops replaying or recording. '''
+    global REPLAY_SNAPSHOT, RECORD_SNAPSHOT
+    REPLAY_SNAPSHOT = RECORD_SNAPSHOT = None
+
+def get(url, headers=None, timeout=DEFAULT_TIMEOUT, session=None, stream=False):
+    ''' Performs a GET request over the shared (or inputted) session,
+    and returns the response. Unless USE_CACHE is disabled, the
+    request is revalidated against the HTTP cache, and unchanged
+    bodies are served from disk. When replaying a snapshot, the
+    recorded body is returned without any network access; when 
+    recording, the body is stored in the snapshot and served from 
+    there. '''
+    if REPLAY_SNAPSHOT:
+        if not get_snapshot().exists():
+            print(f'Snapshot {REPLAY_SNAPSHOT} not found.')
+            sys.exit()
+        return get_snapshot().response(url)
+    if session is None:
+        session = get_session()
+    if USE_CACHE:
+        response = get_cache().get(session, url, headers=headers, 
+            timeout=timeout, stream=stream)
+    else:
+        response = session.get(url, headers=headers, timeout=timeout, 
+            stream=stream)
+    if RECORD_SNAPSHOT and response.status_code == 200:
+        snapshot = get_snapshot()
+        snapshot.record(url, response.iter_content(1 << 20))
+        response.close()
+        return snapshot.response(url)
+    return response
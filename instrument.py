@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Set COVID_NL_INSTRUMENT=0 to turn all stages into no-ops
+ENABLED = os.environ.get('COVID_NL_INSTRUMENT', '1') != '0'
+# Tracing allocations is precise but slows the pipeline down, so the
+# tracemalloc peak is only recorded when asked for
+TRACE_MEMORY = os.environ.get('COVID_NL_TRACEMALLOC', '0') == '1'
+
+_records = []
+_lock = threading.Lock()
+# The tracemalloc peak seen so far by each open stage (a one item list)
+_open_peaks = []
+_started = time.time()
+
+def max_rss_mb():
+    ''' Returns the peak resident set size of this process in MB. '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def rss_mb():
+    ''' Returns the current resident set size of this process in MB,
+    or None where /proc is not available. '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+
+def add_record(record):
+    with _lock:
+        _records.append(record)
+
+def _carry_peak():
+    ''' Adds the tracemalloc peak since it was last reset to the peaks
+    of the open stages. Call with the lock held. '''
+    peak = tracemalloc.get_traced_memory()[1]
+    for open_peak in _open_peaks:
+        open_peak[0] = max(open_peak[0], peak)
+
+@contextmanager
+def stage(name, **info):
+    ''' Records the wall time, CPU time, and peak memory of the code
+    run within the context under the stage name. Yields the record
+    (a dict), so the caller can add e.g. the number of rows. The CPU
+    time is that of the whole process, so it includes other threads
+    running at the same time. The tracemalloc peak is reset when a
+    stage starts, and the peak reached until then is carried over to
+    the stages still open, so an outer stage includes the peaks of
+    the stages nested in it. '''
+    if not ENABLED:
+        yield {}
+        return
+    record = {'stage' : name}
+    record.update(info)
+    peak = [0]
+    if TRACE_MEMORY:
+        with _lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                _carry_peak()
+                tracemalloc.reset_peak()
+            _open_peaks.append(peak)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+        record['max_rss_mb'] = max_rss_mb()
+        if TRACE_MEMORY:
+            with _lock:
+                _carry_peak()
+                _open_peaks[:] = [open_peak for open_peak in _open_peaks
+                    if open_peak is not peak]
+            record['tracemalloc_peak_mb'] = round(peak[0] / 1e6, 1)
+        add_record(record)
+
+def timed(name=None, rows=False):
+    ''' Decorator running the function as a stage (by default named
+    after the function). With rows set, the length of the returned
+    value is recorded as the number of rows. '''
+    def decorator(func):
+        stage_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if rows and hasattr(result, '__len__'):
+                    record['rows'] = len(result)
+            return result
+        return wrapper
+    return decorator
+
+def records():
+    with _lock:
+        return list(_records)
+
+def reset():
+    global _started
+    with _lock:
+        del _records[:]
+        _started = time.time()
+
+def report():
+    ''' Returns the run report: the recorded stages in the order they
+    finished, and the totals of the run. '''
+    stages = records()
+    return {
+        'started' : time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_started)),
+        'wall_s' : round(time.time() - _started, 4),
+        'max_rss_mb' : max_rss_mb(),
+        'stages' : stages
+        }
+
+def write_report(path):
+    ''' Writes the run report as JSON. Does nothing when disabled. '''
+    if not ENABLED:
+        return
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=4, default=str)
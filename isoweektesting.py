@@ -1,15 +1,33 @@
-import requests
-import json
 import pandas as pd
-import os
 import isoweek
-import datetime
+from weeknumbers import week_numbers
 
-def calc_week(row):
-    return isoweek.Week.withdate(datetime.datetime.strptime(row['date'], '%Y-%m-%d')).isoformat()
+def calc_week(date):
+    return isoweek.Week.withdate(date).isoformat()
 
-df = pd.read_csv('export.csv')
+def check_week_numbers(start='2015-01-01', end='2030-12-31'):
+    ''' Compares the vectorized week_numbers with the Isoweek module
+    for every date in the inputted range, which covers several year
+    boundary weeks (e.g. 2015W53, 2020W53, 2026W53). '''
+    dates = pd.Series(pd.date_range(start, end, freq='D'))
+    expected = dates.map(calc_week)
+    result = week_numbers(dates)
+    mismatches = dates[result != expected]
+    if len(mismatches):
+        print(mismatches)
+        raise AssertionError(f'{len(mismatches)} week numbers differ from isoweek')
+    print(f'Week numbers of {len(dates)} dates match isoweek.')
 
-df['w'] = df.apply(calc_week, axis=1)
-print(df)
-print(df.w.min())
\ No newline at end of file
+def check_export(path='export.csv'):
+    ''' Recalculates the week numbers of the exported data, and checks
+    them against the stored ones. '''
+    df = pd.read_csv(path)
+    df['w'] = week_numbers(df.date)
+    if not (df.w == df.week_number).all():
+        print(df[df.w != df.week_number])
+        raise AssertionError('Week numbers in export differ')
+    print(f'Week numbers in {path} match ({df.w.min()} - {df.w.max()}).')
+
+if __name__ == '__main__':
+    check_week_numbers()
+    check_export()
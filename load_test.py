@@ -0,0 +1,130 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+import numpy as np
+import synthetic
+import api_server
+import regressions
+import rapport_data
+
+# Requests sent by every worker in turn, unless paths are inputted
+DEFAULT_PATHS = [
+    '/',
+    '/data/merged.json',
+    '/data/merged.csv',
+    '/data/merged.json?start=2020-10-01&end=2020-12-31&columns=date,infection_day,IC_current',
+    '/data/testing.json',
+    '/data/regression.json'
+    ]
+
+def synthetic_version(n_days=3 * 365):
+    ''' Returns a dataset version holding synthetic merged, testing,
+    and regression datasets. '''
+    merged = synthetic.merged_frame(n_days)
+    testing = rapport_data.process_test_data_df(synthetic.ggd_table(), export=False)
+    return api_server.DatasetVersion({
+        'merged' : merged,
+        'testing' : testing,
+        'regression' : regressions.results_frame(
+            regressions.day_contrib_reg_batch(merged))
+        })
+
+def worker(base_url, paths, deadline, headers, latencies, statuses, errors,
+        lock, offset):
+    ''' Sends the requests in paths in turn over a single keep-alive
+    connection until the deadline, recording the latency in seconds
+    and the status of each response. '''
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+    etags = {}
+    i = offset
+    local_latencies, local_statuses, local_errors = [], {}, 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        request_headers = dict(headers)
+        if 'If-None-Match' in headers:
+            request_headers['If-None-Match'] = etags.get(path, '')
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=request_headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+            continue
+        local_latencies.append(time.perf_counter() - start)
+        local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    connection.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+        for status, count in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+def run_load(base_url, paths=DEFAULT_PATHS, concurrency=8, duration=10.0,
+        compressed=True, conditional=False):
+    ''' Sends requests to the API at base_url from concurrency threads
+    for duration seconds. With conditional set, the requests repeat
+    the last ETag of their path (measuring the 304 path). Returns the
+    requests per second and the latency percentiles in milliseconds. '''
+    headers = {'Accept-Encoding' : 'gzip' if compressed else 'identity'}
+    if conditional:
+        headers['If-None-Match'] = ''
+    latencies, statuses, errors = [], {}, []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [threading.Thread(target=worker, args=(base_url, paths, deadline,
+        headers, latencies, statuses, errors, lock, i))
+        for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests' : len(latencies),
+        'errors' : sum(errors),
+        'statuses' : {str(status) : count for status, count in sorted(statuses.items())},
+        'seconds' : round(elapsed, 2),
+        'requests_per_second' : round(len(latencies) / elapsed, 1),
+        'latency_ms' : {name : round(float(np.percentile(latencies, q)), 2)
+            for name, q in [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]}
+            if len(latencies) else {}
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of api_server.py')
+    parser.add_argument('--url',
+        help='Base url of a running API (default: serve synthetic data in process)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0,
+        help='Seconds to send requests for')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--no-gzip', action='store_true',
+        help='Request uncompressed responses')
+    parser.add_argument('--conditional', action='store_true',
+        help='Send If-None-Match with the last ETag of each path')
+    args = parser.parse_args(argv)
+    kwargs = dict(paths=args.paths, concurrency=args.concurrency,
+        duration=args.duration, compressed=not args.no_gzip,
+        conditional=args.conditional)
+    if args.url:
+        results = run_load(args.url, **kwargs)
+    else:
+        with api_server.ApiServer(port=0, version=synthetic_version()) as api:
+            results = run_load(api.url(), **kwargs)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,22 +1,70 @@
 import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import regressions
+import adjustment
 import plotfuncs
 import getdata
+import httpclient
+import instrument
 import rapport_data
 
-def main():
-	dframe = getdata.data_main()
+# Stages that can be run separately. The libraries used by a stage
+# (matplotlib, statsmodels/scipy, pdfminer/tabula/bs4) are only
+# imported once it runs.
+STAGES = ['data', 'plots', 'regression', 'testing']
+
+def load_data():
+	''' Returns the previously exported data, for stages run without
+	the data stage. '''
+	dframe = getdata.load_export()
+	if dframe is None:
+		print('No exported data found, run the data stage first.')
+		sys.exit()
+	return dframe
+
+def main(stages=None):
+	stages = stages or STAGES
 	plot_target_dir = os.path.join(os.getcwd(), 'plots')
-	plotfuncs.plot_and_save_all(dframe, plot_target_dir)	
+	if 'testing' in stages:
+		# Look up the newest RIVM rapport while the data is downloaded
+		executor = ThreadPoolExecutor(max_workers=1)
+		online_rapport = executor.submit(rapport_data.retreive_online_rapport)
+		executor.shutdown(wait=False)
+	if 'data' in stages:
+		dframe = getdata.data_main(concurrent=True, incremental=True)
+	elif 'plots' in stages or 'regression' in stages:
+		dframe = load_data()
+	if 'plots' in stages:
+		plotfuncs.plot_and_save_all(dframe, plot_target_dir)	
 	
-	reg_results =  regressions.day_contrib_reg(dframe,'infection')
-	regressions.export_regression_results(reg_results)
+	if 'regression' in stages:
+		reg_results = regressions.day_contrib_reg_batch(dframe)
+		regressions.export_regression_results(reg_results)
+		rolling_df = regressions.rolling_day_contrib_reg(dframe)
+		plotfuncs.plot_and_save_rolling(rolling_df, 'infection', plot_target_dir)
+		adjusted_df = adjustment.adjustment_main(dframe)
+		plotfuncs.plot_and_save_adjusted(adjusted_df, plot_target_dir)
 	
-	testing_df, rapport_name = rapport_data.main()
-	plotfuncs.plot_testing_data(testing_df, rapport_name, plot_target_dir)
-	getdata.export_data(dframe)
-
-if __name__== "__main__":
-	main()
+	if 'testing' in stages:
+		testing_df, rapport_name = rapport_data.main(online_rapport.result())
+		plotfuncs.plot_and_save_testing(testing_df, rapport_name, plot_target_dir)
+	if 'data' in stages:
+		getdata.export_data(dframe)
+	if httpclient.USE_CACHE and httpclient._cache is not None:
+		print(f'HTTP cache: {httpclient.get_cache().stats()}')
+	instrument.write_report(os.path.join(os.getcwd(), 'run_report.json'))
 
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description='Covid_NL data pipeline')
+	parser.add_argument('stages', nargs='*', metavar='stage',
+		help=f'Stages to run: {", ".join(STAGES)} (default: all)')
+	args = parser.parse_args(argv)
+	for stage in args.stages:
+		if stage not in STAGES:
+			parser.error(f'unknown stage: {stage}')
+	return args
 
+if __name__== "__main__":
+	main(parse_args().stages)
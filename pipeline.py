@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import getdata
+import storage
+import plotfuncs
+import httpclient
+import instrument
+import adjustment
+import regressions
+import rapport_data
+
+CACHE_DIR = os.path.join(os.getcwd(), '.pipeline_cache')
+INDEX_NAME = 'index.json'
+MAX_WORKERS = 4
+# Group of the tasks drawing with matplotlib (which is not thread safe)
+# and updating the manifest of the plots directory
+PLOT_GROUP = 'plots'
+
+class Task:
+    ''' A stage of the pipeline. func is called with the outputs of
+    the tasks in deps (in order). Source tasks read from the network,
+    and always run unless the pipeline is run offline. outputs returns
+    the files a task writes; the task is stale when one is missing.
+    Tasks of the same group never run at the same time. Bump version
+    when the code of a task changes, to run it again. '''
+
+    def __init__(self, name, func, deps=(), source=False, outputs=None,
+            version='1', group=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.source = source
+        self.outputs = outputs or (lambda: [])
+        self.version = version
+        self.group = group
+
+def plot_path(file_name):
+    return os.path.join(os.getcwd(), 'plots', file_name)
+
+def fetch_rivm():
+    return getdata.get_rivm_data_streaming(httpclient.HEADERS, getdata.RIVM_URL)
+
+def fetch_ic():
+    return getdata.get_nice_data(httpclient.HEADERS, getdata.NICE_URL_IC,
+        'IC_current')
+
+def fetch_zkh():
+    return getdata.get_nice_data(httpclient.HEADERS, getdata.NICE_URL_ZKH,
+        'ZKH_current')
+
+def export(dframe):
+    getdata.export_data(dframe)
+
+def plots(dframe):
+    plotfuncs.plot_and_save_all(dframe, plot_path(''))
+
+def regression(dframe):
+    regressions.export_regression_results(
+        regressions.day_contrib_reg_batch(dframe))
+
+def rolling_regression(dframe):
+    rolling_df = regressions.rolling_day_contrib_reg(dframe)
+    plotfuncs.plot_and_save_rolling(rolling_df, 'infection', plot_path(''))
+
+def weekday_adjustment(dframe):
+    plotfuncs.plot_and_save_adjusted(adjustment.adjustment_main(dframe),
+        plot_path(''))
+
+def testing_plot(report):
+    testing_df, rapport_name = report
+    plotfuncs.plot_and_save_testing(testing_df, rapport_name, plot_path(''))
+
+TASKS = [
+    Task('fetch_rivm', fetch_rivm, source=True),
+    Task('fetch_ic', fetch_ic, source=True),
+    Task('fetch_zkh', fetch_zkh, source=True),
+    Task('parse_rivm', getdata.parse_rivm_daily_df, ['fetch_rivm']),
+    Task('merge', getdata.merge_dframes, ['fetch_ic', 'fetch_zkh', 'parse_rivm']),
+    Task('export', export, ['merge'],
+        outputs=lambda: [storage.frame_path(getdata.export_stem())]),
+    Task('plots', plots, ['merge'], group=PLOT_GROUP,
+        outputs=lambda: [plot_path(file_name) for file_name, _ in
+            map(plotfuncs.PLOT_OUTPUTS.get, plotfuncs.PLOTS)]),
+    Task('regression', regression, ['merge'],
+        outputs=lambda: [os.path.join(os.getcwd(), 'reg_results.txt')]),
+    Task('rolling_regression', rolling_regression, ['merge'], group=PLOT_GROUP,
+        outputs=lambda: [plot_path('rollingweekday.png')]),
+    Task('weekday_adjustment', weekday_adjustment, ['merge'], group=PLOT_GROUP,
+        outputs=lambda: [plot_path('adjusteddaily.png'),
+            storage.frame_path(adjustment.adjusted_stem())]),
+    Task('fetch_report', rapport_data.retreive_online_rapport, source=True),
+    Task('parse_report', rapport_data.main, ['fetch_report'],
+        outputs=lambda: [storage.frame_path(rapport_data.test_data_stem())]),
+    Task('testing_plot', testing_plot, ['parse_report'], group=PLOT_GROUP,
+        outputs=lambda: [plot_path('testingweekly2.png')])
+    ]
+
+def fingerprint(value):
+    ''' Returns a hash of a task output. Dataframes are hashed by
+    their contents, so equal data gives an equal fingerprint. '''
+    hasher = hashlib.sha256()
+    def update(value):
+        if isinstance(value, pd.DataFrame):
+            hasher.update(repr(list(value.columns)).encode())
+            hasher.update(pd.util.hash_pandas_object(
+                value, index=False).to_numpy().tobytes())
+        elif isinstance(value, (tuple, list)):
+            hasher.update(f'{type(value).__name__}{len(value)}'.encode())
+            for item in value:
+                update(item)
+        else:
+            hasher.update(pickle.dumps(value))
+    update(value)
+    return hasher.hexdigest()
+
+class Pipeline:
+    ''' Runs the tasks needed for the inputted targets, in dependency
+    order, running independent tasks concurrently (except tasks of
+    the same group). The output of each task is cached on disk in
+    cache_dir, along with the key it was computed for: a hash of the
+    task version and the fingerprints of the outputs of its
+    dependencies. A task whose key did not change (and whose output
+    files exist) is not run again. '''
+
+    def __init__(self, tasks=TASKS, cache_dir=None, offline=False,
+            force=False, workers=MAX_WORKERS):
+        self.tasks = {task.name : task for task in tasks}
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        self.offline = offline
+        self.force = force
+        self.workers = workers
+        self.outputs = {}
+        self.status = {}
+        self.unchanged = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def _output_path(self, name):
+        return os.path.join(self.cache_dir, name + '.pkl')
+
+    def required(self, targets):
+        ''' Returns the targets and all tasks they depend on. '''
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.tasks:
+                raise ValueError(f'Unknown task: {name}')
+            if name not in required:
+                required.add(name)
+                pending.extend(self.tasks[name].deps)
+        return required
+
+    def task_key(self, task):
+        hasher = hashlib.sha256(f'{task.name}:{task.version}'.encode())
+        for dep in task.deps:
+            hasher.update(self.index[dep]['fingerprint'].encode())
+        return hasher.hexdigest()
+
+    def is_fresh(self, task, key):
+        entry = self.index.get(task.name)
+        if self.force or entry is None:
+            return False
+        if task.source:
+            return ((self.offline or task.name in self.unchanged) and
+                os.path.exists(self._output_path(task.name)))
+        return (entry['key'] == key and
+            all(os.path.exists(path) for path in task.outputs()) and
+            os.path.exists(self._output_path(task.name)))
+
+    def output(self, name):
+        ''' Returns the output of a task, run in this pipeline or read
+        from the cache. '''
+        with self._lock:
+            if name not in self.outputs:
+                with open(self._output_path(name), 'rb') as f:
+                    self.outputs[name] = pickle.load(f)
+            return self.outputs[name]
+
+    def run_task(self, name):
+        ''' Runs the task unless its cached output is fresh, and
+        records its fingerprint. Returns whether it was run. '''
+        task = self.tasks[name]
+        with self._lock:
+            key = self.task_key(task)
+        if self.is_fresh(task, key):
+            return False
+        with instrument.stage(f'task_{name}'):
+            result = task.func(*[self.output(dep) for dep in task.deps])
+        path = self._output_path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self.outputs[name] = result
+            self.index[name] = {
+                'key' : key,
+                'fingerprint' : fingerprint(result),
+                'finished' : time.strftime('%Y-%m-%dT%H:%M:%S')
+                }
+            self._save_index()
+        return True
+
+    def run(self, targets=None, unchanged=()):
+        ''' Runs the targets (by default all tasks) and the tasks they
+        depend on, and returns the status of each: 'run' or 'cached'.
+        The source tasks in unchanged are known to fetch the same data
+        as last time, and are not run again (like when offline). '''
+        required = self.required(targets or list(self.tasks))
+        self.unchanged = set(unchanged)
+        self.status = {}
+        done = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(done) < len(required):
+                for name in sorted(required - done - set(running.values())):
+                    task = self.tasks[name]
+                    busy = {self.tasks[other].group for other in running.values()}
+                    if (all(dep in done for dep in task.deps) and
+                            (task.group is None or task.group not in busy)):
+                        running[executor.submit(self.run_task, name)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    self.status[name] = 'run' if future.result() else 'cached'
+                    print(f'{name}: {self.status[name]}')
+                    done.add(name)
+        return self.status
+
+    def describe(self, targets=None):
+        ''' Returns the required tasks of the targets in dependency
+        order, with their dependencies and when they last finished. '''
+        required = self.required(targets or list(self.tasks))
+        return [(name, self.tasks[name].deps,
+            self.index.get(name, {}).get('finished'))
+            for name in self.tasks if name in required]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Covid_NL pipeline')
+    parser.add_argument('targets', nargs='*',
+        help='Tasks to run, along with their stale dependencies (default: all)')
+    parser.add_argument('--offline', action='store_true',
+        help='Use the last fetched sources instead of fetching them again')
+    parser.add_argument('--force', action='store_true',
+        help='Run all required tasks, even if their output is cached')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+        help='Number of tasks run at the same time')
+    parser.add_argument('--list', action='store_true',
+        help='List the required tasks and their dependencies')
+    args = parser.parse_args(argv)
+    pipeline = Pipeline(offline=args.offline, force=args.force,
+        workers=args.workers)
+    for target in args.targets:
+        if target not in pipeline.tasks:
+            parser.error(f'unknown task: {target} '
+                f'(choose from {", ".join(pipeline.tasks)})')
+    if args.list:
+        for name, deps, finished in pipeline.describe(args.targets):
+            print(f'{name:<20} <- {", ".join(deps) or "-":<35} {finished or "never run"}')
+        return
+    pipeline.run(args.targets)
+    instrument.write_report(os.path.join(os.getcwd(), 'run_report.json'))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,12 +1,110 @@
 import os
 import math
+import json
+import hashlib
+import threading
+import multiprocessing
 import pandas as pd
+import instrument
 from datetime import datetime
 from datetime import timedelta
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import matplotlib.ticker as ticker
-import matplotlib.patches as mpatches
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when the plotting code changes, to render all plots again
+PLOT_VERSION = '1'
+MANIFEST_NAME = 'manifest.json'
+# Number of frames whose derived series are kept
+DERIVED_CACHE_SIZE = 8
+# Daily columns of the merged data the plots show a rolling average of
+ROLLING_COLUMNS = ['infection_day', 'hospital_day', 'dead_day']
+
+_derived = OrderedDict()
+_derived_lock = threading.Lock()
+
+def frame_key(dframe):
+    ''' Returns a hash of the columns and contents of the dataframe. '''
+    hasher = hashlib.sha256(repr(list(dframe.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(
+        dframe, index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+class DerivedSeries:
+    ''' The data the plots derive from a dataframe, each computed on
+    first use and then shared by all plots of the same data: the
+    weekly table, rolling averages, and axis limits. Obtain it with
+    derived_series, which memoizes it by the contents of the frame. '''
+
+    def __init__(self, dframe, key=None):
+        # A copy, so the series can not go stale when the caller
+        # changes the frame afterwards
+        self.dframe = dframe.copy()
+        self.key = key or frame_key(dframe)
+        self._weekly = None
+        self._rolling = {}
+        self._limits = {}
+
+    @property
+    def weekly(self):
+        ''' One row per week, with the weekly infections in local_max
+        where they are higher than in the weeks before and after. '''
+        if self._weekly is None:
+            df_week = self.dframe.drop_duplicates(subset='week_number').copy()
+            df_week['local_max'] = df_week.infection_week[
+                (df_week.infection_week.shift(1) < df_week.infection_week) & 
+                (df_week.infection_week.shift(-1) < df_week.infection_week)
+                ]
+            self._weekly = df_week
+        return self._weekly
+
+    def rolling(self, column, window=7):
+        ''' The rolling average of the column over window rows. '''
+        if (column, window) not in self._rolling:
+            self._rolling[(column, window)] = self.dframe[column].rolling(window).mean()
+        return self._rolling[(column, window)]
+
+    def limits(self, column):
+        ''' The minimum and maximum of the column. '''
+        if column not in self._limits:
+            self._limits[column] = (self.dframe[column].min(), self.dframe[column].max())
+        return self._limits[column]
+
+    def prepare(self):
+        ''' Computes all derived series of the frame, e.g. before it
+        is sent to worker processes. '''
+        columns = set(self.dframe.columns)
+        for column in self.dframe.columns:
+            if (pd.api.types.is_numeric_dtype(self.dframe[column]) or
+                    pd.api.types.is_datetime64_any_dtype(self.dframe[column]) or
+                    column == 'week_number'):
+                self.limits(column)
+        if {'week_number', 'infection_week'} <= columns:
+            self._weekly = self.weekly
+        for column in ROLLING_COLUMNS:
+            if column in columns:
+                self.rolling(column)
+        return self
+
+def remember(series):
+    ''' Adds the derived series to the cache, dropping the least
+    recently used ones beyond DERIVED_CACHE_SIZE. '''
+    with _derived_lock:
+        _derived[series.key] = series
+        _derived.move_to_end(series.key)
+        while len(_derived) > DERIVED_CACHE_SIZE:
+            _derived.popitem(last=False)
+    return series
+
+def derived_series(dframe):
+    ''' Returns the derived series of the dataframe, shared with all
+    earlier calls for a frame with the same contents. '''
+    key = frame_key(dframe)
+    with _derived_lock:
+        series = _derived.get(key)
+        if series is not None:
+            _derived.move_to_end(key)
+            return series
+    return remember(DerivedSeries(dframe, key))
 
 def set_grid(ax):
     ax.grid(
@@ -24,10 +122,39 @@ def set_grid(ax):
         color='0.75'
     )
 
+def create_figure(target_dir, **kwargs):
+    ''' Returns a new figure. Figures that are saved to target_dir
+    are created on an Agg canvas through the object-oriented API, so
+    they do not touch the global pyplot state and can be rendered in
+    any process. Otherwise a pyplot figure is created to be shown.
+    matplotlib is imported here on first use (and pyplot only when
+    showing), so importing this module is cheap. '''
+    if target_dir:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(**kwargs)
+        FigureCanvasAgg(fig)
+        return fig
+    import matplotlib.pyplot as plt
+    return plt.figure(**kwargs)
+
+def save_or_show(fig, target_dir, file_name):
+    ''' Saves the figure as file_name in target_dir, or shows it
+    if no target_dir is given and closes it afterwards. '''
+    if target_dir:
+        fig.savefig(os.path.join(target_dir, file_name))
+    else:
+        import matplotlib.pyplot as plt
+        plt.show()
+        plt.close(fig)
+
 def plot_weekly(dframe, target_dir=None):
-    fig, ax = plt.subplots(figsize=(12.8, 9.6))
+    import matplotlib.ticker as ticker
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
+    ax = fig.add_subplot(111)
     fig.suptitle('Reported weekly COVID-19 data Netherlands')
-    df_week = dframe.drop_duplicates(subset='week_number')
+    series = derived_series(dframe)
+    df_week = series.weekly
     weeks = df_week.week_number.unique()
     width = 0.6
     
@@ -49,9 +176,8 @@ def plot_weekly(dframe, target_dir=None):
         label='Reported deaths')
 
     # Set limits on y and x axis
-    ax.set_ylim(0, df_week.infection_week.max() + 2000)
-    ldate = df_week.week_number.min() 
-    hdate = df_week.week_number.max()
+    ax.set_ylim(0, series.limits('infection_week')[1] + 2000)
+    ldate, hdate = series.limits('week_number')
     ax.set_xbound(ldate, hdate)
     # Set ticker spacing
     ax.yaxis.set_major_locator(ticker.MultipleLocator(2000))
@@ -65,31 +191,29 @@ def plot_weekly(dframe, target_dir=None):
         textcoords='offset points',
         size=8, ha='center', va='bottom')
     
-    plt.xticks(rotation=45)
-    plt.xticks(fontsize=8)
-    plt.legend(loc='upper left', frameon=False)
-    plt.xlabel('Week')
-    plt.ylabel('Reported amount')
+    ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+    ax.legend(loc='upper left', frameon=False)
+    ax.set_xlabel('Week')
+    ax.set_ylabel('Reported amount')
 
-    if target_dir:
-        fp = os.path.join(target_dir, 'weeklycombined.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'weeklycombined.png')
 
 def plot_current_ic_zkh(dframe, target_dir=None):
+    import matplotlib.dates as mdates
+    import matplotlib.ticker as ticker
+    from matplotlib.artist import setp
 
     df_current = dframe
-    fig = plt.figure(figsize=(13.8, 11.6))
+    series = derived_series(dframe)
+    fig = create_figure(target_dir, figsize=(13.8, 11.6))
     width = 0.5
     fig.tight_layout()
-    ax = plt.subplot(111)
+    ax = fig.add_subplot(111)
     fig.suptitle('Total reported COVID patients Hospital')
-    ax.set_ylim(0, (df_current.ZKH_current.max() + 
-        df_current.IC_current.max()) + 50)
-    ldate = df_current.date.min() - timedelta(days=1)
-    hdate = df_current.date.max() + timedelta(days=1)
+    ax.set_ylim(0, (series.limits('ZKH_current')[1] + 
+        series.limits('IC_current')[1]) + 50)
+    ldate = series.limits('date')[0] - timedelta(days=1)
+    hdate = series.limits('date')[1] + timedelta(days=1)
     ax.set_xlim(ldate, hdate)
     p1 = ax.bar(df_current.date, df_current.ZKH_current,
         width, label='Reported COVID patients nursing ward')
@@ -102,10 +226,10 @@ def plot_current_ic_zkh(dframe, target_dir=None):
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
     ax.yaxis.set_major_locator(ticker.MultipleLocator(250))
     
-    plt.setp(ax.get_xticklabels(), rotation=45, ha="right", fontsize=8)
-    plt.legend(loc='upper right', frameon=False)
-    plt.xlabel('Date')
-    plt.ylabel('Reported amount')
+    setp(ax.get_xticklabels(), rotation=45, ha="right", fontsize=8)
+    ax.legend(loc='upper right', frameon=False)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Reported amount')
 
     # Add source annotation
     ax.annotate(('Sources:' \
@@ -116,20 +240,19 @@ def plot_current_ic_zkh(dframe, target_dir=None):
         textcoords='offset points',
         size=8, ha='center', va='bottom')
 
-    if target_dir:
-        fp = os.path.join(target_dir, 'currenticzkh.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'currenticzkh.png')
 
 def subplot_daily_infections(dframe, target_dir=None):
+    import matplotlib.dates as mdates
+    import matplotlib.ticker as ticker
+    from matplotlib.artist import setp
 
-    rolling_avg_inf = dframe.infection_day.rolling(7).mean()
-    rolling_avg_hos = dframe.hospital_day.rolling(7).mean()
-    rolling_avg_death = dframe.dead_day.rolling(7).mean()
+    series = derived_series(dframe)
+    rolling_avg_inf = series.rolling('infection_day')
+    rolling_avg_hos = series.rolling('hospital_day')
+    rolling_avg_death = series.rolling('dead_day')
 
-    fig = plt.figure(figsize=(15, 11.2))
+    fig = create_figure(target_dir, figsize=(15, 11.2))
     fig.tight_layout()
     gs1 = fig.add_gridspec(nrows=3, ncols=2)
     fig.suptitle('Daily reported COVID-19 data Netherlands')
@@ -147,7 +270,7 @@ def subplot_daily_infections(dframe, target_dir=None):
         linestyle='-',
         label='7-day rolling average') 
     fig_ax1.legend(loc='upper left', frameon=False)
-    fig_ax1.set_ylim(0, dframe.infection_day.max() + 500)
+    fig_ax1.set_ylim(0, series.limits('infection_day')[1] + 500)
     fig_ax1.xaxis.set_major_locator(mdates.DayLocator(interval=7))
     fig_ax1.yaxis.set_major_locator(ticker.MultipleLocator(500))
 
@@ -163,7 +286,7 @@ def subplot_daily_infections(dframe, target_dir=None):
         linewidth=1,
         linestyle='-',
         label='7-day rolling average') 
-    fig_ax2.set_ylim(0, dframe.hospital_day.max() + 100)
+    fig_ax2.set_ylim(0, series.limits('hospital_day')[1] + 100)
     fig_ax2.xaxis.set_major_locator(mdates.DayLocator(interval=14))
     fig_ax2.yaxis.set_major_locator(ticker.MultipleLocator(100)) 
 
@@ -179,24 +302,24 @@ def subplot_daily_infections(dframe, target_dir=None):
         linewidth=1,
         linestyle='-',
         label='7-day rolling average') 
-    fig_ax3.set_ylim(0, dframe.dead_day.max() + 50)
+    fig_ax3.set_ylim(0, series.limits('dead_day')[1] + 50)
     fig_ax3.xaxis.set_major_locator(mdates.DayLocator(interval=14))
     fig_ax3.yaxis.set_major_locator(ticker.MultipleLocator(50)) 
 
-    ldate = dframe.date.min() - timedelta(days=3)
-    hdate = dframe.date.max() + timedelta(days=3)
+    ldate = series.limits('date')[0] - timedelta(days=3)
+    hdate = series.limits('date')[1] + timedelta(days=3)
     for f in [fig_ax1, fig_ax2, fig_ax3]:
         set_grid(f)
         f.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%y'))
         f.set_xbound(ldate, hdate)
-        plt.setp(f.get_xticklabels(), 
+        setp(f.get_xticklabels(), 
             rotation=45, 
             ha="right", 
             fontsize=8)
-        plt.setp(f.get_yticklabels(),  
+        setp(f.get_yticklabels(),  
             fontsize=8)
 
-    plt.xlabel('Date')
+    fig_ax3.set_xlabel('Date')
     fig_ax1.annotate(f'Source: RIVM https://data.rivm.nl/covid-19/',
         xy=(0.5, 0), xytext=(0, 10),
         xycoords=('axes fraction', 'figure fraction'),
@@ -205,22 +328,16 @@ def subplot_daily_infections(dframe, target_dir=None):
 
     fig.subplots_adjust(left=None, bottom=None, right=None, top=0.90,
         wspace=0.1, hspace=0.6)
-    if target_dir:
-        fp = os.path.join(target_dir, 'dailycombined.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'dailycombined.png')
 
 def subplot_weekly(dframe, target_dir=None):
-    df_week = dframe.drop_duplicates(subset='week_number').copy()
-    df_week['local_max'] = df_week.infection_week[
-        (df_week.infection_week.shift(1) < df_week.infection_week) & 
-        (df_week.infection_week.shift(-1) < df_week.infection_week)
-        ]
+    import matplotlib.ticker as ticker
+    from matplotlib.artist import setp
+    series = derived_series(dframe)
+    df_week = series.weekly
     weeks = df_week.week_number.unique()
     width = 0.6
-    fig = plt.figure(figsize=(12.8, 9.6))
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
     fig.tight_layout()
     gs1 = fig.add_gridspec(nrows=2, ncols=2)
     fig.suptitle('Weekly reported COVID-19 data Netherlands')
@@ -229,7 +346,7 @@ def subplot_weekly(dframe, target_dir=None):
     fig_ax1.set_title('Reported infections', fontsize=10)
     fig_ax1.xaxis.set_major_locator(ticker.MultipleLocator(1))
     fig_ax1.yaxis.set_major_locator(ticker.MultipleLocator(5000))
-    fig_ax1.set_ylim(0, df_week.infection_week.max() + 20000)
+    fig_ax1.set_ylim(0, series.limits('infection_week')[1] + 20000)
     p1 = fig_ax1.bar(weeks, 
         df_week.infection_week,
         width=width,
@@ -246,8 +363,7 @@ def subplot_weekly(dframe, target_dir=None):
                 alpha=1,
                 color='black')
 
-    plt.xticks(rotation=45)
-    plt.xticks(fontsize=6)
+    fig_ax1.tick_params(axis='x', labelrotation=45, labelsize=6)
 
     fig_ax2 = fig.add_subplot(gs1[1 , : ])
     fig_ax2.set_title('Reported hospital admissions & deaths', fontsize=10)
@@ -265,13 +381,12 @@ def subplot_weekly(dframe, target_dir=None):
         label='Reported deaths')
     fig_ax2.legend(loc='upper right', frameon=False)
     
-    ldate = df_week.week_number.min() 
-    hdate = df_week.week_number.max() 
+    ldate, hdate = series.limits('week_number')
     
     for f in [fig_ax1, fig_ax2]:
         set_grid(f)
         f.set_xbound(ldate, hdate)
-        plt.setp(f.get_yticklabels(),  
+        setp(f.get_yticklabels(),  
             fontsize=8)
 
     fig_ax1.annotate(f'Source: RIVM https://data.rivm.nl/covid-19/',
@@ -280,36 +395,28 @@ def subplot_weekly(dframe, target_dir=None):
         textcoords='offset points',
         size=8, ha='center', va='bottom')
     
-    plt.xticks(rotation=45)
-    plt.xticks(fontsize=6)
-    plt.xlabel('Week')
+    fig_ax2.tick_params(axis='x', labelrotation=45, labelsize=6)
+    fig_ax2.set_xlabel('Week')
    
-    if target_dir:
-        fp = os.path.join(target_dir, 'weeklycombined2.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'weeklycombined2.png')
 
 def plot_weekly_infections(dframe, target_dir=None):
-    df = dframe.drop_duplicates(subset='week_number').copy()
-    df['local_max'] = df.infection_week[
-        (df.infection_week.shift(1) < df.infection_week) & 
-        (df.infection_week.shift(-1) < df.infection_week)
-        ]
-    fig = plt.figure(figsize=(12.8, 9.6))
+    import matplotlib.ticker as ticker
+    series = derived_series(dframe)
+    df = series.weekly
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
     fig.tight_layout()
     fig.suptitle('Reported infections by week')
-    ax = plt.subplot(111)
-    ax.bar(df["week_number"].unique(),
-        df["infection_week"].unique(),
+    ax = fig.add_subplot(111)
+    ax.bar(df["week_number"],
+        df["infection_week"],
         edgecolor='white',
         width=0.6,
         label='Weekly reported infections')
 
     for x,y in zip(df.week_number, df.local_max):
         if not math.isnan(y):
-            plt.text(x, y+0.05, int(y),
+            ax.text(x, y+0.05, int(y),
                 ha='center',
                 va= 'bottom', 
                 fontsize=8,
@@ -317,18 +424,16 @@ def plot_weekly_infections(dframe, target_dir=None):
                 color='black')
 
     # Set limits on y and x axis
-    ax.set_ylim(0, df.infection_week.max() + 2000)
-    ldate = df.week_number.min()
-    hdate = df.week_number.max()
+    ax.set_ylim(0, series.limits('infection_week')[1] + 2000)
+    ldate, hdate = series.limits('week_number')
     ax.set_xbound(ldate, hdate)
     # Set ticker spacing
     ax.yaxis.set_major_locator(ticker.MultipleLocator(2500))
     ax.xaxis.set_major_locator(ticker.MultipleLocator(1))
-    plt.legend(loc='upper left', frameon=False)
-    plt.xlabel('Week')
-    plt.ylabel('Reported infections')
-    plt.xticks(rotation=45)
-    plt.xticks(fontsize=8)
+    ax.legend(loc='upper left', frameon=False)
+    ax.set_xlabel('Week')
+    ax.set_ylabel('Reported infections')
+    ax.tick_params(axis='x', labelrotation=45, labelsize=8)
     set_grid(ax)
 
     # Add source annotation
@@ -338,19 +443,17 @@ def plot_weekly_infections(dframe, target_dir=None):
         textcoords='offset points',
         size=8, ha='center', va='bottom')
 
-    if target_dir:
-        fp = os.path.join(target_dir, 'weeklyinfections.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'weeklyinfections.png')
 
 def plot_daily_infections(dframe, target_dir=None):
-    rolling_avg = dframe.infection_day.rolling(7).mean()
+    import matplotlib.dates as mdates
+    import matplotlib.ticker as ticker
+    series = derived_series(dframe)
+    rolling_avg = series.rolling('infection_day')
     
-    fig = plt.figure(figsize=(12.8, 9.6))
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
     fig.tight_layout()
-    ax = plt.subplot(111)
+    ax = fig.add_subplot(111)
     fig.suptitle('Reported daily Infections over time')
     # Plot the daily infections
     ax.bar(dframe.date, 
@@ -367,20 +470,20 @@ def plot_daily_infections(dframe, target_dir=None):
         label='7-day rolling average')
 
     # Set limits on y and x axis
-    ax.set_ylim(0, dframe.infection_day.max() + 500)
-    ldate = dframe.date.min()
-    hdate = dframe.date.max() + timedelta(days=1)
+    ax.set_ylim(0, series.limits('infection_day')[1] + 500)
+    ldate = series.limits('date')[0]
+    hdate = series.limits('date')[1] + timedelta(days=1)
     ax.set_xbound(ldate, hdate)
 
     set_grid(ax)
 
-    plt.gcf().autofmt_xdate()
-    plt.xticks(fontsize=8)
+    fig.autofmt_xdate()
+    ax.tick_params(axis='x', labelsize=8)
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
     ax.yaxis.set_major_locator(ticker.MultipleLocator(500))
-    plt.legend(loc='upper left', frameon=False)
-    plt.xlabel('Date')
-    plt.ylabel('Reported infections')
+    ax.legend(loc='upper left', frameon=False)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Reported infections')
 
     # Add source annotation
     ax.annotate(f'Source: RIVM https://data.rivm.nl/covid-19/',
@@ -389,20 +492,16 @@ def plot_daily_infections(dframe, target_dir=None):
         textcoords='offset points',
         size=8, ha='center', va='bottom')
 
-    if target_dir:
-        fp = os.path.join(target_dir, 'dailyinfections.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    save_or_show(fig, target_dir, 'dailyinfections.png')
 
 def plot_testing_data(dframe, rapport_name, target_dir=None):
-    fig = plt.figure(figsize=(12.8, 9.6))
+    import matplotlib.ticker as ticker
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
     fig.tight_layout()
-    ax = plt.subplot(111)
+    ax = fig.add_subplot(111)
     fig.suptitle('Weekly reported test results GGD')
     # Set limits on y and x axis
-    ax.set_ylim(0, dframe.aantal_testen.max() + 100000)
+    ax.set_ylim(0, derived_series(dframe).limits('aantal_testen')[1] + 100000)
     # Set ticker spacing
     ax.yaxis.set_major_locator(ticker.MultipleLocator(25000))
     # Plot data
@@ -431,24 +530,237 @@ def plot_testing_data(dframe, rapport_name, target_dir=None):
         size=8, ha='center', va='bottom')
 
 
-    plt.legend(loc='upper right', frameon=False)
-    plt.xlabel('Week')
-    plt.ylabel('Reported amount')
+    ax.legend(loc='upper right', frameon=False)
+    ax.set_xlabel('Week')
+    ax.set_ylabel('Reported amount')
+
+    save_or_show(fig, target_dir, 'testingweekly2.png')
+
+def plot_rolling_weekday(rolling_df, type_var='infection', target_dir=None):
+    ''' Plots the weekday coefficients (relative to friday) of the
+    rolling weekday regression of type_var (see 
+    regressions.rolling_day_contrib_reg) by the last week of each
+    window, with their 95% confidence bands. '''
+    import matplotlib.ticker as ticker
+    df = rolling_df[rolling_df.type_var == type_var]
+    fig = create_figure(target_dir, figsize=(12.8, 9.6))
+    ax = fig.add_subplot(111)
+    fig.suptitle(f'Weekday effect on the reported {type_var} share of the week')
+    for term, df_term in df[df.term != 'Intercept'].groupby('term', sort=False):
+        day = term.split('.')[-1].rstrip(']')
+        line, = ax.plot(df_term.last_week, df_term.coef, label=day)
+        ax.fill_between(df_term.last_week, 
+            df_term.coef - 1.96 * df_term.std_err,
+            df_term.coef + 1.96 * df_term.std_err, 
+            color=line.get_color(), alpha=0.15)
+    ax.axhline(0, color='black', linewidth=0.75)
+    # Set ticker spacing
+    ax.xaxis.set_major_locator(ticker.MultipleLocator(4))
+    set_grid(ax)
 
-    if target_dir:
-        fp = os.path.join(target_dir, 'testingweekly2.png')
-        plt.savefig(fp)
-    else:
-        plt.show()
-        plt.close()
+    # Add source annotation
+    ax.annotate(f'Source: RIVM https://data.rivm.nl/covid-19/',
+        xy=(0.5, 0), xytext=(0, 12),
+        xycoords=('axes fraction', 'figure fraction'),
+        textcoords='offset points',
+        size=8, ha='center', va='bottom')
+
+    ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+    ax.legend(loc='upper left', frameon=False)
+    ax.set_xlabel('Last week of window')
+    ax.set_ylabel('Coefficient (difference with friday)')
+
+    save_or_show(fig, target_dir, 'rollingweekday.png')
+
+def plot_adjusted_daily(dframe, target_dir=None):
+    ''' Plots the reported daily infections, hospital admissions, and
+    deaths together with their weekday adjusted figures and 7-day
+    average (see adjustment.adjust_for_weekday). '''
+    import matplotlib.dates as mdates
+    fig = create_figure(target_dir, figsize=(12.8, 11.6))
+    fig.suptitle('Reported daily COVID-19 data adjusted for weekday reporting')
+    axes = fig.subplots(3, 1, sharex=True)
+    series = derived_series(dframe)
+    for ax, (column, label) in zip(axes, [('infection_day', 'Infections'),
+            ('hospital_day', 'Hospital admissions'), ('dead_day', 'Deaths')]):
+        ax.bar(dframe.date, dframe[column], width=0.5, color='0.7',
+            label=f'Reported {label.lower()}')
+        ax.plot(dframe.date, dframe[f'{column}_adj'], 
+            color='tab:blue', linewidth=0.75, alpha=0.6,
+            label='Weekday adjusted')
+        ax.plot(dframe.date, dframe[f'{column}_adj_avg7'], 
+            color='purple', linewidth=1.5,
+            label='Weekday adjusted 7-day average')
+        ax.set_ylim(0, series.limits(column)[1] * 1.1 + 1)
+        ax.set_ylabel(label)
+        set_grid(ax)
+        ax.legend(loc='upper left', frameon=False, fontsize=8)
+    axes[-1].set_xbound(series.limits('date')[0], series.limits('date')[1] + timedelta(days=1))
+    axes[-1].xaxis.set_major_locator(mdates.MonthLocator())
+    axes[-1].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    axes[-1].tick_params(axis='x', labelrotation=45, labelsize=8)
+    axes[-1].set_xlabel('Date')
+
+    # Add source annotation
+    axes[-1].annotate(f'Source: RIVM https://data.rivm.nl/covid-19/',
+        xy=(0.5, 0), xytext=(0, 10),
+        xycoords=('axes fraction', 'figure fraction'),
+        textcoords='offset points',
+        size=8, ha='center', va='bottom')
 
-def plot_and_save_all(dframe, plot_target_dir=None):
+    save_or_show(fig, target_dir, 'adjusteddaily.png')
+
+PLOTS = [
+    plot_weekly,
+    plot_current_ic_zkh,
+    subplot_daily_infections,
+    subplot_weekly,
+    plot_weekly_infections,
+    plot_daily_infections
+    ]
+
+# Output file and the dataframe columns used by each plotting function
+PLOT_OUTPUTS = {
+    plot_weekly : ('weeklycombined.png', 
+        ['week_number', 'infection_week', 'hospital_week', 'dead_week']),
+    plot_current_ic_zkh : ('currenticzkh.png', 
+        ['date', 'ZKH_current', 'IC_current']),
+    subplot_daily_infections : ('dailycombined.png',
+        ['date', 'infection_day', 'hospital_day', 'dead_day']),
+    subplot_weekly : ('weeklycombined2.png',
+        ['week_number', 'infection_week', 'hospital_week', 'dead_week']),
+    plot_weekly_infections : ('weeklyinfections.png', 
+        ['week_number', 'infection_week']),
+    plot_daily_infections : ('dailyinfections.png', 
+        ['date', 'infection_day']),
+    plot_testing_data : ('testingweekly2.png', ['week_number', 
+        'aantal_testen', 'aantal_positief', 'perentage_positief']),
+    plot_rolling_weekday : ('rollingweekday.png', ['last_week', 'type_var',
+        'term', 'coef', 'std_err', 'nobs']),
+    plot_adjusted_daily : ('adjusteddaily.png', ['date', 'infection_day',
+        'infection_day_adj', 'infection_day_adj_avg7', 'hospital_day', 
+        'hospital_day_adj', 'hospital_day_adj_avg7', 'dead_day', 
+        'dead_day_adj', 'dead_day_adj_avg7'])
+    }
+
+def plot_fingerprint(plot, dframe, args=()):
+    ''' Returns a hash of the plot code version, the contents of the
+    columns used by the plotting function, and its other arguments. '''
+    columns = PLOT_OUTPUTS[plot][1]
+    hasher = hashlib.sha256()
+    hasher.update(repr((PLOT_VERSION, plot.__name__, columns, args)).encode())
+    hasher.update(pd.util.hash_pandas_object(
+        dframe[columns], index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+def load_manifest(target_dir):
+    ''' Returns the fingerprints of the plots rendered into target_dir
+    (file name -> hash). '''
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(target_dir, manifest):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def render_plot(plot, dframe, args, target_dir, series=None):
+    ''' Renders and saves a single plot as an instrumented stage, and
+    returns the stage record, so plots rendered in worker processes 
+    can be recorded by the parent process. The derived series of the
+    frame computed by the parent process can be passed in as series. '''
+    if series is not None:
+        remember(series)
+    with instrument.stage(plot.__name__, rows=len(dframe)) as record:
+        plot(dframe, *args, target_dir=target_dir)
+    return record
+
+def pool_context():
+    ''' Returns the multiprocessing context of the worker processes.
+    render is also called from the threads of the pipeline, and a 
+    forked worker could inherit a lock held by another thread (e.g.
+    of instrument or of the derived series), so the workers are 
+    started from a fresh server process (or spawned, where there is
+    no fork server) instead of forked from this one. '''
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    # The server imports the plotting modules once, so the workers
+    # forked from it start with them loaded
+    context.set_forkserver_preload(['plotfuncs', 'matplotlib.pyplot'])
+    return context
+
+def render(jobs, target_dir=None, workers=None, force=False):
+    ''' Renders the jobs, (plot, dframe, args) tuples. When saving,
+    plots whose output already exists in target_dir with the same 
+    fingerprint are skipped (unless force is set), and the rest is
+    rendered in separate worker processes (at most workers, by default
+    one per core; workers=1 renders them one after another in this
+    process). Returns the file names that were rendered. '''
+    if not target_dir:
+        for plot, dframe, args in jobs:
+            plot(dframe, *args)
+        return []
+    manifest = load_manifest(target_dir)
+    fingerprints = {}
+    pending = []
+    for plot, dframe, args in jobs:
+        file_name = PLOT_OUTPUTS[plot][0]
+        fingerprints[file_name] = plot_fingerprint(plot, dframe, args)
+        if (force or manifest.get(file_name) != fingerprints[file_name] or
+                not os.path.exists(os.path.join(target_dir, file_name))):
+            pending.append((plot, dframe, args))
+    if len(pending) < len(jobs):
+        print(f'Skipping {len(jobs) - len(pending)} unchanged plot(s).')
+    if workers == 1 or len(pending) < 2:
+        for plot, dframe, args in pending:
+            render_plot(plot, dframe, args, target_dir)
+    else:
+        max_workers = min(workers or os.cpu_count(), len(pending))
+        # Derive the series once here, instead of in every worker
+        series = {id(dframe) : derived_series(dframe).prepare()
+            for _, dframe, _ in pending}
+        with ProcessPoolExecutor(max_workers=max_workers,
+                mp_context=pool_context()) as executor:
+            futures = [executor.submit(render_plot, plot, dframe, args, target_dir,
+                series[id(dframe)]) for plot, dframe, args in pending]
+            for future in futures:
+                record = future.result()
+                if record:
+                    instrument.add_record(dict(record, worker=True))
+    rendered = [PLOT_OUTPUTS[plot][0] for plot, _, _ in pending]
+    manifest.update({name : fingerprints[name] for name in rendered})
+    save_manifest(target_dir, manifest)
+    return rendered
+
+def plot_and_save_all(dframe, plot_target_dir=None, workers=None, force=False):
     ''' Creates all the above plots and saves the resulting
-    figures into the plot directory. '''
+    figures into the plot directory, skipping plots whose data did
+    not change since they were last saved (see render). Returns the
+    file names that were rendered. '''
     print('Starting plots.')
-    plot_weekly(dframe, target_dir=plot_target_dir)
-    plot_current_ic_zkh(dframe, target_dir=plot_target_dir)
-    subplot_daily_infections(dframe, target_dir=plot_target_dir)
-    subplot_weekly(dframe, target_dir=plot_target_dir)
-    plot_weekly_infections(dframe, target_dir=plot_target_dir)
-    plot_daily_infections(dframe, target_dir=plot_target_dir) 
\ No newline at end of file
+    return render([(plot, dframe, ()) for plot in PLOTS], 
+        plot_target_dir, workers, force)
+
+def plot_and_save_rolling(rolling_df, type_var='infection', 
+        plot_target_dir=None, force=False):
+    ''' Creates the rolling weekday regression plot of type_var,
+    unless it was already saved for the same estimates. '''
+    return render([(plot_rolling_weekday, rolling_df, (type_var,))],
+        plot_target_dir, workers=1, force=force)
+
+def plot_and_save_adjusted(adjusted_df, plot_target_dir=None, force=False):
+    ''' Creates the weekday adjusted daily plot, unless it was already
+    saved for the same data. '''
+    return render([(plot_adjusted_daily, adjusted_df, ())],
+        plot_target_dir, workers=1, force=force)
+
+def plot_and_save_testing(dframe, rapport_name, plot_target_dir=None, force=False):
+    ''' Creates the GGD testing plot, unless it was already saved
+    for the same data and rapport. '''
+    return render([(plot_testing_data, dframe, (rapport_name,))], 
+        plot_target_dir, workers=1, force=force)
@@ -1,25 +1,49 @@
 import os
 import io
+import re
 import sys
-import tabula
-import requests
+import json
+import argparse
 import datetime
-import bs4 as bs
 import pandas as pd
-from pdfminer.pdfpage import PDFPage
-from pdfminer.converter import TextConverter
-from pdfminer.pdfinterp import PDFResourceManager
-from pdfminer.pdfinterp import PDFPageInterpreter
-import isoweek
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import httpclient
+import instrument
+import storage
+from weeknumbers import week_numbers
 
-def extract_text_by_page(pdf_path):
+RAPPORT_URL = ('https://www.rivm.nl/coronavirus-covid-19/' \
+    'actueel/wekelijkse-update-epidemiologische-' \
+    'situatie-covid-19-in-nederland')
+RAPPORT_HOST = 'http://rivm.nl'
+RAPPORT_TIMEOUT = (10, 120)
+TABLE_SEARCH_STR = 'AantaltestenuitgevoerddoordeGGD'
+BACKFILL_DIR = os.path.join(os.getcwd(), 'data', 'backfill')
+PAGE_INDEX_PATH = os.path.join(os.getcwd(), 'data', 'rapport_page_index.json')
+TABLE_COLUMNS = (200, 340, 440)
+# Table extraction: 'tabula' (tabula-java) or 'pdfminer' (pure python)
+TABLE_BACKEND = os.environ.get('COVID_NL_TABLE_BACKEND', 'tabula')
+PDF_STRING_LITERAL = re.compile(rb'\((?:\\.|[^\\)])*\)', re.S)
+
+def extract_text_by_page(pdf_path, page_numbers=None):
     ''' Extracts text from each page of the 
-    inputted pdf, and returns the text. '''
+    inputted pdf (or only the inputted page numbers, counting
+    from 1), and returns the text. One resource manager is shared
+    by all pages, so fonts are only loaded once. '''
+    # pdfminer, tabula, and bs4 are imported on first use, so runs
+    # that do not parse a new rapport do not pay for loading them
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.converter import TextConverter
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    res_manager = PDFResourceManager(caching=True)
+    page_indices = None
+    if page_numbers is not None:
+        page_indices = [num - 1 for num in page_numbers]
     with open(pdf_path, 'rb') as fh:
         for page in PDFPage.get_pages(fh, 
+                                pagenos=page_indices,
                                 caching=True,
                                 check_extractable=True):
-            res_manager = PDFResourceManager()
             fake_file_handle = io.StringIO()
             converter = TextConverter(res_manager, fake_file_handle)
             page_interpreter = PDFPageInterpreter(res_manager, converter)
@@ -30,28 +54,161 @@ def extract_text_by_page(pdf_path):
             # close open handles
             converter.close()
             fake_file_handle.close()
+
+def extract_raw_text_by_page(pdf_path):
+    ''' Fast, rough alternative to extract_text_by_page. Yields the
+    string literals shown on each page, read directly from the
+    decompressed content streams without interpreting them. Text 
+    in encoded (e.g. hex or CID) strings is not recovered. '''
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdftypes import resolve1
+    with open(pdf_path, 'rb') as fh:
+        for page in PDFPage.get_pages(fh, caching=True):
+            contents = page.contents
+            if not isinstance(contents, list):
+                contents = [contents]
+            data = b''.join(resolve1(stream).get_data() 
+                for stream in contents if stream is not None)
+            literals = PDF_STRING_LITERAL.findall(data)
+            yield b''.join(lit[1:-1] for lit in literals).decode('latin-1')
+
+def find_table_page(pdf_path, search_str=TABLE_SEARCH_STR):
+    ''' Returns the number of the first page containing search_str.
+    The raw content streams are searched first. A page found that way
+    is confirmed with the full text extraction of that page only; if
+    that fails, every page is extracted until the string is found.
+    Returns None if no page contains the string. '''
+    for i, page in enumerate(extract_raw_text_by_page(pdf_path)):
+        if search_str in page:
+            text = next(extract_text_by_page(pdf_path, [i + 1]))
+            if search_str in text:
+                return i + 1
+            break
+    for i, page in enumerate(extract_text_by_page(pdf_path)):
+        if search_str in page:
+            return i + 1
+    return None
+
+def load_page_index():
+    if not os.path.exists(PAGE_INDEX_PATH):
+        return {}
+    with open(PAGE_INDEX_PATH) as f:
+        return json.load(f)
+
+def save_page_index(page_index):
+    with open(PAGE_INDEX_PATH + '.tmp', 'w') as f:
+        json.dump(page_index, f, indent=4, sort_keys=True)
+    os.replace(PAGE_INDEX_PATH + '.tmp', PAGE_INDEX_PATH)
+
+def page_index_key(pdf_path):
+    return f'{os.path.basename(pdf_path)}:{os.path.getsize(pdf_path)}'
     
-def extract_text(pdf_path):
+@instrument.timed('pdf_scan')
+def extract_text(pdf_path, use_index=True, page_index=None):
     ''' The search_str is the name of the table of interest, 
     albeit weirdly formatted by the text extraction. Function
     locates the page containing this string, and returns 
-    the page number. '''
-    for i, page in enumerate(extract_text_by_page(pdf_path)):
-        search_str = 'AantaltestenuitgevoerddoordeGGD'
-        if search_str in page:
-            table_page_num = i + 1
-            break
+    the page number. Page numbers found are recorded per rapport 
+    (by file name and size) in the page index, so parsing the 
+    same rapport again does not need to scan it. When a page_index
+    is passed in, it is only updated in memory, and saving it is
+    left to the caller. '''
+    key = page_index_key(pdf_path)
+    save = use_index and page_index is None
+    if page_index is None:
+        page_index = load_page_index() if use_index else {}
+    if key in page_index:
+        return page_index[key]
+    table_page_num = find_table_page(pdf_path)
+    if use_index and table_page_num:
+        page_index[key] = table_page_num
+        if save:
+            save_page_index(page_index)
     return table_page_num
         
-def extract_table(table_page_num, file_path):
+def page_chars(pdf_path, page_num):
+    ''' Returns the characters (pdfminer LTChar objects, with their
+    positions) on the inputted page number. '''
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.layout import LTChar, LTContainer
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    res_manager = PDFResourceManager(caching=True)
+    device = PDFPageAggregator(res_manager, laparams=None)
+    page_interpreter = PDFPageInterpreter(res_manager, device)
+    with open(pdf_path, 'rb') as fh:
+        for page in PDFPage.get_pages(fh, pagenos=[page_num - 1], 
+                caching=True, check_extractable=True):
+            page_interpreter.process_page(page)
+    layout = device.get_result()
+    chars = []
+    objs = list(layout)
+    while objs:
+        obj = objs.pop()
+        if isinstance(obj, LTChar):
+            chars.append(obj)
+        elif isinstance(obj, LTContainer):
+            objs.extend(obj)
+    return chars
+
+def chars_to_rows(chars, columns, y_tolerance=2.0):
+    ''' Groups characters into rows by their baseline (top to bottom),
+    and each row into cells by the column boundaries. Characters 
+    further apart than a fifth of the font size are separated by a 
+    space. Returns a list of rows, each a list of cell strings (None
+    for empty cells). '''
+    chars = sorted(chars, key=lambda c: -c.y0)
+    lines = []
+    for char in chars:
+        if lines and lines[-1][0] - char.y0 <= y_tolerance:
+            lines[-1][1].append(char)
+        else:
+            lines.append((char.y0, [char]))
+    rows = []
+    for _, line in lines:
+        cells = [[] for _ in range(len(columns) + 1)]
+        for char in sorted(line, key=lambda c: c.x0):
+            center = (char.x0 + char.x1) / 2
+            cells[sum(center > bound for bound in columns)].append(char)
+        row = []
+        for cell in cells:
+            text = ''
+            for prev, char in zip([None] + cell, cell):
+                if prev is not None and char.x0 - prev.x1 > 0.2 * char.size:
+                    text += ' '
+                text += char.get_text()
+            row.append(text.strip() or None)
+        rows.append(row)
+    return rows
+
+def extract_table_pdfminer(table_page_num, file_path, columns=TABLE_COLUMNS):
+    ''' Pure python alternative to the tabula extraction: splits the
+    text on the inputted page into rows and into the same fixed 
+    columns, returning it as a dataframe in the shape returned by 
+    tabula (integer column labels, no header). '''
+    rows = chars_to_rows(page_chars(file_path, table_page_num), columns)
+    return pd.DataFrame(rows, columns=range(len(columns) + 1))
+
+@instrument.timed('table_extraction', rows=True)
+def extract_table(table_page_num, file_path, backend=None):
     ''' Extracts the table data from the inputted page number,
-    returning it as a dataframe.'''
-    tables = tabula.read_pdf(file_path,
-        pages = table_page_num,
-        guess = False,
-        columns  = (200, 340, 440),
-        pandas_options = {'header':None}
-    )
+    returning it as a dataframe. The backend ('tabula' or 'pdfminer',
+    by default TABLE_BACKEND) determines whether tabula-java is used,
+    or the pure python extract_table_pdfminer, which avoids starting
+    a JVM for every rapport.'''
+    backend = backend or TABLE_BACKEND
+    if backend == 'pdfminer':
+        tables = [extract_table_pdfminer(table_page_num, file_path)]
+    elif backend == 'tabula':
+        import tabula
+        tables = tabula.read_pdf(file_path,
+            pages = table_page_num,
+            guess = False,
+            columns  = TABLE_COLUMNS,
+            pandas_options = {'header':None}
+        )
+    else:
+        raise ValueError(f'Unknown table extraction backend: {backend}')
     if tables:
         return tables[0]
     else:
@@ -100,19 +257,18 @@ def retreive_current_rapport(pdf_folder):
     else:
         return None, None
 
+@instrument.timed()
 def retreive_online_rapport():
     ''' Retreives information about the most recent pdf rapport
     from the RIVM website. Returns the file url, the file name,
     and the date of publication (by parsing the name). '''
-    url = ('https://www.rivm.nl/coronavirus-covid-19/' \
-        'actueel/wekelijkse-update-epidemiologische-' \
-        'situatie-covid-19-in-nederland')
-    response = requests.get(url)
+    response = httpclient.get(RAPPORT_URL, timeout=RAPPORT_TIMEOUT)
     if response.raise_for_status() == None:
+        import bs4 as bs
         soup = bs.BeautifulSoup (response.content, 'html.parser')
         link_soup = soup.find(class_='list-group-item icon-pijl-rechts')
         if link_soup:
-            pdf_url = 'http://rivm.nl' + link_soup['href']
+            pdf_url = RAPPORT_HOST + link_soup['href']
             rapport_name = link_soup['href'].split('/')[-1]
             file_date = get_rapport_date(rapport_name)
             return file_date, pdf_url, rapport_name
@@ -123,11 +279,12 @@ def retreive_online_rapport():
         print(response.raise_for_status())
         sys.exit()
 
+@instrument.timed()
 def dowload_rapport(url, pdf_name, target_dir):
     ''' Downloads rapport pdf and saves it
     to the pdf_rapport directory '''
     target_fp = os.path.join(target_dir, pdf_name)
-    response = requests.get(url)
+    response = httpclient.get(url, timeout=RAPPORT_TIMEOUT)
     with open(target_fp, 'wb') as f:
         f.write(response.content)
     print('New rapport downloaded')
@@ -142,16 +299,22 @@ def diagnose_table(dframe):
     else:
         print('Parsing succesfull.')
 
-def calculate_week_numer(row):
-    ''' Function using the Isoweek module to calculate the week number
-    corresponsing with a given date. '''
-    return isoweek.Week.withdate(row['start_dt']).isoformat()
+def test_data_stem():
+    return os.path.join(os.getcwd(), 'data', 'ggd_test_data')
+
+def load_test_data():
+    ''' Reads the GGD testing data written by process_test_data_df,
+    with the date columns parsed. '''
+    return storage.read_frame(test_data_stem(), 
+        parse_dates=['start_dt', 'end_dt'])
 
-def process_test_data_df(dframe):
+@instrument.timed(rows=True)
+def process_test_data_df(dframe, export=True):
     ''' Parses dataframe with GGD testing data. First removes all
     redundant rows based on numerical values in column 2, and drops
     the totals row. Next, caculates the week numbers of the
-    date ranges. Finally, exports the data to a csv files. '''
+    date ranges. Finally, unless export is disabled, exports the data
+    in the configured storage format (see storage.write_frame). '''
     diagnose_table(dframe)   
     dframe = dframe[pd.to_numeric(dframe.iloc[:, 2], 
         errors='coerce').notnull()]
@@ -167,25 +330,114 @@ def process_test_data_df(dframe):
         pat=' - ', n=1, expand=True)
     dframe['start_dt'] = pd.to_datetime(dframe.start_dt, format='%d-%m-%Y')
     dframe['end_dt'] = pd.to_datetime(dframe.end_dt, format='%d-%m-%Y')
-    dframe['week_number'] = dframe.apply(calculate_week_numer, axis=1)
+    dframe['week_number'] = week_numbers(dframe.start_dt)
     dframe['aantal_testen'] = pd.to_numeric(dframe['aantal_testen'])
+    dframe['aantal_positief'] = pd.to_numeric(dframe['aantal_positief'])
     dframe['perentage_positief'] = pd.to_numeric(dframe['perentage_positief'])
     dframe = dframe.drop(columns= ['date'])
-    target_dir = os.path.join(os.getcwd(), 'data')
-    target_fp = os.path.join(target_dir, 'ggd_test_data.csv')
-    dframe.to_csv(target_fp, index=False, header=True)
-    print('CSV data file created')
+    if export:
+        storage.write_frame(dframe, test_data_stem())
+        print('Data file created')
     return dframe
 
-def main():
+def parse_rapport(pdf_path, backend=None, page_index=None):
+    ''' Locates and extracts the GGD testing table of a single
+    rapport, and returns the processed data (without exporting it),
+    tagged with the rapport date, or None if the rapport could not be
+    parsed, along with the page index entries found. The table page
+    is looked up in page_index (as read by the parent process), and 
+    the page index file is not written, so the backfill workers do 
+    not overwrite each other's entries. '''
+    page_index = dict(page_index or {})
+    try:
+        table_page_num = extract_text(pdf_path, page_index=page_index)
+        if not table_page_num:
+            print(f'GGD table not found in {pdf_path}')
+            return None, page_index
+        test_data_df = extract_table(table_page_num, pdf_path, backend)
+        dframe = process_test_data_df(test_data_df, export=False)
+    except SystemExit:
+        # The parsing functions exit on unexpected tables
+        print(f'Parsing {pdf_path} failed')
+        return None, page_index
+    dframe['rapport_date'] = get_rapport_date(os.path.basename(pdf_path))
+    return dframe, page_index
+
+def merge_rapports(dframes):
+    ''' Merges the testing data of several rapports into one row per
+    week. Later rapports revise the figures of earlier ones, so the
+    figures of the most recent rapport containing a week are kept, 
+    together with the number of rapports that contained it. '''
+    dframe = pd.concat(dframes, ignore_index=True)
+    dframe = dframe.sort_values(['rapport_date', 'start_dt'])
+    dframe['n_rapports'] = dframe.groupby('week_number').week_number.transform('size')
+    dframe = dframe.drop_duplicates(subset='week_number', keep='last')
+    return dframe.sort_values('start_dt').reset_index(drop=True)
+
+def backfill_stem(pdf_path):
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(BACKFILL_DIR, name)
+
+def backfill(pdf_paths, workers=None, backend=None):
+    ''' Parses historical rapports (a directory or a list of pdf paths)
+    in a pool of worker processes, and merges the results into one
+    deduplicated testing dataset (see merge_rapports), which is 
+    exported as data/ggd_test_data_history. The result of each rapport
+    is stored as soon as it is parsed, and rapports with a stored 
+    result are not parsed again, so an interrupted backfill resumes
+    where it stopped. The table pages found by the workers are added
+    to the page index by this process, which saves it once. '''
+    if isinstance(pdf_paths, str):
+        pdf_paths = [os.path.join(pdf_paths, name) 
+            for name in sorted(os.listdir(pdf_paths)) if name.endswith('.pdf')]
+    os.makedirs(BACKFILL_DIR, exist_ok=True)
+    dframes = {}
+    pending = []
+    for pdf_path in pdf_paths:
+        dframe = storage.read_frame(backfill_stem(pdf_path), 
+            parse_dates=['start_dt', 'end_dt', 'rapport_date'])
+        if dframe is None:
+            pending.append(pdf_path)
+        else:
+            dframes[pdf_path] = dframe
+    print(f'Backfill: {len(dframes)} rapport(s) done, {len(pending)} to parse.')
+    if pending:
+        page_index = load_page_index()
+        found = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(parse_rapport, pdf_path, backend,
+                    page_index) : pdf_path for pdf_path in pending}
+                for future in as_completed(futures):
+                    dframe, entries = future.result()
+                    found.update(entries)
+                    if dframe is not None:
+                        storage.write_frame(dframe, backfill_stem(futures[future]))
+                        dframes[futures[future]] = dframe
+        finally:
+            # Saved once, also when the backfill is interrupted
+            if any(page_index.get(key) != page for key, page in found.items()):
+                page_index.update(found)
+                save_page_index(page_index)
+    if not dframes:
+        return None
+    dframe = merge_rapports(list(dframes.values()))
+    storage.write_frame(dframe, test_data_stem() + '_history')
+    print(f'Backfill: {len(dframe)} weeks from {len(dframes)} rapport(s).')
+    return dframe
+
+def main(online_rapport=None):
     ''' First checks if the RIVM pdf rapport in the pdf_rapports
     folder is the most current one compared to the one on the 
     RIVM website. If not, the new pdf is downloaded, parsed,
-    and the data table of interest is extracted.  '''
+    and the data table of interest is extracted. The result of
+    retreive_online_rapport can be passed in as online_rapport
+    when it was already retreived. '''
     pdf_folder = os.path.join(os.getcwd(), 'pdf_rapport')
-    data_folder = os.path.join(os.getcwd(), 'data')
     cur_rap_date, cur_pdf_name = retreive_current_rapport(pdf_folder)
-    online_rap_date, rap_url, online_pdf_name = retreive_online_rapport()
+    if online_rapport is None:
+        online_rapport = retreive_online_rapport()
+    online_rap_date, rap_url, online_pdf_name = online_rapport
     if cur_rap_date != online_rap_date or cur_rap_date == None:
         if cur_rap_date != None:
             if os.path.exists(os.path.join(pdf_folder, cur_pdf_name)):
@@ -199,15 +451,22 @@ def main():
             return dframe, online_pdf_name
     else:
         print('Online rapport is same as downloaded one.')
-        target_fp = os.path.join(data_folder, 'ggd_test_data.csv' )
-        if not os.path.exists(target_fp):
+        dframe = load_test_data()
+        if dframe is None:
             pdf_path = os.path.join(pdf_folder, cur_pdf_name)
             table_page_num = extract_text(pdf_path)
             if table_page_num:
                 test_data_df = extract_table(table_page_num, pdf_path)
                 dframe = process_test_data_df(test_data_df)
-        dframe = pd.read_csv(target_fp)
         return dframe, cur_pdf_name
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='RIVM rapport GGD testing data')
+    parser.add_argument('--backfill', metavar='DIR',
+        help='Parse all historical rapports in DIR instead of the newest one')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.backfill, workers=args.workers)
+    else:
+        main()
\ No newline at end of file
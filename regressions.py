@@ -1,7 +1,12 @@
 import sys
 import datetime
+import numpy as np
 import pandas as pd
-from statsmodels.formula.api import ols
+import instrument
+
+TYPE_VARS = ['infection', 'hospital', 'deaths']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+    'Saturday', 'Sunday']
 
 def set_target_regression_variables(type_var):
     ''' Returns the variable names depending on the regression of 
@@ -51,21 +56,349 @@ def day_contrib_reg(df_input, type_var):
     regression_result: OLS Regression Results 
 
     '''
-    day_var_name, week_var_name, y_var_name = set_target_regression_variables(type_var)
-    cols_to_keep = ['date', 'week_number', day_var_name, week_var_name]
-    df = df_input[cols_to_keep].copy()
-    
-    df['date'] = pd.to_datetime(df.date, dayfirst=True)
+    # statsmodels takes long to import, so it is only imported by the
+    # regression using it
+    from statsmodels.formula.api import ols
+    y_var_name = set_target_regression_variables(type_var)[2]
+    df = weekday_shares(df_input, [type_var])
+
+    with instrument.stage(f'regression_{type_var}', rows=len(df)):
+        fit = ols(f'{y_var_name} ~ C(weekday)', data=df).fit()
+        regression_result = fit.summary() 
+    return regression_result
+
+class RegressionResult:
+    ''' Result of a weekday dummy OLS regression fitted by
+    fit_weekday_ols, holding the same statistics as the statsmodels
+    summary: params is a dataframe with the coefficients, standard
+    errors, t-values, p-values, and 95% confidence intervals, and
+    diagnostics a dict with the residual tests and information
+    criteria (see residual_diagnostics). '''
+
+    def __init__(self, y_var_name, params, nobs, df_model, rsquared, 
+            fvalue, f_pvalue, diagnostics):
+        self.y_var_name = y_var_name
+        self.params = params
+        self.nobs = nobs
+        self.df_model = df_model
+        self.df_resid = nobs - df_model - 1
+        self.rsquared = rsquared
+        self.rsquared_adj = 1 - (1 - rsquared) * (nobs - 1) / self.df_resid
+        self.fvalue = fvalue
+        self.f_pvalue = f_pvalue
+        self.diagnostics = diagnostics
+
+    def as_text(self):
+        rule = '=' * 78
+        stats = self.diagnostics
+        def row(left, left_value, right, right_value):
+            return f'{left:<20}{left_value:>19} {right:<20}{right_value:>18}'
+        lines = [
+            'OLS Regression Results'.center(78),
+            rule,
+            row('Dep. Variable:', self.y_var_name,
+                'R-squared:', f'{self.rsquared:.3f}'),
+            row('Model:', 'OLS', 'Adj. R-squared:', f'{self.rsquared_adj:.3f}'),
+            row('Method:', 'Least Squares', 'F-statistic:', f'{self.fvalue:.4g}'),
+            row('No. Observations:', self.nobs,
+                'Prob (F-statistic):', f'{self.f_pvalue:.3g}'),
+            row('Df Residuals:', self.df_resid,
+                'Log-Likelihood:', f'{stats["llf"]:.2f}'),
+            row('Df Model:', self.df_model, 'AIC:', f'{stats["aic"]:.4g}'),
+            row('Covariance Type:', 'nonrobust', 'BIC:', f'{stats["bic"]:.4g}'),
+            rule,
+            self.params.to_string(float_format=lambda x: f'{x:.4f}'),
+            rule,
+            row('Omnibus:', f'{stats["omnibus"]:.3f}',
+                'Durbin-Watson:', f'{stats["durbin_watson"]:.3f}'),
+            row('Prob(Omnibus):', f'{stats["omnibus_pvalue"]:.3f}',
+                'Jarque-Bera (JB):', f'{stats["jarque_bera"]:.3f}'),
+            row('Skew:', f'{stats["skew"]:.3f}',
+                'Prob(JB):', f'{stats["jarque_bera_pvalue"]:.3g}'),
+            row('Kurtosis:', f'{stats["kurtosis"]:.3f}',
+                'Cond. No.', f'{stats["condition_number"]:.3g}'),
+            rule
+            ]
+        return '\n'.join(lines)
+
+def weekday_design(weekdays):
+    ''' Returns the design matrix of the weekday regression: an
+    intercept and a dummy for each weekday but the first in 
+    alphabetical order (Friday), as created by the C(weekday) formula
+    term. Also returns the column names, as named by statsmodels. '''
+    levels = sorted(WEEKDAYS)
+    names = ['Intercept'] + [f'C(weekday)[T.{day}]' for day in levels[1:]]
+    codes = pd.Categorical(weekdays, categories=levels).codes
+    design = np.zeros((len(codes), len(levels)))
+    design[:, 0] = 1
+    rows = np.flatnonzero(codes > 0)
+    design[rows, codes[rows]] = 1
+    return design, names
+
+def residual_diagnostics(design, residuals):
+    ''' Returns the diagnostics of the statsmodels OLS summary for
+    each column of residuals (the fits of the columns of targets on
+    the design matrix), as a dict of arrays: the log-likelihood, AIC
+    and BIC, the Durbin-Watson statistic, the skew and kurtosis, the
+    omnibus (D'Agostino) and Jarque-Bera normality tests with their
+    p-values, and the condition number of the design matrix. '''
+    nobs, n_params = design.shape
+    n = float(nobs)
+    ssr = (residuals ** 2).sum(axis=0)
+    llf = -n / 2 * (np.log(2 * np.pi) + np.log(ssr / n) + 1)
+    centered = residuals - residuals.mean(axis=0)
+    variance = (centered ** 2).mean(axis=0)
+    skew = (centered ** 3).mean(axis=0) / variance ** 1.5
+    kurtosis = (centered ** 4).mean(axis=0) / variance ** 2
+    # Skewness and kurtosis tests, as scipy.stats.skewtest and 
+    # kurtosistest, combined into the omnibus test (normaltest)
+    y = skew * np.sqrt((n + 1) * (n + 3) / (6 * (n - 2)))
+    beta2 = (3 * (n ** 2 + 27 * n - 70) * (n + 1) * (n + 3) /
+        ((n - 2) * (n + 5) * (n + 7) * (n + 9)))
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha = np.sqrt(2 / (w2 - 1))
+    y = np.where(y == 0, 1, y)
+    z_skew = delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+    expected = 3 * (n - 1) / (n + 1)
+    var_b2 = 24 * n * (n - 2) * (n - 3) / ((n + 1) ** 2 * (n + 3) * (n + 5))
+    x = (kurtosis - expected) / np.sqrt(var_b2)
+    sqrt_beta1 = (6 * (n ** 2 - 5 * n + 2) / ((n + 7) * (n + 9)) *
+        np.sqrt(6 * (n + 3) * (n + 5) / (n * (n - 2) * (n - 3))))
+    a = 6 + 8 / sqrt_beta1 * (2 / sqrt_beta1 + np.sqrt(1 + 4 / sqrt_beta1 ** 2))
+    denom = 1 + x * np.sqrt(2 / (a - 4))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        term2 = np.sign(denom) * ((1 - 2 / a) / np.abs(denom)) ** (1 / 3)
+    z_kurtosis = (1 - 2 / (9 * a) - term2) / np.sqrt(2 / (9 * a))
+    omnibus = z_skew ** 2 + z_kurtosis ** 2
+    jarque_bera = n / 6 * (skew ** 2 + (kurtosis - 3) ** 2 / 4)
+    eigenvalues = np.linalg.eigvalsh(design.T @ design)
+    return {
+        'llf' : llf,
+        'aic' : -2 * llf + 2 * n_params,
+        'bic' : -2 * llf + np.log(n) * n_params,
+        'durbin_watson' : (np.diff(residuals, axis=0) ** 2).sum(axis=0) / ssr,
+        'skew' : skew,
+        'kurtosis' : kurtosis,
+        'omnibus' : omnibus,
+        # The chi-squared survival function with 2 degrees of freedom
+        'omnibus_pvalue' : np.exp(-omnibus / 2),
+        'jarque_bera' : jarque_bera,
+        'jarque_bera_pvalue' : np.exp(-jarque_bera / 2),
+        'condition_number' : np.full(residuals.shape[1],
+            np.sqrt(eigenvalues.max() / eigenvalues.min()))
+        }
+
+def fit_weekday_ols(design, targets, names, y_var_names):
+    ''' Fits the OLS regression of each column of targets on the
+    design matrix in a single least squares solve, and returns a 
+    RegressionResult per target. All targets need to be observed on 
+    the same rows. '''
+    # scipy.special holds the t and F distribution functions without
+    # the import cost of scipy.stats
+    from scipy import special
+    nobs, n_params = design.shape
+    df_resid = nobs - n_params
+    coefs = np.linalg.lstsq(design, targets, rcond=None)[0]
+    residuals = targets - design @ coefs
+    sigma2 = (residuals ** 2).sum(axis=0) / df_resid
+    xtx_inv_diag = np.diag(np.linalg.inv(design.T @ design))
+    std_errs = np.sqrt(np.outer(xtx_inv_diag, sigma2))
+    t_values = coefs / std_errs
+    p_values = 2 * special.stdtr(df_resid, -np.abs(t_values))
+    t_crit = special.stdtrit(df_resid, 0.975)
+    centered = targets - targets.mean(axis=0)
+    rsquared = 1 - (residuals ** 2).sum(axis=0) / (centered ** 2).sum(axis=0)
+    df_model = n_params - 1
+    # A perfect fit has an infinite F-statistic
+    with np.errstate(divide='ignore'):
+        fvalues = (rsquared / df_model) / ((1 - rsquared) / df_resid)
+    f_pvalues = special.fdtrc(df_model, df_resid, fvalues)
+    diagnostics = residual_diagnostics(design, residuals)
+    results = []
+    for i, y_var_name in enumerate(y_var_names):
+        params = pd.DataFrame({
+            'coef' : coefs[:, i],
+            'std err' : std_errs[:, i],
+            't' : t_values[:, i],
+            'P>|t|' : p_values[:, i],
+            '[0.025' : coefs[:, i] - t_crit * std_errs[:, i],
+            '0.975]' : coefs[:, i] + t_crit * std_errs[:, i]
+            }, index=names)
+        results.append(RegressionResult(y_var_name, params, nobs, df_model,
+            rsquared[i], fvalues[i], f_pvalues[i],
+            {name : values[i] for name, values in diagnostics.items()}))
+    return results
+
+def weekday_shares(df_input, type_vars=TYPE_VARS):
+    ''' Prepares the data of the weekday regressions of all inputted
+    type variables at once: parses the dates, determines the weekday,
+    drops the non-complete weeks, and calculates the ratio of day to
+    week total of each variable. '''
+    names = [set_target_regression_variables(type_var) for type_var in type_vars]
+    cols_to_keep = ['date', 'week_number']
+    for day_var_name, week_var_name, _ in names:
+        cols_to_keep += [day_var_name, week_var_name]
+    df = df_input[list(dict.fromkeys(cols_to_keep))].copy()
+    if not pd.api.types.is_datetime64_any_dtype(df.date):
+        df['date'] = pd.to_datetime(df.date, dayfirst=True)
     df['weekday'] = df.date.dt.day_name() 
     week_count = df.week_number.value_counts()
     to_remove = week_count[week_count < 7].index
     df = df[~df.week_number.isin(to_remove)].copy()
-    df[y_var_name] = df[day_var_name] / df[week_var_name]
+    for day_var_name, week_var_name, y_var_name in names:
+        df[y_var_name] = df[day_var_name] / df[week_var_name]
+    return df
 
-    fit = ols(f'{y_var_name} ~ C(weekday)', data=df).fit()
-    regression_result = fit.summary() 
-    return regression_result
+def day_contrib_reg_batch(df_input, type_vars=TYPE_VARS):
+    ''' Batch version of day_contrib_reg: prepares the data and the
+    design matrix once, and fits the weekday regressions of all
+    inputted type variables in one vectorized least squares solve
+    (one per set of rows, as rows with a missing ratio, e.g. of a
+    week without deaths, are dropped per variable like statsmodels
+    does). Returns a dict of type variable -> RegressionResult. '''
+    df = weekday_shares(df_input, type_vars)
+    y_var_names = [set_target_regression_variables(type_var)[2]
+        for type_var in type_vars]
+    with instrument.stage('regression_batch', rows=len(df), 
+            targets=len(type_vars)):
+        design, names = weekday_design(df.weekday)
+        targets = df[y_var_names].to_numpy(dtype=float)
+        observed = np.isfinite(targets)
+        groups = {}
+        for i in range(len(type_vars)):
+            groups.setdefault(observed[:, i].tobytes(), []).append(i)
+        results = {}
+        for columns in groups.values():
+            rows = observed[:, columns[0]]
+            fits = fit_weekday_ols(design[rows], targets[rows][:, columns],
+                names, [y_var_names[i] for i in columns])
+            for i, fit in zip(columns, fits):
+                results[type_vars[i]] = fit
+    return {type_var : results[type_var] for type_var in type_vars}
+
+def results_frame(results):
+    ''' Returns a dict of regression results (as returned by
+    day_contrib_reg_batch) as one long dataframe, with a row per type
+    variable and coefficient holding its statistics and the statistics
+    of the fit. '''
+    frames = []
+    for type_var, result in results.items():
+        params = result.params.rename(columns={
+            'std err' : 'std_err',
+            'P>|t|' : 'p_value',
+            '[0.025' : 'ci_low',
+            '0.975]' : 'ci_high'
+            })
+        params = params.rename_axis('term').reset_index()
+        params.insert(0, 'type_var', type_var)
+        params['nobs'] = result.nobs
+        params['rsquared'] = result.rsquared
+        params['fvalue'] = result.fvalue
+        params['f_pvalue'] = result.f_pvalue
+        frames.append(params)
+    return pd.concat(frames, ignore_index=True)
 
 def export_regression_results(results):
+    ''' Writes the regression summary, or a dict of summaries (as
+    returned by day_contrib_reg_batch), into reg_results.txt. '''
+    if not isinstance(results, dict):
+        results = {None : results}
     with open('reg_results.txt', 'w') as f:
-        f.write(results.as_text()) 
\ No newline at end of file
+        f.write('\n\n'.join(result.as_text() for result in results.values()))
+
+def weekly_normal_equations(df, y_var_names):
+    ''' Splits the normal equations of the weekday regressions into
+    the contributions of each week. Returns the weeks and arrays 
+    indexed by week and target: X'X (weeks, targets, k, k), X'y 
+    (weeks, targets, k), y'y and the number of observations, along
+    with the names of the coefficients. Missing ratios are left out
+    of the sums of their target only. '''
+    design, names = weekday_design(df.weekday)
+    targets = df[y_var_names].to_numpy(dtype=float)
+    observed = np.isfinite(targets)
+    targets = np.where(observed, targets, 0)
+    weeks, week_index = np.unique(df.week_number.to_numpy(), return_inverse=True)
+    n_weeks, n_targets, k = len(weeks), len(y_var_names), design.shape[1]
+    xtx = np.zeros((n_weeks, n_targets, k, k))
+    xty = np.zeros((n_weeks, n_targets, k))
+    yty = np.zeros((n_weeks, n_targets))
+    nobs = np.zeros((n_weeks, n_targets))
+    for t in range(n_targets):
+        x = design * observed[:, [t]]
+        outer = x[:, :, None] * x[:, None, :]
+        np.add.at(xtx[:, t], week_index, outer)
+        np.add.at(xty[:, t], week_index, x * targets[:, [t]])
+        np.add.at(yty[:, t], week_index, targets[:, t] ** 2)
+        np.add.at(nobs[:, t], week_index, observed[:, t])
+    return weeks, xtx, xty, yty, nobs, names
+
+def rolling_day_contrib_reg(df_input, window=12, type_vars=TYPE_VARS,
+        expanding=False):
+    ''' Estimates the weekday regression of day_contrib_reg for every
+    window of consecutive complete weeks: each window of the inputted
+    number of weeks, or with expanding set, all weeks up to and
+    including each week (starting at window weeks). Rather than 
+    refitting every window, the normal equations are updated by 
+    adding the newest week and removing the oldest, and all targets
+    of a window are solved at once.
+
+    Returns a tidy dataframe with a row per window, type variable,
+    and coefficient: the first and last week of the window, the 
+    coefficient name, estimate, standard error, and the number of
+    observations. '''
+    df = weekday_shares(df_input, type_vars).sort_values('date')
+    y_var_names = [set_target_regression_variables(type_var)[2]
+        for type_var in type_vars]
+    with instrument.stage('rolling_regression', rows=len(df),
+            targets=len(type_vars)):
+        weeks, xtx, xty, yty, nobs, names = weekly_normal_equations(
+            df, y_var_names)
+        k = len(names)
+        sum_xtx, sum_xty = np.zeros(xtx.shape[1:]), np.zeros(xty.shape[1:])
+        sum_yty, sum_nobs = np.zeros(yty.shape[1:]), np.zeros(nobs.shape[1:])
+        windows = []
+        for i in range(len(weeks)):
+            sum_xtx += xtx[i]
+            sum_xty += xty[i]
+            sum_yty += yty[i]
+            sum_nobs += nobs[i]
+            first = 0 if expanding else i - window + 1
+            if not expanding and first > 0:
+                sum_xtx -= xtx[first - 1]
+                sum_xty -= xty[first - 1]
+                sum_yty -= yty[first - 1]
+                sum_nobs -= nobs[first - 1]
+            if i + 1 < window:
+                continue
+            # X'X is singular for targets without an observation of
+            # every weekday in the window, which are left out
+            dummies = np.diagonal(sum_xtx, axis1=1, axis2=2)[:, 1:]
+            solvable = (dummies > 0).all(axis=1) & (
+                sum_nobs - dummies.sum(axis=1) > 0) & (sum_nobs > k)
+            if not solvable.any():
+                continue
+            xtx_inv = np.linalg.inv(sum_xtx[solvable])
+            coefs = np.einsum('tij,tj->ti', xtx_inv, sum_xty[solvable])
+            rss = sum_yty[solvable] - np.einsum('ti,ti->t', coefs, 
+                sum_xty[solvable])
+            sigma2 = rss / (sum_nobs[solvable] - k)
+            std_errs = np.sqrt(np.diagonal(xtx_inv, axis1=1, axis2=2) * 
+                sigma2[:, None])
+            windows.append((first, i, np.flatnonzero(solvable), coefs, 
+                std_errs, sum_nobs[solvable]))
+    columns = ['first_week', 'last_week', 'type_var', 'term', 'coef', 
+        'std_err', 'nobs']
+    if not windows:
+        return pd.DataFrame(columns=columns)
+    firsts, lasts, targets, coefs, std_errs, window_nobs = zip(*windows)
+    counts = [len(solved) * k for solved in targets]
+    return pd.DataFrame({
+        'first_week' : np.repeat(weeks[list(firsts)], counts),
+        'last_week' : np.repeat(weeks[list(lasts)], counts),
+        'type_var' : np.repeat(np.asarray(type_vars)[np.concatenate(targets)], k),
+        'term' : np.tile(names, sum(counts) // k),
+        'coef' : np.concatenate([c.ravel() for c in coefs]),
+        'std_err' : np.concatenate([e.ravel() for e in std_errs]),
+        'nobs' : np.repeat(np.concatenate(window_nobs), k).astype(int)
+        }, columns=columns)
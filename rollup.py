@@ -0,0 +1,202 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import instrument
+from weeknumbers import week_numbers
+
+# Region levels of the cube, with the key and name columns of the
+# RIVM feed identifying a region
+LEVELS = {
+    'municipality' : ('Municipality_code', 'Municipality_name'),
+    'province' : ('Province', 'Province'),
+    'safety_region' : ('Security_region_code', 'Security_region_name')
+    }
+PERIODS = ['day', 'week']
+# Measures of the cube, and the RIVM column summed into each
+MEASURES = {
+    'infection' : 'Total_reported',
+    'hospital' : 'Hospital_admission',
+    'dead' : 'Deceased'
+    }
+META_NAME = 'meta.json'
+
+def fill_missing(values):
+    ''' Returns the column of region keys or names with the missing
+    values replaced by '' (adding it to the categories of a
+    categorical column). '''
+    if isinstance(values.dtype, pd.CategoricalDtype) and '' not in values.cat.categories:
+        values = values.cat.add_categories('')
+    return values.fillna('')
+
+def factorize_keys(values):
+    ''' Returns the integer codes of the region keys in the column, and
+    the keys as sorted strings (so the code of a key can be found by
+    binary search, also for categorical columns). '''
+    codes, uniques = pd.factorize(fill_missing(values))
+    uniques = np.asarray(uniques, dtype=str)
+    order = np.argsort(uniques, kind='stable')
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    return ranks[codes], uniques[order]
+
+def cube_dir():
+    return os.path.join(os.getcwd(), 'data', 'rollup')
+
+class RollupCube:
+    ''' The RIVM figures summed by day and by ISO week, for every
+    municipality, province, and safety region. Dates, weeks, and
+    regions are integer coded by their sorted position, and each
+    (level, period) holds one array of shape (measures, regions,
+    periods), so the figures of a region over a date range are a
+    contiguous slice found by binary search. '''
+
+    def __init__(self, dates, weeks, keys, names, arrays):
+        self.dates = np.asarray(dates)
+        self.weeks = np.asarray(weeks)
+        self.keys = keys
+        self.names = names
+        self.arrays = arrays
+
+    def region_index(self, level, key):
+        ''' Returns the integer code of the region key on the level. '''
+        keys = self.keys[level]
+        i = np.searchsorted(keys, key)
+        if i == len(keys) or keys[i] != key:
+            raise KeyError(f'Unknown {level}: {key}')
+        return i
+
+    def period_slice(self, period='day', start=None, end=None):
+        ''' Returns the slice of the days (or weeks) from start up to
+        and including end, either of which may be left open. Days are
+        dates, weeks ISO week labels (e.g. 2021W01). '''
+        labels = self.dates if period == 'day' else self.weeks
+        if period == 'day':
+            start = None if start is None else pd.Timestamp(start).to_datetime64()
+            end = None if end is None else pd.Timestamp(end).to_datetime64()
+        first = 0 if start is None else np.searchsorted(labels, start, 'left')
+        last = len(labels) if end is None else np.searchsorted(labels, end, 'right')
+        return slice(first, last)
+
+    def _frame(self, values, period, periods):
+        if period == 'day':
+            dframe = pd.DataFrame({'date' : pd.to_datetime(self.dates[periods])})
+        else:
+            dframe = pd.DataFrame({'week_number' : self.weeks[periods]})
+        for i, measure in enumerate(MEASURES):
+            dframe[f'{measure}_{period}'] = values[i]
+        return dframe
+
+    def region(self, level, key, period='day', start=None, end=None):
+        ''' Returns the figures of a single region over the inputted
+        date (or week) range as a dataframe. '''
+        periods = self.period_slice(period, start, end)
+        values = self.arrays[(level, period)][:, self.region_index(level, key), periods]
+        return self._frame(values, period, periods)
+
+    def national(self, period='day', start=None, end=None):
+        ''' Returns the national totals (over all municipalities,
+        including the rows without one) as a dataframe. '''
+        periods = self.period_slice(period, start, end)
+        values = self.arrays[('municipality', period)][:, :, periods].sum(axis=1)
+        return self._frame(values, period, periods)
+
+    def frame(self, level, period='day'):
+        ''' Returns the figures of all regions on the level as a long
+        dataframe, with a row per region and day (or week). '''
+        array = self.arrays[(level, period)]
+        n_regions, n_periods = array.shape[1:]
+        labels = pd.to_datetime(self.dates) if period == 'day' else self.weeks
+        dframe = pd.DataFrame({
+            level : np.repeat(self.keys[level], n_periods),
+            'name' : np.repeat(self.names[level], n_periods),
+            'date' if period == 'day' else 'week_number' : np.tile(labels, n_regions)
+            })
+        for i, measure in enumerate(MEASURES):
+            dframe[f'{measure}_{period}'] = array[i].ravel()
+        return dframe
+
+    def save(self, path=None):
+        ''' Stores the cube as a directory of .npy arrays and a JSON
+        file with the coded dates, weeks, and regions. The directory
+        is written next to the old one and then swapped in. '''
+        path = path or cube_dir()
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        meta = {
+            'dates' : list(np.datetime_as_string(self.dates, unit='D')),
+            'weeks' : list(self.weeks),
+            'keys' : {level : list(keys) for level, keys in self.keys.items()},
+            'names' : {level : list(names) for level, names in self.names.items()}
+            }
+        with open(os.path.join(tmp_path, META_NAME), 'w') as f:
+            json.dump(meta, f)
+        for (level, period), array in self.arrays.items():
+            np.save(os.path.join(tmp_path, f'{level}_{period}.npy'), array)
+        if os.path.exists(path):
+            os.replace(path, path + '.old')
+        os.replace(tmp_path, path)
+        shutil.rmtree(path + '.old', ignore_errors=True)
+        return path
+
+def load_cube(path=None, mmap=True):
+    ''' Reads a cube stored by RollupCube.save, memory mapping the
+    arrays unless mmap is disabled. Returns None if there is none. '''
+    path = path or cube_dir()
+    if not os.path.exists(os.path.join(path, META_NAME)):
+        return None
+    with open(os.path.join(path, META_NAME)) as f:
+        meta = json.load(f)
+    arrays = {(level, period) : np.load(os.path.join(path, f'{level}_{period}.npy'),
+        mmap_mode='r' if mmap else None) for level in LEVELS for period in PERIODS}
+    return RollupCube(pd.to_datetime(meta['dates']).to_numpy(), meta['weeks'],
+        {level : np.asarray(keys) for level, keys in meta['keys'].items()},
+        {level : np.asarray(names) for level, names in meta['names'].items()},
+        arrays)
+
+@instrument.timed('rollup_cube')
+def build_cube(raw_rivm_df):
+    ''' Builds the rollup cube from the raw RIVM frame (as returned by
+    get_rivm_data_main) in a single pass over the rows: the rows are
+    summed by cell, a distinct (municipality, province, safety region)
+    combination, and day, and all levels and the weeks are summed from
+    those totals. Rows without a municipality (or province / safety
+    region) are kept under the key '', in the province and safety
+    region of the row. '''
+    day_codes, dates = pd.factorize(raw_rivm_df.date, sort=True)
+    level_codes, keys = {}, {}
+    for level, (key_col, name_col) in LEVELS.items():
+        level_codes[level], keys[level] = factorize_keys(raw_rivm_df[key_col])
+    combined = np.zeros(len(raw_rivm_df), dtype=np.int64)
+    for level, codes in level_codes.items():
+        combined = combined * len(keys[level]) + codes
+    cells, first_rows, cell_codes = np.unique(combined, return_index=True,
+        return_inverse=True)
+    cell_codes = cell_codes.ravel()
+    n_days, n_cells = len(dates), len(cells)
+    flat_index = cell_codes * n_days + day_codes
+    cell_day = np.stack([np.bincount(flat_index, minlength=n_cells * n_days,
+        weights=raw_rivm_df[column].fillna(0).to_numpy(dtype=float))
+        for column in MEASURES.values()]).round().astype(np.int64)
+    cell_day = cell_day.reshape(len(MEASURES), n_cells, n_days)
+    first = raw_rivm_df.iloc[first_rows]
+    names, day_arrays = {}, {}
+    for level, (key_col, name_col) in LEVELS.items():
+        region_codes = level_codes[level][first_rows]
+        names[level] = np.empty(len(keys[level]), dtype=object)
+        names[level][region_codes] = fill_missing(first[name_col]).to_numpy()
+        # Sum the cells of each region, as contiguous runs
+        order = np.argsort(region_codes, kind='stable')
+        region_starts = np.flatnonzero(np.r_[True, np.diff(region_codes[order]) != 0])
+        day_arrays[level] = np.add.reduceat(cell_day[:, order], region_starts, axis=1)
+    week_labels = week_numbers(pd.Series(dates)).to_numpy()
+    week_starts = np.flatnonzero(np.r_[True, week_labels[1:] != week_labels[:-1]])
+    arrays = {}
+    for level, day_array in day_arrays.items():
+        arrays[(level, 'day')] = day_array
+        arrays[(level, 'week')] = np.add.reduceat(day_array, week_starts, axis=2)
+    return RollupCube(dates.to_numpy(), week_labels[week_starts], keys,
+        {level : level_names.astype(str) for level, level_names in names.items()},
+        arrays)
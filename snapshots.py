@@ -0,0 +1,129 @@
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from httpcache import CachedResponse
+
+SNAPSHOT_DIR = os.path.join(os.getcwd(), 'snapshots')
+MANIFEST_NAME = 'manifest.json'
+COMPRESS_LEVEL = 6
+
+class SnapshotResponse(CachedResponse):
+    ''' Stands in for a requests response whose body is replayed from
+    a snapshot (stored gzip compressed). '''
+    from_snapshot = True
+
+    def _open(self):
+        return gzip.open(self.path, 'rb')
+
+class Snapshot:
+    ''' A named set of recorded response bodies, stored compressed in
+    SNAPSHOT_DIR/name together with a manifest holding the url, the
+    time of recording, and the size of each body. '''
+
+    def __init__(self, name, snapshot_dir=None):
+        self.name = name
+        self.path = os.path.join(snapshot_dir or SNAPSHOT_DIR, name)
+        self.manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.entries = self._load_manifest()
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)['responses']
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'name' : self.name, 'responses' : self.entries},
+                f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _body_path(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.path, name + '.gz')
+
+    def record(self, url, chunks):
+        ''' Stores the body (an iterable of byte chunks) of the
+        response to url, replacing an earlier recording. '''
+        os.makedirs(self.path, exist_ok=True)
+        path = self._body_path(url)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        size = 0
+        with gzip.open(tmp_path, 'wb', compresslevel=COMPRESS_LEVEL) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.entries[url] = {
+                'file' : os.path.basename(path),
+                'recorded' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'size' : size,
+                'compressed_size' : os.path.getsize(path)
+                }
+            self._save_manifest()
+
+    def response(self, url):
+        ''' Returns the recorded response to url. Exits if the url was
+        not recorded in this snapshot. '''
+        if url not in self.entries:
+            print(f'No response to {url} in snapshot {self.name}.')
+            sys.exit()
+        return SnapshotResponse(url, self._body_path(url))
+
+    def summary(self):
+        return {
+            'name' : self.name,
+            'responses' : len(self.entries),
+            'size' : sum(entry['size'] for entry in self.entries.values()),
+            'compressed_size' : sum(entry['compressed_size']
+                for entry in self.entries.values()),
+            'recorded' : max((entry['recorded'] for entry in
+                self.entries.values()), default=None)
+            }
+
+def list_snapshots(snapshot_dir=None):
+    ''' Returns the summaries of the snapshots in snapshot_dir. '''
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = [Snapshot(name, snapshot_dir) for name in
+        sorted(os.listdir(snapshot_dir))]
+    return [snapshot.summary() for snapshot in snapshots if snapshot.exists()]
+
+def remove_snapshot(name, snapshot_dir=None):
+    shutil.rmtree(Snapshot(name, snapshot_dir).path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Covid_NL response snapshots')
+    parser.add_argument('command', choices=['list', 'show', 'remove'])
+    parser.add_argument('name', nargs='?', help='Snapshot name')
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        for summary in list_snapshots():
+            print(json.dumps(summary))
+        return
+    if not args.name:
+        parser.error(f'{args.command} needs a snapshot name')
+    snapshot = Snapshot(args.name)
+    if not snapshot.exists():
+        print(f'Snapshot {args.name} not found.')
+        sys.exit()
+    if args.command == 'show':
+        print(json.dumps(snapshot.entries, indent=4))
+    else:
+        remove_snapshot(args.name)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import synthetic
+from daemon import Daemon
+from pipeline import Pipeline
+from benchmarks import offline_pipeline
+
+def soak(cycles=100, change_every=5, n_municipalities=50, n_days=200,
+        targets=None):
+    ''' Runs the daemon for the inputted number of cycles (without
+    waiting between them) against the offline stand-in sources, and
+    publishes a revised RIVM feed (of the same size) every change_every
+    cycles. Returns the timings of the cycles with and without a
+    changed source, and the memory use over the run. '''
+    with offline_pipeline(n_municipalities, n_days) as standin:
+        daemon = Daemon(interval=0, targets=targets,
+            pipeline=Pipeline(cache_dir=os.path.join(os.getcwd(), '.pipeline_cache')),
+            log_path=os.path.join(os.getcwd(), 'daemon_cycles.jsonl'))
+        records = []
+        for i in range(cycles):
+            if i and i % change_every == 0:
+                standin.set_route('/rivm.json', synthetic.rivm_json_bytes(
+                    n_municipalities, n_days, seed=i))
+            records.append(daemon.cycle())
+    errors = [record for record in records if 'error' in record]
+    # The first cycle runs every task, and the following ones warm up
+    # the caches, so memory is compared from the second quarter on
+    rss = np.array([record['rss_mb'] or 0 for record in records])
+    quarter = max(len(rss) // 4, 1)
+    def timings(selected):
+        wall = np.array([record['wall_s'] for record in selected])
+        if not len(wall):
+            return {}
+        return {
+            'cycles' : len(wall),
+            'p50_s' : round(float(np.percentile(wall, 50)), 3),
+            'max_s' : round(float(wall.max()), 3)
+            }
+    return {
+        'cycles' : cycles,
+        'errors' : len(errors),
+        'first_error' : errors[0]['error'] if errors else None,
+        'first_cycle_s' : records[0]['wall_s'],
+        'changed' : timings([record for record in records[1:] if record.get('changed')]),
+        'unchanged' : timings([record for record in records[1:] if not record.get('changed')]),
+        'tasks_per_changed_cycle' : sorted({len(record.get('run', []))
+            for record in records[1:] if record.get('changed')}),
+        'rss_mb' : {
+            'first' : float(rss[0]),
+            'second_quarter' : float(np.median(rss[quarter:2 * quarter])),
+            'last_quarter' : float(np.median(rss[-quarter:])),
+            'max' : float(rss.max())
+            },
+        'rss_growth_mb' : round(float(np.median(rss[-quarter:]) -
+            np.median(rss[quarter:2 * quarter])), 1)
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soak test of daemon.py')
+    parser.add_argument('targets', nargs='*',
+        help='Pipeline tasks kept up to date (default: all)')
+    parser.add_argument('--cycles', type=int, default=100)
+    parser.add_argument('--change-every', type=int, default=5,
+        help='Revise the RIVM feed every this many cycles')
+    parser.add_argument('--municipalities', type=int, default=50)
+    parser.add_argument('--days', type=int, default=200)
+    args = parser.parse_args(argv)
+    results = soak(args.cycles, args.change_every, args.municipalities,
+        args.days, args.targets or None)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
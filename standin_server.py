@@ -0,0 +1,86 @@
+import time
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandinServer:
+    ''' Local stand-in for the RIVM and NICE servers. Serves the
+    bodies in routes (path -> bytes) from a background thread,
+    delaying every response by latency seconds. Responses carry an 
+    ETag, and conditional requests for unchanged bodies are answered
+    with 304. Usable as a context manager. '''
+
+    def __init__(self, routes=None, latency=0.0):
+        self.routes = {}
+        self.latency = latency
+        self.request_count = 0
+        self.not_modified_count = 0
+        self._last_modified = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        for path, body in (routes or {}).items():
+            self.set_route(path, body)
+
+    def url(self, path):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def set_route(self, path, body):
+        with self._lock:
+            self.routes[path] = body
+            self._last_modified[path] = formatdate(time.time(), usegmt=True)
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                with standin._lock:
+                    standin.request_count += 1
+                    body = standin.routes.get(path)
+                    last_modified = standin._last_modified.get(path)
+                time.sleep(standin.latency)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    with standin._lock:
+                        standin.not_modified_count += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+            daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
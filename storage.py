@@ -0,0 +1,57 @@
+import os
+import pandas as pd
+
+# Format used to persist the exported dataframes: 'csv', 'parquet' or 'feather'.
+# The binary formats need pyarrow, and keep the column dtypes.
+STORAGE_FORMAT = os.environ.get('COVID_NL_STORAGE', 'csv')
+EXTENSIONS = {
+    'csv' : '.csv',
+    'parquet' : '.parquet',
+    'feather' : '.feather'
+    }
+
+def check_format(storage_format):
+    storage_format = storage_format or STORAGE_FORMAT
+    if storage_format not in EXTENSIONS:
+        raise ValueError(f'Unknown storage format: {storage_format}')
+    return storage_format
+
+def frame_path(stem, storage_format=None):
+    ''' Returns the file path of the dataframe stored under stem (a
+    path without extension) in the inputted or configured format. '''
+    return stem + EXTENSIONS[check_format(storage_format)]
+
+def write_frame(dframe, stem, storage_format=None, index=False):
+    ''' Writes the dataframe to stem plus the extension of the storage
+    format. The file is written next to the old one and then swapped
+    in. The index is only written to csv files (when index is set);
+    the binary formats always store a default index. Returns the path
+    written to. '''
+    storage_format = check_format(storage_format)
+    path = frame_path(stem, storage_format)
+    tmp_path = path + '.tmp'
+    if storage_format == 'csv':
+        dframe.to_csv(tmp_path, index=index, date_format='%Y-%m-%d')
+    elif storage_format == 'parquet':
+        dframe.reset_index(drop=True).to_parquet(tmp_path, index=False)
+    else:
+        dframe.reset_index(drop=True).to_feather(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def read_frame(stem, storage_format=None, parse_dates=None, index=False):
+    ''' Reads a dataframe written by write_frame. The parse_dates and
+    index arguments are only needed for csv files, which do not keep
+    the dtypes. The binary formats are memory mapped. Returns None if
+    the file does not exist. '''
+    storage_format = check_format(storage_format)
+    path = frame_path(stem, storage_format)
+    if not os.path.exists(path):
+        return None
+    if storage_format == 'csv':
+        return pd.read_csv(path, parse_dates=parse_dates or False,
+            index_col=0 if index else None)
+    if storage_format == 'parquet':
+        return pd.read_parquet(path, memory_map=True)
+    from pyarrow import feather
+    return feather.read_table(path, memory_map=True).to_pandas()
@@ -0,0 +1,181 @@
+import json
+import random
+import datetime
+import numpy as np
+import pandas as pd
+from weeknumbers import week_numbers
+
+RIVM_START_DATE = datetime.date(2020, 2, 27)
+
+def municipality_records(n_municipalities):
+    ''' Returns a list of dicts describing fake municipalities, with
+    the geographic fields present in the RIVM per municipality feed. '''
+    municipalities = []
+    for i in range(n_municipalities):
+        province = i % 12
+        region = i % 25
+        municipalities.append({
+            'Municipality_code' : f'GM{i:04d}',
+            'Municipality_name' : f'Gemeente {i}',
+            'Province' : f'Provincie {province}',
+            'Security_region_code' : f'VR{region + 1:02d}',
+            'Security_region_name' : f'Veiligheidsregio {region + 1}',
+            'Municipal_health_service' : f'GGD {region + 1}',
+            'ROAZ_region' : f'ROAZ {province}'
+            })
+    return municipalities
+
+def rivm_records(n_municipalities=355, n_days=365, seed=0,
+        start_date=RIVM_START_DATE):
+    ''' Yields synthetic records in the shape of the RIVM
+    COVID-19_aantallen_gemeente_per_dag.json feed, one per
+    municipality per day. '''
+    rand = random.Random(seed)
+    municipalities = municipality_records(n_municipalities)
+    report_date = (start_date + datetime.timedelta(days=n_days)).isoformat()
+    for day in range(n_days):
+        publication_date = (start_date + datetime.timedelta(days=day)).isoformat()
+        for municipality in municipalities:
+            record = {
+                'Date_of_report' : f'{report_date} 10:00:00',
+                'Date_of_publication' : publication_date
+                }
+            record.update(municipality)
+            record['Total_reported'] = rand.randint(0, 40)
+            record['Hospital_admission'] = rand.randint(0, 3)
+            record['Deceased'] = rand.randint(0, 1)
+            yield record
+
+def rivm_json_chunks(n_municipalities=355, n_days=365, seed=0,
+        chunk_size=1 << 20):
+    ''' Yields the synthetic RIVM feed as utf-8 encoded JSON in chunks
+    of roughly chunk_size bytes, mimicking a streamed HTTP response
+    without holding the whole body in memory. '''
+    parts = [b'[']
+    size = 1
+    first = True
+    for record in rivm_records(n_municipalities, n_days, seed):
+        encoded = json.dumps(record).encode('utf-8')
+        if not first:
+            parts.append(b',')
+            size += 1
+        parts.append(encoded)
+        size += len(encoded)
+        first = False
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    parts.append(b']')
+    yield b''.join(parts)
+
+def rivm_json_bytes(n_municipalities=355, n_days=365, seed=0):
+    ''' Returns the complete synthetic RIVM feed as bytes, as it
+    would be found in response.content. '''
+    return b''.join(rivm_json_chunks(n_municipalities, n_days, seed))
+
+def nice_records(n_days=365, seed=0, start_date=RIVM_START_DATE, scale=500):
+    ''' Yields synthetic records in the shape of the NICE intake-count
+    feeds: one {date, value} pair per day. '''
+    rand = random.Random(seed)
+    for day in range(n_days):
+        yield {
+            'date' : (start_date + datetime.timedelta(days=day)).isoformat(),
+            'value' : rand.randint(0, scale)
+            }
+
+def nice_json_bytes(n_days=365, seed=0, scale=500):
+    ''' Returns a synthetic NICE feed as bytes. '''
+    return json.dumps(list(nice_records(n_days, seed, scale=scale))).encode('utf-8')
+
+def merged_frame(n_days=3 * 365, seed=0, start_date=RIVM_START_DATE):
+    ''' Returns a synthetic dataframe in the shape returned by
+    getdata.data_main, covering n_days. '''
+    rng = np.random.default_rng(seed)
+    dframe = pd.DataFrame({
+        'date' : pd.date_range(start_date, periods=n_days, freq='D')
+        })
+    dframe['week_number'] = week_numbers(dframe.date)
+    for col, high in [('infection', 10000), ('hospital', 300), ('dead', 100)]:
+        dframe[f'{col}_day'] = rng.integers(0, high, n_days)
+    for col in ['infection', 'hospital', 'dead']:
+        dframe[f'{col}_week'] = dframe.groupby('week_number')[
+            f'{col}_day'].transform('sum')
+    dframe['IC_current'] = rng.integers(0, 700, n_days)
+    dframe['ZKH_current'] = rng.integers(0, 3000, n_days)
+    return dframe
+
+def rivm_frame(n_municipalities=355, n_days=365, seed=0, schema=True):
+    ''' Returns the synthetic RIVM feed as the dataframe returned by
+    getdata.get_rivm_data_main, with the date set. With schema 
+    disabled, the columns keep the types they are loaded from JSON
+    with. '''
+    import getdata
+    dframe = pd.DataFrame(list(rivm_records(n_municipalities, n_days, seed)))
+    if schema:
+        dframe = getdata.apply_rivm_schema(dframe)
+    else:
+        dframe['date'] = pd.to_datetime(dframe.Date_of_publication)
+    return dframe
+
+def nice_frame(variable_name, n_days=365, seed=0, scale=500):
+    ''' Returns a synthetic NICE feed as the dataframe returned by
+    getdata.get_nice_data for the inputted variable name. '''
+    dframe = pd.DataFrame(list(nice_records(n_days, seed, scale=scale)))
+    dframe = dframe.rename(columns={'value' : variable_name})
+    dframe['date'] = pd.to_datetime(dframe.date)
+    return dframe
+
+def ggd_table(n_weeks=12, seed=0, end_date=datetime.date(2021, 2, 21)):
+    ''' Returns a synthetic GGD testing table in the raw shape
+    extracted from a rapport by rapport_data.extract_table (integer
+    column labels, all values as strings): a title and header rows,
+    one row per week up to end_date (a sunday), the totals row, and
+    the footnote rows. This is the input of process_test_data_df. '''
+    rand = random.Random(seed)
+    nan = float('nan')
+    rows = [
+        ['9 SARS-COV-2 T', 'ESTEN AFGENOMEN DOOR', 'DE GGD’EN VANAF', 
+            'NOVEMBER 2020'],
+        ['Tabel 13: Aantal testen uitg', 'evoerd door de GGD’en, m',
+            'et bekende uitslag.', nan],
+        ['1', nan, nan, nan],
+        ['Datum van - tot', 'Aantal testen met', 'Aantal positief', 
+            'Percentage'],
+        [nan, 'uitslag', nan, 'positief']
+        ]
+    total_tests = total_positive = 0
+    for week in range(n_weeks, 0, -1):
+        end = end_date - datetime.timedelta(weeks=week - 1)
+        start = end - datetime.timedelta(days=6)
+        tests = rand.randint(150000, 500000)
+        positive = int(tests * rand.uniform(0.05, 0.15))
+        total_tests += tests
+        total_positive += positive
+        rows.append([f'{start:%d-%m-%Y} - {end:%d-%m-%Y}', str(tests),
+            str(positive), f'{100 * positive / tests:.1f}'])
+    rows.append(['Totaal', str(total_tests), str(total_positive),
+        f'{100 * total_positive / total_tests:.1f}'])
+    rows.append(['1', nan, nan, nan])
+    rows.append(['De gegevens van de meest rece', 
+        'nte week zijn nog niet volledig.', nan, nan])
+    return pd.DataFrame(rows, columns=range(4))
+
+def ggd_tables(n_reports=10, n_weeks=12, seed=0,
+        last_date=datetime.date(2021, 2, 21)):
+    ''' Returns the raw GGD tables of n_reports weekly rapports, the
+    last one covering the weeks up to last_date, as a list of
+    (rapport date, table) tuples. '''
+    tables = []
+    for i in range(n_reports):
+        end_date = last_date - datetime.timedelta(weeks=n_reports - 1 - i)
+        rapport_date = end_date + datetime.timedelta(days=2)
+        tables.append((rapport_date, ggd_table(n_weeks, seed + i, end_date)))
+    return tables
+
+def rapport_listing_html(pdf_name, path='/documenten'):
+    ''' Returns a page in the shape of the RIVM rapport listing, 
+    linking to the inputted pdf as the most recent rapport. '''
+    return ('<html><body><ul class="list-group">'
+        f'<a class="list-group-item icon-pijl-rechts" href="{path}/{pdf_name}">'
+        f'{pdf_name}</a></ul></body></html>').encode('utf-8')
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+def week_numbers(dates):
+    ''' Returns the ISO week numbers, formatted as by
+    isoweek.Week.isoformat (e.g. 2020W53), corresponding with the
+    inputted dates as a series aligned with the input. The week is
+    only calculated once per distinct date, and then mapped back
+    onto the rows. '''
+    dates = pd.Series(pd.to_datetime(dates))
+    codes, uniques = pd.factorize(dates)
+    iso = pd.DatetimeIndex(uniques).isocalendar()
+    labels = (iso.year.astype(str) + 'W' +
+        iso.week.astype(str).str.zfill(2)).to_numpy(dtype=object)
+    labels = np.append(labels, np.nan)
+    # factorize codes missing dates as -1, which maps to the nan above
+    return pd.Series(labels[codes], index=dates.index, name='week_number')